@@ -13,6 +13,17 @@ class ModuleDocFragment(object):
     # Standard libvirt documentation fragment
     DOCUMENTATION = r'''
 options:
+    broker_dir:
+        description:
+            - "Directory for unix sockets of ssh tunnels to remote libvirt daemons. A tunnel is started in the
+               background by the first module run which connects to a libvirt daemon via ssh, e.g. with uri
+               C(qemu+ssh://host/system), and is reused by all later module runs on the same host until it is
+               killed. This saves a ssh handshake per module run. Connections are opened directly if not set."
+            - "The directory is created with mode 0700 if it does not exist. It must be owned by the user which runs
+               the module and its permissions are reduced to 0700, because every user with access to it could take
+               over tunnels."
+        required: false
+        type: path
     uri:
         default: qemu:///system
         description:
@@ -0,0 +1,527 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# vim:set fileformat=unix shiftwidth=4 softtabstop=4 expandtab:
+# kate: end-of-line unix; space-indent on; indent-width 4; remove-trailing-spaces modified;
+
+# Copyright: (c) 2020, Jakob Meng <jakobmeng@web.de>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+from ansible.module_utils._text import to_bytes, to_text
+import hashlib
+import re
+import struct
+import zlib
+
+# Images are reproducible, i.e. all timestamps in filesystems are set to 1980-01-01 00:00:00 UTC, which is the
+# earliest date supported by FAT.
+
+# Volume label which cloud-init's NoCloud datasource searches for
+# Ref.: https://cloudinit.readthedocs.io/en/latest/reference/datasources/nocloud.html
+CONFIGDRIVE_LABEL = 'cidata'
+
+# Meta-Data written by cloud-localds if none is given
+# Ref.: https://github.com/canonical/cloud-utils/blob/main/bin/cloud-localds
+DEFAULT_METADATA = 'instance-id: iid-local01\n'
+
+# Digest of the files on a config drive is stored in the image, in a field which is not evaluated by cloud-init, so
+# that config drives can be compared to their desired content by reading a few bytes instead of the whole image.
+# For ISO 9660 images it is the application identifier of the primary volume descriptor, for FAT images it is part of
+# the boot code area of the boot sector.
+MARKER_OFFSETS = {'iso': 16 * 2048 + 574, 'vfat': 256}
+MARKER_SIZE = 128
+MARKER_PREFIX = b'JM1.LIBVIRT CIDATA SHA256:'
+
+ISO_SECTOR_SIZE = 2048
+
+# Recording date of directory records, as years since 1900, month, day, hour, minute, second and offset from GMT
+ISO_RECORD_DATE = struct.pack('7B', 80, 1, 1, 0, 0, 0, 0)
+
+# Dates of volume descriptors, as digits of year, month, day, hour, minute, second and hundredths plus offset from GMT
+ISO_VOLUME_DATE = b'1980010100000000\0'
+ISO_VOLUME_NO_DATE = b'0000000000000000\0'
+
+FAT_SECTOR_SIZE = 512
+
+# FAT12 is limited to 4084 clusters
+FAT12_MAX_CLUSTERS = 4084
+
+# cloud-localds creates vfat images with a size of 128KiB
+FAT_MIN_SECTORS = 256
+
+FAT_ROOT_ENTRIES = 64
+FAT_MEDIA_DESCRIPTOR = 0xF8
+
+# Date 1980-01-01 and time 00:00:00 as stored in FAT directory entries
+FAT_DATE = (0 << 9) | (1 << 5) | 1
+FAT_TIME = 0
+
+
+def _div_ceil(dividend, divisor):
+    return -(-dividend // divisor)
+
+
+def _pad(data, size):
+    """ Pad `data` with zeros to a multiple of `size` bytes """
+    return data + b'\0' * (-len(data) % size)
+
+
+def _both16(value):
+    """ Encode 16 bit integer in both-byte order as required by ISO 9660 """
+    return struct.pack('<H', value) + struct.pack('>H', value)
+
+
+def _both32(value):
+    """ Encode 32 bit integer in both-byte order as required by ISO 9660 """
+    return struct.pack('<I', value) + struct.pack('>I', value)
+
+
+def _iso_names(names):
+    """ Return unique ISO 9660 level 1 file identifiers, i.e. 8.3 names of d-characters, for `names` """
+    identifiers = []
+    for name in names:
+        stem, dot, ext = to_text(name).upper().rpartition('.')
+        if not dot:
+            stem, ext = ext, ''
+        stem = re.sub('[^A-Z0-9_]', '_', stem)[:8]
+        ext = re.sub('[^A-Z0-9_]', '_', ext)[:3]
+
+        identifier = '%s.%s;1' % (stem, ext)
+        counter = 0
+        while identifier in identifiers:
+            counter += 1
+            suffix = str(counter)
+            identifier = '%s%s.%s;1' % (stem[:8 - len(suffix)], suffix, ext)
+        identifiers.append(identifier)
+
+    return [to_bytes(identifier) for identifier in identifiers]
+
+
+def _joliet_names(names):
+    """ Return Joliet file identifiers, i.e. names in UCS-2 with up to 64 characters, for `names` """
+    return [to_text(name)[:64].encode('utf-16-be') for name in names]
+
+
+def _iso_directory_record(identifier, extent, size, is_directory):
+    padding = b'\0' if len(identifier) % 2 == 0 else b''
+    return b''.join([
+        struct.pack('<BB', 33 + len(identifier) + len(padding), 0),
+        _both32(extent),
+        _both32(size),
+        ISO_RECORD_DATE,
+        struct.pack('<BBB', 2 if is_directory else 0, 0, 0),
+        _both16(1),
+        struct.pack('<B', len(identifier)),
+        identifier,
+        padding])
+
+
+def _iso_directory(extent, size, files):
+    """ Return root directory with `files`, a list of (identifier, extent, size) tuples, located at `extent` and the
+        offsets of the directory records of `files` in it
+
+        Directory records must not cross sector boundaries, hence sectors are padded with zeros where necessary.
+    """
+    records = [
+        _iso_directory_record(b'\0', extent, size, True),
+        _iso_directory_record(b'\1', extent, size, True)
+    ]
+    records = [(None, record) for record in records]
+    records.extend((identifier, _iso_directory_record(identifier, file_extent, file_size, False))
+                   for identifier, file_extent, file_size in sorted(files))
+
+    directory = b''
+    offsets = {}
+    for identifier, record in records:
+        if len(directory) % ISO_SECTOR_SIZE + len(record) > ISO_SECTOR_SIZE:
+            directory = _pad(directory, ISO_SECTOR_SIZE)
+        if identifier is not None:
+            offsets[identifier] = len(directory)
+        directory += record
+    return _pad(directory, ISO_SECTOR_SIZE), offsets
+
+
+def _iso_path_table(extent, byte_order):
+    """ Return path table with root directory at `extent` as its only entry """
+    return struct.pack(byte_order + 'BBIH', 1, 0, extent, 1) + b'\0\0'
+
+
+def _iso_volume_descriptor(joliet, volume_id, volume_size, path_tables, root_record):
+    """ Return primary volume descriptor or, if `joliet` is true, Joliet's supplementary volume descriptor """
+
+    def text(value, length):
+        if joliet:
+            return (to_text(value).encode('utf-16-be') + b'\0 ' * length)[:length]
+        return (to_bytes(value) + b' ' * length)[:length]
+
+    l_path_table, m_path_table, path_table_size = path_tables
+    descriptor = b''.join([
+        struct.pack('<B', 2 if joliet else 1), b'CD001', b'\1', b'\0',
+        text('', 32),  # system identifier
+        text(volume_id, 32),
+        b'\0' * 8,
+        _both32(volume_size),
+        (b'%/E' if joliet else b'').ljust(32, b'\0'),  # escape sequences of UCS-2 Level 3
+        _both16(1),  # volume set size
+        _both16(1),  # volume sequence number
+        _both16(ISO_SECTOR_SIZE),
+        _both32(path_table_size),
+        struct.pack('<II', l_path_table, 0),
+        struct.pack('>II', m_path_table, 0),
+        root_record,
+        text('', 128),  # volume set identifier
+        text('', 128),  # publisher identifier
+        text('', 128),  # data preparer identifier
+        text('', 128),  # application identifier
+        text('', 37),  # copyright file identifier
+        text('', 37),  # abstract file identifier
+        text('', 37),  # bibliographic file identifier
+        ISO_VOLUME_DATE,  # creation date
+        ISO_VOLUME_DATE,  # modification date
+        ISO_VOLUME_NO_DATE,  # expiration date
+        ISO_VOLUME_NO_DATE,  # effective date
+        b'\1'])  # file structure version
+    return _pad(descriptor, ISO_SECTOR_SIZE)
+
+
+def _iso_image(files, volume_id):
+    """ Return ISO 9660 image like make_iso() does and its layout, i.e. the location of each file's data and size
+        fields
+    """
+    names = [name for name, data in files]
+    contents = [to_bytes(data) for name, data in files]
+    sectors = [_div_ceil(len(data), ISO_SECTOR_SIZE) for data in contents]
+
+    # system area, primary and supplementary volume descriptors, terminator and four single sector path tables
+    extent = 16 + 3 + 4
+
+    directories = []
+    for identifiers in [_iso_names(names), _joliet_names(names)]:
+        # directory size depends on length of records but not on their content
+        size = len(_iso_directory(0, 0, [(identifier, 0, 0) for identifier in identifiers])[0])
+        directories.append((identifiers, extent, size))
+        extent += size // ISO_SECTOR_SIZE
+
+    extents = []
+    for count in sectors:
+        extents.append(extent)
+        extent += count
+    volume_size = extent
+
+    image = bytearray(16 * ISO_SECTOR_SIZE)
+    for index, (identifiers, directory_extent, directory_size) in enumerate(directories):
+        root_record = _iso_directory_record(b'\0', directory_extent, directory_size, True)
+        path_tables = (19 + 2 * index, 20 + 2 * index, len(_iso_path_table(0, '<')))
+        image += _iso_volume_descriptor(index == 1, volume_id, volume_size, path_tables, root_record)
+    image += _pad(b'\xffCD001\1', ISO_SECTOR_SIZE)  # volume descriptor set terminator
+
+    for identifiers, directory_extent, directory_size in directories:
+        image += _pad(_iso_path_table(directory_extent, '<'), ISO_SECTOR_SIZE)
+        image += _pad(_iso_path_table(directory_extent, '>'), ISO_SECTOR_SIZE)
+
+    layout = dict(files=dict(
+        (name, dict(offset=file_extent * ISO_SECTOR_SIZE, capacity=count * ISO_SECTOR_SIZE, size_fields=[]))
+        for name, file_extent, count in zip(names, extents, sectors)))
+
+    for identifiers, directory_extent, directory_size in directories:
+        directory, offsets = _iso_directory(directory_extent, directory_size,
+                                            [(identifier, file_extent, len(data))
+                                             for identifier, file_extent, data in zip(identifiers, extents, contents)])
+        for name, identifier in zip(names, identifiers):
+            # data length field follows record length, extended attribute record length and location of extent
+            layout['files'][name]['size_fields'].append(len(image) + offsets[identifier] + 10)
+        image += directory
+
+    for data in contents:
+        image += _pad(data, ISO_SECTOR_SIZE)
+
+    return bytes(image), layout
+
+
+def make_iso(files, volume_id=CONFIGDRIVE_LABEL):
+    """ Return ISO 9660 image with Joliet extension which contains `files`, a list of (name, data) tuples, in its root
+        directory
+
+        Files are listed with 8.3 names in the primary directory and with their full names in the Joliet directory,
+        both refer to the same file data. Rock Ridge extensions are not written.
+    """
+    return _iso_image(files, volume_id)[0]
+
+
+def _fat_short_names(names):
+    """ Return unique 8.3 names, as stored in FAT directory entries, for long file names `names` """
+    short_names = []
+    for name in names:
+        stem, dot, ext = to_text(name).upper().rpartition('.')
+        if not dot:
+            stem, ext = ext, ''
+        stem = re.sub('[^A-Z0-9_~!#$%&\'(){}^@`-]', '_', stem.replace(' ', '').lstrip('.'))
+        ext = re.sub('[^A-Z0-9_~!#$%&\'(){}^@`-]', '_', ext.replace(' ', ''))[:3]
+
+        counter = 1
+        while True:
+            suffix = '~%d' % counter
+            short_name = to_bytes(stem[:8 - len(suffix)] + suffix).ljust(8) + to_bytes(ext).ljust(3)
+            if short_name not in short_names:
+                break
+            counter += 1
+        short_names.append(short_name)
+    return short_names
+
+
+def _fat_checksum(short_name):
+    """ Return checksum of 8.3 name `short_name` which links long file name entries to their short entry """
+    checksum = 0
+    for char in bytearray(short_name):
+        checksum = (((checksum & 1) << 7) + (checksum >> 1) + char) & 0xFF
+    return checksum
+
+
+def _fat_long_name_entries(name, short_name):
+    """ Return VFAT long file name entries for `name`, ordered as they are stored in front of the short entry """
+    chars = to_text(name).encode('utf-16-le')
+    if len(chars) % 26:
+        chars += b'\0\0'
+        chars += b'\xff' * (-len(chars) % 26)
+
+    checksum = _fat_checksum(short_name)
+    count = len(chars) // 26
+    entries = []
+    for index in range(count):
+        part = chars[index * 26:(index + 1) * 26]
+        sequence = index + 1
+        if sequence == count:
+            sequence |= 0x40  # last long file name entry
+        entries.append(b''.join([
+            struct.pack('<B', sequence),
+            part[0:10],
+            struct.pack('<BBB', 0x0F, 0, checksum),
+            part[10:22],
+            struct.pack('<H', 0),
+            part[22:26]]))
+    return list(reversed(entries))
+
+
+def _fat_entry(short_name, attributes, cluster, size):
+    return b''.join([
+        short_name,
+        struct.pack('<BBB', attributes, 0, 0),
+        struct.pack('<HHH', FAT_TIME, FAT_DATE, FAT_DATE),  # creation time and date, access date
+        struct.pack('<H', 0),  # high word of cluster
+        struct.pack('<HH', FAT_TIME, FAT_DATE),  # modification time and date
+        struct.pack('<HI', cluster, size)])
+
+
+def _fat12_table(chains, clusters):
+    """ Return a file allocation table for `clusters` clusters with `chains`, a list of (first, count) tuples """
+    values = [0] * (clusters + 2)
+    values[0] = 0xF00 | FAT_MEDIA_DESCRIPTOR
+    values[1] = 0xFFF
+    for first, count in chains:
+        for cluster in range(first, first + count):
+            values[cluster] = cluster + 1 if cluster < first + count - 1 else 0xFFF
+
+    if len(values) % 2:
+        values.append(0)
+
+    table = bytearray()
+    for low, high in zip(values[0::2], values[1::2]):
+        table.extend(struct.pack('<I', low | (high << 12))[:3])
+    return bytes(table)
+
+
+def _vfat_image(files, volume_label):
+    """ Return FAT12 image like make_vfat() does and its layout, i.e. the location of each file's data, size field and
+        clusters as well as the location of the file allocation tables
+    """
+    names = [name for name, data in files]
+    contents = [to_bytes(data) for name, data in files]
+    label = to_bytes(volume_label.upper())[:11].ljust(11)
+
+    short_names = _fat_short_names(names)
+    long_name_entries = [_fat_long_name_entries(name, short_name) for name, short_name in zip(names, short_names)]
+
+    # volume label plus long file name entries and short entry of each file
+    entry_count = 1 + sum(len(entries) + 1 for entries in long_name_entries)
+    root_entries = max(FAT_ROOT_ENTRIES, entry_count + (-entry_count % 16))
+    root_sectors = root_entries * 32 // FAT_SECTOR_SIZE
+
+    cluster_sectors = 1
+    while True:
+        cluster_size = cluster_sectors * FAT_SECTOR_SIZE
+        counts = [_div_ceil(len(data), cluster_size) for data in contents]
+        clusters = sum(counts)
+        if clusters <= FAT12_MAX_CLUSTERS:
+            break
+        if cluster_sectors == 128:
+            raise ValueError('files are too large for a FAT12 filesystem')
+        cluster_sectors *= 2
+
+    # grow data area until image has its minimum size
+    while True:
+        fat_sectors = _div_ceil(_div_ceil((clusters + 2) * 3, 2), FAT_SECTOR_SIZE)
+        total_sectors = 1 + 2 * fat_sectors + root_sectors + clusters * cluster_sectors
+        if total_sectors >= FAT_MIN_SECTORS or clusters >= FAT12_MAX_CLUSTERS:
+            break
+        clusters = min(FAT12_MAX_CLUSTERS, clusters + _div_ceil(FAT_MIN_SECTORS - total_sectors, cluster_sectors))
+
+    cluster_size = cluster_sectors * FAT_SECTOR_SIZE
+    root_offset = (1 + 2 * fat_sectors) * FAT_SECTOR_SIZE
+    data_offset = root_offset + root_sectors * FAT_SECTOR_SIZE
+    layout = dict(
+        files={},
+        fat=dict(offsets=[FAT_SECTOR_SIZE, (1 + fat_sectors) * FAT_SECTOR_SIZE], clusters=clusters,
+                 cluster_size=cluster_size))
+
+    entries = [_fat_entry(label, 0x08, 0, 0)]  # volume label
+    chains = []
+    cluster = 2
+    for name, short_name, long_names, data, count in zip(names, short_names, long_name_entries, contents, counts):
+        chains.append((cluster, count))
+        entries.extend(long_names)
+        layout['files'][name] = dict(
+            offset=data_offset + (cluster - 2) * cluster_size,
+            capacity=count * cluster_size,
+            entry=root_offset + len(entries) * 32,
+            cluster=cluster)
+        entries.append(_fat_entry(short_name, 0x20, cluster if count else 0, len(data)))
+        cluster += count
+
+    # volume serial number is derived from content to keep images reproducible
+    serial = zlib.crc32(b''.join(short_names + contents)) & 0xFFFFFFFF
+
+    boot_sector = b''.join([
+        b'\xeb\x3c\x90',  # jump over parameter block
+        b'mkfs.fat',
+        struct.pack('<HBHBH', FAT_SECTOR_SIZE, cluster_sectors, 1, 2, root_entries),
+        struct.pack('<HBH', total_sectors if total_sectors < 0x10000 else 0, FAT_MEDIA_DESCRIPTOR, fat_sectors),
+        struct.pack('<HHII', 32, 2, 0, total_sectors if total_sectors >= 0x10000 else 0),
+        struct.pack('<BBBI', 0x80, 0, 0x29, serial),
+        label,
+        b'FAT12   '])
+    boot_sector += b'\xcd\x18'  # boot code which returns to the BIOS, i.e. int 18h
+    boot_sector = boot_sector.ljust(FAT_SECTOR_SIZE - 2, b'\0') + b'\x55\xaa'
+
+    fat = _pad(_fat12_table(chains, clusters), FAT_SECTOR_SIZE)
+    root = b''.join(entries).ljust(root_sectors * FAT_SECTOR_SIZE, b'\0')
+
+    image = bytearray(boot_sector)
+    image += fat
+    image += fat
+    image += root
+    for data in contents:
+        image += _pad(data, cluster_size)
+    image += b'\0' * (total_sectors * FAT_SECTOR_SIZE - len(image))
+
+    return bytes(image), layout
+
+
+def make_vfat(files, volume_label=CONFIGDRIVE_LABEL):
+    """ Return FAT12 image with long file names which contains `files`, a list of (name, data) tuples, in its root
+        directory
+    """
+    return _vfat_image(files, volume_label)[0]
+
+
+class ConfigDriveTemplate(object):
+    """ Config drive image with a fixed layout, from which images with other file contents are made by patching file
+        data, sizes and allocation tables into a copy of it, instead of building a new filesystem for each image
+
+        Each file is allotted `capacity` bytes, rounded up to whole sectors or clusters, where `capacities` is a list
+        of (name, capacity) tuples.
+    """
+
+    def __init__(self, filesystem, capacities):
+        files = [(name, b'\0' * capacity) for name, capacity in capacities]
+        if filesystem == 'iso':
+            self.image, self.layout = _iso_image(files, CONFIGDRIVE_LABEL)
+        elif filesystem == 'vfat':
+            self.image, self.layout = _vfat_image(files, CONFIGDRIVE_LABEL)
+        else:
+            raise ValueError("filesystem '%s' is not supported, use either iso or vfat" % filesystem)
+        self.filesystem = filesystem
+
+    def render(self, files):
+        """ Return image which contains `files`, a list of (name, data) tuples with the same names as the template """
+        if sorted(name for name, data in files) != sorted(self.layout['files']):
+            raise ValueError('files %s do not match files %s of config drive template' %
+                             (', '.join(name for name, data in files), ', '.join(self.layout['files'])))
+
+        image = bytearray(self.image)
+        chains = []
+        for name, data in files:
+            data = to_bytes(data)
+            location = self.layout['files'][name]
+            if len(data) > location['capacity']:
+                raise ValueError('file %s with %d bytes exceeds its capacity of %d bytes in config drive template' %
+                                 (name, len(data), location['capacity']))
+
+            # file data of template is zeroed, hence bytes behind data do not have to be cleared
+            image[location['offset']:location['offset'] + len(data)] = data
+
+            if self.filesystem == 'iso':
+                for offset in location['size_fields']:
+                    image[offset:offset + 8] = _both32(len(data))
+            else:  # vfat
+                count = _div_ceil(len(data), self.layout['fat']['cluster_size'])
+                chains.append((location['cluster'], count))
+                image[location['entry'] + 26:location['entry'] + 32] = struct.pack(
+                    '<HI', location['cluster'] if count else 0, len(data))
+
+        if self.filesystem == 'vfat':
+            # release clusters which are allotted to files but not used by their data
+            fat = _fat12_table(chains, self.layout['fat']['clusters'])
+            for offset in self.layout['fat']['offsets']:
+                image[offset:offset + len(fat)] = fat
+
+        _write_marker(image, self.filesystem, configdrive_marker(self.filesystem, files))
+        return bytes(image)
+
+
+def configdrive_files(metadata, userdata, networkconfig):
+    """ Return list of (name, data) tuples of files on a config drive, the same files as created by cloud-localds """
+    files = [
+        ('meta-data', to_bytes(metadata or DEFAULT_METADATA)),
+        ('user-data', to_bytes(userdata))
+    ]
+    if networkconfig:
+        files.append(('network-config', to_bytes(networkconfig)))
+    return files
+
+
+def configdrive_marker(filesystem, files):
+    """ Return marker with digest of `filesystem` and `files`, a list of (name, data) tuples, as stored in images """
+    digest = hashlib.sha256(to_bytes(filesystem))
+    for name, data in sorted(files):
+        for value in [name, data]:
+            value = to_bytes(value)
+            digest.update(to_bytes('\0%d\0' % len(value)))
+            digest.update(value)
+
+    # ISO 9660 allows a-characters only, i.e. no lower case letters
+    return (MARKER_PREFIX + to_bytes(digest.hexdigest().upper())).ljust(MARKER_SIZE)
+
+
+def _write_marker(image, filesystem, marker):
+    image[MARKER_OFFSETS[filesystem]:MARKER_OFFSETS[filesystem] + MARKER_SIZE] = marker
+
+
+def make_configdrive(filesystem, metadata, userdata, networkconfig):
+    """ Return image of a cloud-init config drive for the NoCloud datasource, with the same files as created by
+        cloud-localds and a marker with their digest
+
+        Argument `filesystem` is either 'iso' for ISO 9660 or 'vfat' for FAT.
+    """
+    files = configdrive_files(metadata, userdata, networkconfig)
+
+    if filesystem == 'iso':
+        image = bytearray(make_iso(files))
+    elif filesystem == 'vfat':
+        image = bytearray(make_vfat(files))
+    else:
+        raise ValueError("filesystem '%s' is not supported, use either iso or vfat" % filesystem)
+
+    _write_marker(image, filesystem, configdrive_marker(filesystem, files))
+    return bytes(image)
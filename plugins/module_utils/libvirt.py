@@ -10,10 +10,23 @@
 from __future__ import absolute_import, division, print_function
 __metaclass__ = type
 
-from ansible.module_utils._text import to_native
+from ansible.module_utils._text import to_bytes, to_native
 from ansible.module_utils.basic import missing_required_lib
 from ansible.module_utils.six import iteritems
+from ansible.module_utils.six.moves.urllib.parse import parse_qs, urlsplit
+import atexit
 import copy
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import random
+import socket
+import stat
+import subprocess
+import threading
+import time
 import traceback
 
 try:
@@ -26,6 +39,16 @@ else:
     LIBVIRT_IMPORT_ERROR = None
     HAS_LIBVIRT = True
 
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    # Error handled in the calling module.
+    FUTURES_IMPORT_ERROR = traceback.format_exc()
+    HAS_FUTURES = False
+else:
+    FUTURES_IMPORT_ERROR = None
+    HAS_FUTURES = True
+
 try:
     from lxml import etree, objectify
 except ImportError:
@@ -37,16 +60,404 @@ else:
     HAS_LXML = True
 
 
+# Size of data chunks sent to libvirt streams, e.g. when uploading images to storage volumes
+STREAM_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def list_params(module, list_key, keys):
+    """ Return parameters for each item of list option `list_key` or for the module itself if `list_key` is not set.
+
+        Options in `keys` which are not set for an item default to the module options with the same name.
+    """
+    if module.params[list_key] is None:
+        return [dict((key, module.params[key]) for key in keys)]
+
+    return [
+        dict((key, item[key] if item.get(key) is not None else module.params[key]) for key in keys)
+        for item in module.params[list_key]
+    ]
+
+
+def map_parallel(func, items, max_workers):
+    """ Return list of results of `func` applied to each of `items`, with up to `max_workers` calls running in parallel.
+
+        The first exception raised by `func` is reraised after all calls have finished.
+    """
+    if max_workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        futures = [executor.submit(func, item) for item in items]
+    return [future.result() for future in futures]
+
+
+def map_items(func, items, max_workers):
+    """ Like map_parallel(), but an exception raised by `func` is returned as result dict(failed=True, msg=...) of its
+        item instead of being reraised, so that results of other items, e.g. volumes which have been created already,
+        are reported as well. Pass results to fail_items() to fail the module run if any item failed.
+    """
+    def call(item):
+        try:
+            return func(item)
+        except Exception as e:
+            return dict(failed=True, msg=to_native(e))
+
+    return map_parallel(call, items, max_workers)
+
+
+def fail_items(result, key):
+    """ Mark module result `result` as failed if any item in list or dict result[key] failed, see map_items() """
+    items = result[key]
+    failed = [(index, item) for index, item in (iteritems(items) if isinstance(items, dict) else enumerate(items))
+              if item.get('failed')]
+    if failed:
+        result['failed'] = True
+        result['msg'] = '%d of %d items of %s failed: %s' % (
+            len(failed), len(result[key]), key, '; '.join('item %s: %s' % (index, item['msg']) for index, item in failed))
+    return result
+
+
+def wait_for(func, timeout, what, delay=0.05, max_delay=1.0):
+    """ Call `func` until it returns a true value and return that value.
+
+        Delays between calls start at `delay` seconds and double up to `max_delay` seconds. An exception is raised if
+        `func` did not succeed within `timeout` seconds.
+    """
+    deadline = time.time() + timeout
+    while True:
+        result = func()
+        if result:
+            return result
+
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise Exception('%s did not happen within %s seconds' % (what, timeout))
+
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
+
+
+def run_command(module, cmd):
+    """ Run command `cmd` with module.run_command() and raise an exception if it fails
+
+        Unlike check_rc=True, which calls module.fail_json(), this reports errors of commands run in detached workers.
+    """
+    rc, stdout, stderr = module.run_command(cmd)
+    if rc != 0:
+        raise Exception('command %s failed with exit code %d: %s' % (cmd, rc, stderr or stdout))
+    return stdout, stderr
+
+
 def try_import(module):
     if not HAS_LIBVIRT:
         module.fail_json(msg=missing_required_lib("libvirt"), exception=LIBVIRT_IMPORT_ERROR)
 
+    if module.params.get('max_workers', 1) > 1 and not HAS_FUTURES:
+        module.fail_json(msg=missing_required_lib("futures"), exception=FUTURES_IMPORT_ERROR)
+
     if not HAS_LXML:
         module.fail_json(msg=missing_required_lib("lxml"), exception=LXML_IMPORT_ERROR)
 
 
+def _unix_socket_alive(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except (IOError, OSError):
+        return False
+    finally:
+        sock.close()
+
+
+def _owned_unix_socket(path):
+    """ Return True if `path` is a unix socket which is owned by the current user """
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISSOCK(st.st_mode) and st.st_uid == os.geteuid()
+
+
+def _make_private_dir(path):
+    """ Create directory `path` with mode 0700 unless it exists and ensure that no other user can access it """
+    try:
+        os.makedirs(path, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.geteuid():
+        raise Exception('%s is not a directory owned by the current user' % path)
+
+    if stat.S_IMODE(st.st_mode) & 0o077:
+        # other users could plant sockets or locks in it
+        os.chmod(path, 0o700)
+
+
+def broker_uri(uri, broker_dir, timeout=30):
+    """ Return an uri which connects to the libvirt daemon at `uri` through a ssh tunnel to its unix socket.
+
+        The tunnel is a ssh process in the background which is reused by all later module runs on this host, so that
+        only the first connection to a remote libvirt daemon pays for the ssh handshake. Uris without ssh transport
+        are returned unchanged.
+    """
+    parts = urlsplit(uri)
+    driver, _, transport = parts.scheme.partition('+')
+    if transport != 'ssh' or not parts.hostname:
+        return uri
+
+    query = parse_qs(parts.query)
+    if 'socket' in query:
+        remote_socket = query['socket'][0]
+    elif parts.path == '/system':
+        remote_socket = '/var/run/libvirt/libvirt-sock'
+    else:
+        # socket path of e.g. session daemons is not known in advance
+        return uri
+
+    _make_private_dir(broker_dir)
+
+    # keep socket path short because unix socket paths are limited to 108 chars
+    key = hashlib.sha256(to_bytes(uri)).hexdigest()[:16]
+    socket_path = os.path.join(broker_dir, key + '.sock')
+    tunnel_uri = '%s+unix://%s?socket=%s' % (driver, parts.path, socket_path)
+
+    with open(socket_path + '.lock', 'a') as lock:
+        # prevent concurrent module runs from spawning multiple tunnels
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        # sockets of other users are replaced by ssh because of StreamLocalBindUnlink
+        if _owned_unix_socket(socket_path) and _unix_socket_alive(socket_path):
+            return tunnel_uri
+
+        cmd = [query.get('command', ['ssh'])[0],
+               '-N',
+               '-o', 'BatchMode=yes',
+               '-o', 'ExitOnForwardFailure=yes',
+               '-o', 'ServerAliveInterval=30',
+               '-o', 'StreamLocalBindUnlink=yes',
+               '-L', '%s:%s' % (socket_path, remote_socket)]
+        if parts.port:
+            cmd.extend(['-p', str(parts.port)])
+        if parts.username:
+            cmd.extend(['-l', parts.username])
+        if 'keyfile' in query:
+            cmd.extend(['-i', query['keyfile'][0]])
+        if query.get('no_verify', ['0'])[0] == '1':
+            cmd.extend(['-o', 'StrictHostKeyChecking=no'])
+        cmd.append(parts.hostname)
+
+        with open(os.devnull, 'r+b') as devnull:
+            # detach ssh from module process, it has to outlive the current module run
+            process = subprocess.Popen(cmd, stdin=devnull, stdout=devnull, stderr=devnull,
+                                       close_fds=True, preexec_fn=os.setsid)
+
+        deadline = time.time() + timeout
+        while not _unix_socket_alive(socket_path):
+            if process.poll() is not None:
+                raise Exception('ssh tunnel to %s exited with code %s' % (parts.hostname, process.returncode))
+            if time.time() > deadline:
+                process.kill()
+                raise Exception('ssh tunnel to %s did not come up within %s seconds' % (parts.hostname, timeout))
+            time.sleep(0.1)
+
+    return tunnel_uri
+
+
+class Job(object):
+    """ Status file of a module run which continues in a detached worker process
+
+        The file is compatible with Ansible's async_status module: While the job is running, it contains keys 'started'
+        and 'finished' and the progress of each item, e.g. each volume. When the job is done, it is replaced by the
+        module result.
+    """
+
+    def __init__(self, path, job_id):
+        self.path = path
+        self.id = job_id
+        self.started = time.time()
+        self.updated = 0
+        self.items = {}
+        self.lock = threading.Lock()
+
+    def status(self):
+        elapsed = time.time() - self.started
+        bytes_done = sum(item['bytes_done'] for item in self.items.values())
+        return dict(
+            ansible_job_id=self.id,
+            results_file=self.path,
+            elapsed=round(elapsed, 1),
+            bytes_done=bytes_done,
+            throughput=int(bytes_done / elapsed) if elapsed > 0 else 0,
+            progress=dict(self.items))
+
+    def write(self, data):
+        # replace status file atomically, readers must never see a partially written file
+        partial_path = self.path + '.part'
+        with open(partial_path, 'w') as f:
+            json.dump(data, f)
+        os.rename(partial_path, self.path)
+
+    def start(self):
+        with self.lock:
+            self.write(dict(self.status(), started=1, finished=0))
+
+    def progress(self, name, bytes_done, bytes_total=None):
+        """ Record that `bytes_done` of `bytes_total` bytes of item `name` have been processed
+
+            The status file is rewritten at most once per second.
+        """
+        with self.lock:
+            self.items[name] = dict(bytes_done=bytes_done, bytes_total=bytes_total)
+
+            now = time.time()
+            if now - self.updated < 1:
+                return
+            self.updated = now
+            self.write(dict(self.status(), started=1, finished=0))
+
+    def finish(self, result):
+        with self.lock:
+            self.write(dict(self.status(), **result))
+
+    def fail(self, msg, exception):
+        with self.lock:
+            self.write(dict(self.status(), failed=True, msg=msg, exception=exception))
+
+
+def run_detached(module, func):
+    """ Run `func(module, job)` in a detached worker process and return the initial status of its Job
+
+        The worker outlives the module run and writes the return value of `func` to the status file of the job in
+        Ansible's async directory, where it can be polled with module async_status.
+    """
+    job_id = '%d.%d' % (random.randint(0, 999999999999), os.getpid())
+    job_dir = os.path.expanduser(os.environ.get('ANSIBLE_ASYNC_DIR', '~/.ansible_async'))
+    try:
+        os.makedirs(job_dir)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+    job = Job(os.path.join(job_dir, job_id), job_id)
+    job.start()
+
+    pid = os.fork()
+    if pid:
+        # intermediate child exits as soon as the worker has been forked
+        os.waitpid(pid, 0)
+        return dict(changed=False, started=1, finished=0, ansible_job_id=job.id, results_file=job.path)
+
+    try:
+        # detach worker from session of module process, it has to outlive the current module run
+        os.setsid()
+        if os.fork():
+            os._exit(0)
+
+        with open(os.devnull, 'r+b') as devnull:
+            for fd in [0, 1, 2]:
+                os.dup2(devnull.fileno(), fd)
+
+        if HAS_LIBVIRT and HAS_LXML:
+            connection_pool.reset()
+
+        try:
+            job.finish(func(module, job))
+        except SystemExit as e:
+            # e.g. from module.fail_json(), whose output is lost because the worker is detached from the module run
+            job.fail('detached worker exited with status %s' % e.code, traceback.format_exc())
+        except BaseException as e:
+            job.fail(to_native(e) or e.__class__.__name__, traceback.format_exc())
+        finally:
+            if HAS_LIBVIRT and HAS_LXML:
+                connection_pool.close()
+    finally:
+        # never return to the module code of the parent process, e.g. to its exit_json() call
+        os._exit(0)
+
+
 if HAS_LIBVIRT and HAS_LXML:
 
+    class ConnectionPool(object):
+        """ Open connections to libvirt daemons and reuse them while they are alive """
+
+        def __init__(self):
+            self.connections = {}
+            self.inventories = {}
+            self.inherited = []
+            self.lock = threading.Lock()
+            self.uri_locks = {}
+
+        def get(self, uri):
+            # connections to different uris are opened in parallel, e.g. by threads which connect to several hosts
+            with self.lock:
+                uri_lock = self.uri_locks.setdefault(uri, threading.Lock())
+
+            with uri_lock:
+                with self.lock:
+                    conn = self.connections.get(uri)
+
+                if conn:
+                    try:
+                        alive = conn.isAlive()
+                    except libvirt.libvirtError:
+                        alive = False
+
+                    if alive:
+                        return conn
+
+                    with self.lock:
+                        del self.connections[uri]
+                        self.inventories.pop(uri).close()
+                    try:
+                        conn.close()
+                    except libvirt.libvirtError:
+                        pass
+
+                conn = libvirt.open(uri)
+                if not conn:
+                    raise Exception("hypervisor connection failure")
+
+                with self.lock:
+                    self.connections[uri] = conn
+                    self.inventories[uri] = Inventory(conn)
+                return conn
+
+        def inventory(self, uri):
+            with self.lock:
+                return self.inventories[uri]
+
+        def reset(self):
+            """ Forget connections inherited from a parent process without closing them
+
+                Connections share their sockets with the parent process, closing them in a forked child would break
+                the parent's connections. References are kept because libvirt closes connections when they are freed.
+            """
+            self.lock = threading.Lock()
+            self.uri_locks = {}
+            self.inherited.extend(self.connections.values())
+            self.connections = {}
+            self.inventories = {}
+
+        def close(self):
+            with self.lock:
+                for inventory in self.inventories.values():
+                    inventory.close()
+                self.inventories.clear()
+
+                for conn in self.connections.values():
+                    try:
+                        conn.close()
+                    except libvirt.libvirtError:
+                        pass
+                self.connections.clear()
+
+    # Connections are shared by all Connection objects of a module run and closed when the module exits
+    connection_pool = ConnectionPool()
+    atexit.register(connection_pool.close)
+
     class Connection(object):
 
         def __init__(self, uri, module):
@@ -54,27 +465,474 @@ if HAS_LIBVIRT and HAS_LXML:
             self.module = module
 
         def __enter__(self):
-            conn = libvirt.open(self.uri)
-            if not conn:
-                raise Exception("hypervisor connection failure")
-            self.conn = conn
-            return self
+            broker_dir = self.module.params.get('broker_dir') if self.module else None
+            if broker_dir:
+                try:
+                    return self.connect(broker_uri(self.uri, broker_dir))
+                except Exception as e:
+                    # fall back to a direct connection if tunnel is not available
+                    self.module.warn('Connecting to %s through broker failed: %s' % (self.uri, to_native(e)))
+
+            return self.connect(self.uri)
 
         def __exit__(self, exc_type, exc_value, traceback):
-            self.conn.close()
+            # connection is kept open for reuse and closed when the module exits
+            pass
+
+        def connect(self, uri):
+            self.conn = connection_pool.get(uri)
+            self.inventory = connection_pool.inventory(uri)
+            return self
 
         # provide access to methods and variables of virConnect object
         def __getattr__(self, name):
             return getattr(self.conn, name)
 
-    def lookup_attribute(entry, xpath, attribute):
-        xml = etree.fromstring(entry.XMLDesc(0))
+    class Inventory(object):
+        """ Read-through cache of storage pools, storage volumes, networks and domains of a libvirt connection
+
+            Objects are looked up by name or uuid on first access and served from memory afterwards. Objects are
+            listed in bulk only if all of them are requested with entries(), index() or volumes_of(), e.g. for
+            inventory queries or before many objects are looked up, because a single lookup is much cheaper than
+            listing a storage pool with thousands of volumes. Once storage pools, networks or domains have been
+            listed, lookups of objects which are not listed do not query libvirt anymore. XML descriptions and infos
+            are fetched once per object. Objects which are changed or deleted have to be passed to invalidate() or,
+            if they have been defined or undefined through this connection, to defined() or undefined().
+        """
+
+        # kind: (list all objects, lookup by name, lookup by uuid, error code if object does not exist)
+        KINDS = {
+            'pool': ('listAllStoragePools', 'storagePoolLookupByName', 'storagePoolLookupByUUIDString',
+                     libvirt.VIR_ERR_NO_STORAGE_POOL),
+            'network': ('listAllNetworks', 'networkLookupByName', 'networkLookupByUUIDString',
+                        libvirt.VIR_ERR_NO_NETWORK),
+            'domain': ('listAllDomains', 'lookupByName', 'lookupByUUIDString',
+                       libvirt.VIR_ERR_NO_DOMAIN),
+        }
+
+        def __init__(self, conn):
+            self.conn = conn
+            self.lock = threading.RLock()
+            self.invalidate()
+
+        def pool(self, name=None, uuid=None):
+            """ Return storage pool with uuid or else name or None if it does not exist """
+            return self.lookup('pool', name, uuid)
+
+        def network(self, name=None, uuid=None):
+            """ Return network with uuid or else name or None if it does not exist """
+            return self.lookup('network', name, uuid)
+
+        def domain(self, name=None, uuid=None):
+            """ Return domain with uuid or else name or None if it does not exist """
+            return self.lookup('domain', name, uuid)
+
+        def volume(self, pool, name):
+            """ Return storage volume `name` in storage pool `pool` or None if it does not exist """
+            with self.lock:
+                index = self.volumes.setdefault(pool.name(), {})
+                volume = index.get(name)
+                if not volume:
+                    volume = lookup_volume_by_name(pool, name)
+                    if volume:
+                        index[name] = volume
+                return volume
+
+        def entries(self, kind):
+            """ Return list of all storage pools, networks or domains for `kind` 'pool', 'network' or 'domain' """
+            with self.lock:
+                return list(self.index(kind).values())
+
+        def volumes_of(self, pool):
+            """ Return list of all storage volumes in storage pool `pool` """
+            with self.lock:
+                index = self.volumes.setdefault(pool.name(), {})
+                if ('volume', pool.name()) not in self.listed:
+                    index.update((volume.name(), volume) for volume in pool.listAllVolumes(0))
+                    self.listed.add(('volume', pool.name()))
+                return list(index.values())
+
+        def index(self, kind):
+            """ Return dict of names to all storage pools, networks or domains for `kind`, listing them only once """
+            with self.lock:
+                index = self.indexes.setdefault(kind, {})
+                if kind not in self.listed:
+                    list_all = self.KINDS[kind][0]
+                    index.update((entry.name(), entry) for entry in getattr(self.conn, list_all)(0))
+                    self.listed.add(kind)
+                return index
+
+        def lookup(self, kind, name, uuid):
+            lookup_by_name, lookup_by_uuid, error_code = self.KINDS[kind][1:]
+            with self.lock:
+                index = self.indexes.setdefault(kind, {})
+
+                if uuid:
+                    entry = next((entry for entry in index.values() if entry.UUIDString() == uuid), None)
+                else:
+                    entry = index.get(name)
+
+                if entry:
+                    return entry
+
+                if kind in self.listed:
+                    # all objects have been listed already
+                    return None
+
+                try:
+                    if uuid:
+                        entry = getattr(self.conn, lookup_by_uuid)(uuid)
+                    else:
+                        entry = getattr(self.conn, lookup_by_name)(name)
+                except libvirt.libvirtError as e:
+                    if e.get_error_code() != error_code:
+                        raise
+                    return None
+
+                index[entry.name()] = entry
+                return entry
+
+        def xml_desc(self, entry, flags=0):
+            """ Return XMLDesc(flags) of a storage pool, storage volume, network or domain """
+            return self.memoize(entry, ('xml', flags), lambda: entry.XMLDesc(flags))
+
+        def info(self, entry):
+            """ Return info() of a storage pool, storage volume or domain """
+            return self.memoize(entry, ('info',), entry.info)
+
+        def memoize(self, entry, what, func):
+            key = self.key(entry) + what
+            with self.lock:
+                if key not in self.cache:
+                    self.cache[key] = func()
+                return self.cache[key]
+
+        @staticmethod
+        def key(entry):
+            if isinstance(entry, libvirt.virStorageVol):
+                return ('volume', entry.key())
+            elif isinstance(entry, libvirt.virStoragePool):
+                return ('pool', entry.name())
+            elif isinstance(entry, libvirt.virNetwork):
+                return ('network', entry.name())
+            elif isinstance(entry, libvirt.virDomain):
+                return ('domain', entry.name())
+            raise TypeError('unsupported libvirt object %r' % entry)
+
+        def invalidate(self, entry=None):
+            """ Forget an object or, if entry is None, everything after it has been changed or deleted """
+            with self.lock:
+                if entry is None:
+                    self.indexes = {}
+                    self.volumes = {}
+                    self.listed = set()
+                    self.cache = {}
+                    return
+
+                kind, key = self.key(entry)
+                if kind == 'volume':
+                    for index in self.volumes.values():
+                        index.pop(entry.name(), None)
+                else:
+                    self.indexes.get(kind, {}).pop(key, None)
+                    self.listed.discard(kind)
+                    if kind == 'pool':
+                        self.volumes.pop(key, None)
+                        self.listed.discard(('volume', key))
+
+                self.cache = dict((k, v) for k, v in iteritems(self.cache) if k[:2] != (kind, key))
+
+        def defined(self, entry):
+            """ Forget cached config of storage pool, network or domain `entry` after it has been defined or redefined
+                through this connection, keeping lists of objects intact
+            """
+            with self.lock:
+                self.undefined(entry)
+                kind, key = self.key(entry)
+                self.indexes.setdefault(kind, {})[entry.name()] = entry
+
+        def undefined(self, entry):
+            """ Forget storage pool, network or domain `entry` after it has been undefined through this connection,
+                keeping lists of objects intact
+            """
+            with self.lock:
+                kind, key = self.key(entry)
+                index = self.indexes.setdefault(kind, {})
+
+                # forget entry by uuid as well because it might have been renamed
+                uuid = entry.UUIDString()
+                names = set([key] + [name for name, other in iteritems(index) if other.UUIDString() == uuid])
+
+                for name in names:
+                    index.pop(name, None)
+                    if kind == 'pool':
+                        self.volumes.pop(name, None)
+                        self.listed.discard(('volume', name))
+
+                self.cache = dict((k, v) for k, v in iteritems(self.cache) if not (k[0] == kind and k[1] in names))
+
+        def close(self):
+            self.invalidate()
+
+    def lookup_pool_by_name(conn, name):
+        """ Return storage pool `name` or None if it does not exist """
+        try:
+            return conn.storagePoolLookupByName(name)
+        except libvirt.libvirtError as e:
+            if e.get_error_code() != libvirt.VIR_ERR_NO_STORAGE_POOL:
+                raise
+        return None
+
+    def lookup_volume_by_name(pool, name):
+        """ Return storage volume `name` in storage pool `pool` or None if it does not exist """
+        try:
+            return pool.storageVolLookupByName(name)
+        except libvirt.libvirtError as e:
+            if e.get_error_code() != libvirt.VIR_ERR_NO_STORAGE_VOL:
+                raise
+        return None
+
+    def watch_volume_allocation(pool, name, progress, interval=1):
+        """ Pass allocation of volume `name` in `pool`, which is being built e.g. by createXMLFrom, to `progress`
+            every `interval` seconds until the returned event is set
+        """
+        done = threading.Event()
+
+        def watch():
+            while not done.wait(interval):
+                try:
+                    volume = lookup_volume_by_name(pool, name)
+                    if volume:
+                        progress(volume.info()[2])
+                except libvirt.libvirtError:
+                    # volume might be unavailable while it is being built
+                    pass
+
+        thread = threading.Thread(target=watch)
+        thread.daemon = True
+        thread.start()
+        return done
+
+    def lookup_domain_by_name(conn, name):
+        """ Return domain `name` or None if it does not exist """
         try:
-            value = xml.xpath(xpath)[0].get(attribute)
+            return conn.lookupByName(name)
+        except libvirt.libvirtError as e:
+            if e.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN:
+                raise
+        return None
+
+    # Compiled XPath expressions by expression, shared by all documents of a module run
+    compiled_xpaths = {}
+
+    def compile_xpath(xpath):
+        """ Return etree.XPath evaluator for XPath expression `xpath`, which is compiled once per module run """
+        evaluator = compiled_xpaths.get(xpath)
+        if evaluator is None:
+            try:
+                evaluator = etree.XPath(xpath)
+            except etree.XPathSyntaxError as e:
+                raise ValueError("XPath expression '%s' is invalid: %s" % (xpath, to_native(e)))
+            compiled_xpaths[xpath] = evaluator
+        return evaluator
+
+    def validate_xpaths(xpaths):
+        """ Compile XPath expressions in `xpaths` and check that they select XML nodes, e.g. for ignore lists """
+        dummy = etree.Element('dummy')
+        for xpath in xpaths:
+            if not isinstance(compile_xpath(xpath)(dummy), list):
+                raise ValueError(
+                    "XPath expression '%s' is not supported, it must be point to XML node(s)" % xpath)
+
+    def select_nodes(xml_root, xpath):
+        """ Return XML nodes of `xml_root` which match XPath expression `xpath` """
+        nodes = compile_xpath(xpath)(xml_root)
+        if not isinstance(nodes, list) or not all(etree.iselement(node) for node in nodes):
+            raise ValueError(
+                "XPath expression '%s' is not supported, it must be point to XML node(s)" % xpath)
+        return nodes
+
+    def lookup_attribute(entry, xpath, attribute, inventory=None):
+        xml_desc = inventory.xml_desc(entry) if inventory else entry.XMLDesc(0)
+        xml = etree.fromstring(xml_desc)
+        try:
+            value = compile_xpath(xpath)(xml)[0].get(attribute)
         except Exception:
-            raise ValueError('attribute %s not found with xpath %s in %s' % (attribute, xpath, entry.XMLDesc(0)))
+            raise ValueError('attribute %s not found with xpath %s in %s' % (attribute, xpath, xml_desc))
         return value
 
+    def make_volume_xml(name, capacity, volume_format=None, allocation=None, cluster_size=None, features=None):
+        """ Generate XML document for a new storage volume, e.g. for use with virStoragePool.createXML()
+
+            Argument `features` is a list of qcow2 features such as lazy_refcounts, which require qcow2 compat level 1.1.
+            Ref.: https://libvirt.org/formatstorage.html#storage-volume-target-elements
+        """
+        volume = etree.Element('volume')
+        etree.SubElement(volume, 'name').text = name
+        etree.SubElement(volume, 'capacity', unit='bytes').text = str(capacity)
+        if allocation is not None:
+            etree.SubElement(volume, 'allocation', unit='bytes').text = str(allocation)
+        if volume_format or cluster_size or features:
+            target = etree.SubElement(volume, 'target')
+            if volume_format:
+                etree.SubElement(target, 'format', type=volume_format)
+            if features:
+                etree.SubElement(target, 'compat').text = '1.1'
+            if cluster_size:
+                etree.SubElement(target, 'clusterSize', unit='bytes').text = str(cluster_size)
+            if features:
+                features_element = etree.SubElement(target, 'features')
+                for feature in features:
+                    etree.SubElement(features_element, feature)
+        return to_native(etree.tostring(volume))
+
+    def stream_send(stream, data):
+        """ Send all of `data` to blocking virStream `stream` """
+        while data:
+            # virStreamSend() might write less bytes than requested
+            sent = stream.send(data)
+            data = data[sent:]
+
+    def stream_abort(stream):
+        try:
+            stream.abort()
+        # bare 'except' is no issue because callers reraise their exception
+        except:  # noqa: E722
+            pass
+
+    def upload_file(conn, volume, fileobj, length=0, chunk_size=STREAM_CHUNK_SIZE, digest=None, verify=None,
+                    progress=None):
+        """ Upload content of file-like object `fileobj` to storage volume `volume` using a libvirt stream.
+
+            All data sent is passed to `digest.update()` if `digest` is given. Function `verify` is called after all
+            data has been sent but before the upload is finished, an exception raised by `verify` aborts the upload.
+            Function `progress` is called with the number of bytes sent so far after each chunk.
+            Returns number of bytes uploaded.
+        """
+        stream = conn.newStream(0)
+        volume.upload(stream, 0, length, 0)
+        try:
+            uploaded = 0
+            while True:
+                data = fileobj.read(chunk_size)
+                if not data:
+                    break
+                if digest:
+                    digest.update(data)
+                stream_send(stream, data)
+                uploaded += len(data)
+                if progress:
+                    progress(uploaded)
+
+            if verify:
+                verify()
+
+            stream.finish()
+            return uploaded
+        # bare 'except' is no issue because we reraise the exception unconditionally below
+        except:  # noqa: E722
+            stream_abort(stream)
+            raise
+
+    def _sparse_hole_handler(stream, fd):
+        """ Report whether current position of `fd` is in data or in a hole and how long this section is
+            Ref.: https://gitlab.com/libvirt/libvirt-python/-/blob/master/examples/sparsestream.py
+        """
+        cur = os.lseek(fd, 0, os.SEEK_CUR)
+        try:
+            data = os.lseek(fd, cur, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno != errno.ENXIO:
+                raise
+            data = -1
+
+        if data == cur:
+            # cur is in data
+            try:
+                hole = os.lseek(fd, data, os.SEEK_HOLE)
+            except OSError as e:
+                if e.errno != errno.ENXIO:
+                    raise
+                hole = -1
+
+            if hole < 0:
+                # there is an implicit hole at the end of each file
+                hole = os.lseek(fd, 0, os.SEEK_END)
+            in_data, section_len = True, hole - data
+        elif data > cur:
+            # cur is in a hole, next data at data
+            in_data, section_len = False, data - cur
+        else:
+            # cur is in trailing hole
+            in_data, section_len = False, os.lseek(fd, 0, os.SEEK_END) - cur
+
+        os.lseek(fd, cur, os.SEEK_SET)
+        return [in_data, section_len]
+
+    def upload_sparse_file(conn, volume, path, digest=None, verify=None, progress=None):
+        """ Upload file at `path` to storage volume `volume` using a sparse libvirt stream, i.e. holes are skipped.
+
+            Arguments `digest`, `verify` and `progress` are handled like in upload_file(), holes are passed to `digest`
+            as zeros and count as sent for `progress`.
+        """
+        if not hasattr(os, 'SEEK_DATA'):
+            raise ValueError('sparse upload is not supported on this platform')
+
+        def read_handler(stream, nbytes, fd):
+            data = os.read(fd, nbytes)
+            if digest:
+                digest.update(data)
+            if progress:
+                progress(os.lseek(fd, 0, os.SEEK_CUR))
+            return data
+
+        def skip_handler(stream, length, fd):
+            if digest:
+                zeros = bytes(bytearray(min(length, STREAM_CHUNK_SIZE)))
+                for offset in range(0, length, len(zeros)):
+                    digest.update(zeros[:length - offset])
+            offset = os.lseek(fd, length, os.SEEK_CUR)
+            if progress:
+                progress(offset)
+            return offset
+
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            stream = conn.newStream(0)
+            volume.upload(stream, 0, 0, libvirt.VIR_STORAGE_VOL_UPLOAD_SPARSE_STREAM)
+            try:
+                stream.sparseSendAll(read_handler, _sparse_hole_handler, skip_handler, fd)
+
+                if verify:
+                    verify()
+
+                stream.finish()
+            # bare 'except' is no issue because we reraise the exception unconditionally below
+            except:  # noqa: E722
+                stream_abort(stream)
+                raise
+        finally:
+            os.close(fd)
+
+    def download_range(conn, volume, offset, length):
+        """ Return up to `length` bytes of storage volume `volume` starting at `offset`, using a libvirt stream """
+        stream = conn.newStream(0)
+        volume.download(stream, offset, length, 0)
+        try:
+            data = b''
+            while len(data) < length:
+                chunk = stream.recv(length - len(data))
+                if not chunk:
+                    break
+                data += chunk
+
+            stream.finish()
+            return data
+        # bare 'except' is no issue because we reraise the exception unconditionally below
+        except:  # noqa: E722
+            stream_abort(stream)
+            raise
+
     def to_cli_args(list_):
         cli_args = []
         if list_:
@@ -91,52 +949,443 @@ if HAS_LIBVIRT and HAS_LXML:
                     cli_args.append(v)
         return cli_args
 
-    def xml_elements_equal(e1, e2):
-        """ Test equivalence of (l)xml.etree.ElementTree
-            Ref.: https://stackoverflow.com/a/24349916/6490710
+    # Children with these tags are compared in document order relative to their siblings with the same tag, because
+    # their order is significant to libvirt, e.g. boot order of disks and interfaces without explicit boot elements,
+    # the primary video device, index assignment of controllers, serial ports, consoles and channels or the order of
+    # dns forwarders. All other children are compared as unordered multisets, e.g. dhcp hosts.
+    ORDERED_XML_TAGS = frozenset(['boot', 'channel', 'console', 'controller', 'disk', 'forwarder', 'hostdev',
+                                  'interface', 'ip', 'parallel', 'serial', 'video'])
+
+    def xml_element_digest(element, digests=None):
+        """ Return a sha256 hex digest of the canonical form of XML subtree `element`
+
+            Two subtrees have the same digest if tags, attributes, texts and tails of all their elements are equal,
+            regardless of attribute order and of the order of children, except for the order of children with the same
+            tag listed in ORDERED_XML_TAGS.
+            If dict `digests` is given, the digests of all elements in the subtree are stored in it.
         """
-        if e1.tag != e2.tag:
-            return False
-        if e1.text != e2.text:
-            return False
-        if e1.tail != e2.tail:
-            return False
-        if e1.attrib != e2.attrib:
-            return False
-        if len(e1) != len(e2):
-            return False
-        return all(
-            xml_elements_equal(c1, c2) for c1, c2 in zip(
-                sorted(e1, key=lambda x: x.tag),
-                sorted(e2, key=lambda x: x.tag)
-            ))
+        ordered = {}
+        unordered = []
+        for child in element:
+            digest = xml_element_digest(child, digests)
+            if child.tag in ORDERED_XML_TAGS:
+                ordered.setdefault(child.tag, []).append(digest)
+            else:
+                unordered.append(digest)
+        ordered = ['%s\2%s' % (tag, '\0'.join(ordered[tag])) for tag in sorted(ordered)]
+        unordered.sort()
+
+        attributes = ['%s=%s' % item for item in sorted(element.attrib.items())]
+        canonical = '\1'.join([
+            '\0'.join(['%s' % element.tag, element.text or '', element.tail or ''] + attributes),
+            '\0'.join(ordered),
+            '\0'.join(unordered)])
+        digest = hashlib.sha256(to_bytes(canonical)).hexdigest()
+        if digests is not None:
+            digests[element] = digest
+        return digest
+
+    def xml_elements_equal(e1, e2):
+        """ Test equivalence of (l)xml.etree.ElementTree, see xml_element_digest() """
+        return xml_element_digest(e1) == xml_element_digest(e2)
+
+    def parse_xml(xml, ignore_xpaths):
+        """ Parse xml string without comments, processing instructions, blank text and nodes that match
+            `ignore_xpaths` """
+
+        parser = etree.XMLParser(remove_comments=True, remove_pis=True, remove_blank_text=True)
+        xml_root = etree.fromstring(xml, parser)
+        objectify.deannotate(xml_root, cleanup_namespaces=True)
+
+        # drop ignored XML nodes
+        for ignore_xpath in ignore_xpaths:
+            for ignored_node in select_nodes(xml_root, ignore_xpath):
+                ignored_node.getparent().remove(ignored_node)
+
+        return xml_root
+
+    # Digests of xml strings by xml string and ignored XPath expressions, so that unchanged xml strings, e.g. XML
+    # descriptions of objects which are compared repeatedly, are parsed only once per module run
+    xml_string_digests = {}
+
+    def xml_string_digest(xml, ignore_xpaths):
+        """ Return digest of xml string `xml` without nodes that match `ignore_xpaths`, see xml_element_digest() """
+        key = (xml, tuple(ignore_xpaths))
+        digest = xml_string_digests.get(key)
+        if digest is None:
+            digest = xml_element_digest(parse_xml(xml, ignore_xpaths))
+            xml_string_digests[key] = digest
+        return digest
 
     def xml_strings_equal(xml1, xml2, ignore_xpaths):
         """ Test equivalence of two xml strings `xml1` and `xml2`, but ignoring nodes that match `ignore_xpaths` """
+        return xml_string_digest(xml1, ignore_xpaths) == xml_string_digest(xml2, ignore_xpaths)
 
-        parser = etree.XMLParser(remove_comments=True, remove_pis=True, remove_blank_text=True)
-        xml1_root = etree.fromstring(xml1, parser)
-        xml2_root = etree.fromstring(xml2, parser)
+    def xml_diff_elements(old_root, new_root, pairs=None):
+        """ Return differences between XML trees `old_root` and `new_root` in a single walk over both trees
 
-        objectify.deannotate(xml1_root, cleanup_namespaces=True)
-        objectify.deannotate(xml2_root, cleanup_namespaces=True)
+            Differences are tuples (change, old_element, new_element, old_parent) where change is 'added', 'removed' or
+            'changed'. Elements are changed if their tag, attributes, text or tail differ. old_parent is the element of
+            the old tree to which an added element corresponds to or the parent of a removed or changed element.
 
-        # drop ignored XML nodes
-        for xml_root in [xml1_root, xml2_root]:
-            for ignore_xpath in ignore_xpaths:
-                ignored_nodes = xml_root.xpath(ignore_xpath)
-                if type(ignored_nodes) != list:
-                    raise ValueError(
-                        "XPath expression '%s' is not supported, it must be point to XML node(s)" % ignore_xpath)
+            Children are paired by tag. Children with tags in ORDERED_XML_TAGS are paired by position. Other children
+            which are equal are paired first, remaining children are paired in document order. Paired children are
+            compared recursively, leftovers are added or removed. If list `pairs` is given, all
+            compared pairs of old and new elements which differ are appended to it as tuples (old_element, new_element).
+        """
+        old_digests = {}
+        new_digests = {}
+        xml_element_digest(old_root, old_digests)
+        xml_element_digest(new_root, new_digests)
+
+        def own(element):
+            return (element.tag, element.text or '', element.tail or '', sorted(element.attrib.items()))
+
+        differences = []
+
+        def walk(old, new):
+            if old_digests[old] == new_digests[new]:
+                return
+
+            if pairs is not None:
+                pairs.append((old, new))
+
+            if own(old) != own(new):
+                differences.append(('changed', old, new, old.getparent()))
+
+            tags = []
+            for child in list(old) + list(new):
+                if child.tag not in tags:
+                    tags.append(child.tag)
 
-                for ignored_node in ignored_nodes:
-                    if type(ignored_node) != etree._Element and type(ignored_node) != etree.ElementTree.Element:
-                        raise ValueError(
-                            "XPath expression '%s' is not supported, it must be point to XML node(s)" % ignore_xpath)
+            for tag in tags:
+                old_children = [child for child in old if child.tag == tag]
+                new_children = [child for child in new if child.tag == tag]
 
-                    ignored_node.getparent().remove(ignored_node)
+                if tag in ORDERED_XML_TAGS:
+                    # pair children by position, moved children are changed
+                    paired_by_position = list(zip(old_children, new_children))
+                    for old_child, new_child in paired_by_position:
+                        walk(old_child, new_child)
+                    for child in old_children[len(paired_by_position):]:
+                        differences.append(('removed', child, None, old))
+                    for child in new_children[len(paired_by_position):]:
+                        differences.append(('added', None, child, old))
+                    continue
 
-        return xml_elements_equal(xml1_root, xml2_root)
+                # pair equal children
+                unpaired = {}
+                for child in old_children:
+                    unpaired.setdefault(old_digests[child], []).append(child)
+
+                paired = set()
+                new_unpaired = []
+                for child in new_children:
+                    candidates = unpaired.get(new_digests[child])
+                    if candidates:
+                        paired.add(candidates.pop(0))
+                    else:
+                        new_unpaired.append(child)
+                old_unpaired = [child for child in old_children if child not in paired]
+
+                for old_child, new_child in zip(old_unpaired, new_unpaired):
+                    walk(old_child, new_child)
+                for old_child in old_unpaired[len(new_unpaired):]:
+                    differences.append(('removed', old_child, None, old))
+                for new_child in new_unpaired[len(old_unpaired):]:
+                    differences.append(('added', None, new_child, old))
+
+        if old_root.tag != new_root.tag:
+            return [('removed', old_root, None, None), ('added', None, new_root, None)]
+
+        walk(old_root, new_root)
+        return differences
+
+    # Children with these tags are added to definitions by libvirt implicitly, e.g. usb controllers, ps2 input devices
+    # and consoles for serial ports. Existing children with these tags are compared only if they are paired with
+    # children of the new definition, see project_xml().
+    IMPLICIT_XML_TAGS = frozenset(['console', 'controller', 'input'])
+
+    def project_xml(old_root, new_root):
+        """ Return a copy of XML tree `old_root` restricted to the elements, attributes and texts which are present in
+            XML tree `new_root`, e.g. without defaults such as device addresses which libvirt has added to a definition
+
+            Children are paired by tag. A new child is paired with the first existing child whose projection is equal
+            to it or else with the first unpaired existing child. Unpaired existing children are kept if their tag is
+            present in `new_root` but not in IMPLICIT_XML_TAGS, so that removed elements are still detected. Children
+            are kept in the order of `old_root`, so that changed orders are detected, too.
+        """
+        projections = {}
+
+        for tag in set(child.tag for child in new_root):
+            pairs, unpaired = pair_xml_children(old_root, new_root, tag)
+            for new_child, old_child in iteritems(pairs):
+                projections[old_child] = project_xml(old_child, new_child)
+
+            if tag not in IMPLICIT_XML_TAGS:
+                for old_child in unpaired:
+                    projections[old_child] = copy.deepcopy(old_child)
+
+        element = etree.Element(old_root.tag, dict((k, v) for k, v in old_root.attrib.items() if k in new_root.attrib))
+        if new_root.text is not None:
+            element.text = old_root.text
+        for old_child in old_root:
+            if old_child in projections:
+                element.append(projections[old_child])
+        return element
+
+    def pair_xml_children(old_root, new_root, tag):
+        """ Return dict of children of XML tree `new_root` with `tag` to the paired children of XML tree `old_root` and
+            list of unpaired children of `old_root` with `tag`, see project_xml()
+        """
+        pairs = {}
+        unpaired = [child for child in old_root if child.tag == tag]
+        for new_child in new_root:
+            if new_child.tag != tag or not unpaired:
+                continue
+
+            new_digest = xml_element_digest(new_child)
+            for old_child in unpaired:
+                if xml_element_digest(project_xml(old_child, new_child)) == new_digest:
+                    paired = old_child
+                    break
+            else:
+                paired = unpaired[0]
+
+            unpaired.remove(paired)
+            pairs[new_child] = paired
+        return pairs, unpaired
+
+    def merge_xml(old_root, new_root):
+        """ Return a copy of XML tree `old_root` with the elements, attributes and texts of XML tree `new_root` merged
+            into it, e.g. to apply a partial definition without dropping defaults which libvirt has added
+
+            Children are paired like in project_xml(), so that the projection of the result onto `new_root` is equal to
+            `new_root`. Paired children are merged recursively and unpaired new children are added. Unpaired existing
+            children are removed if their tag is present in `new_root` but not in IMPLICIT_XML_TAGS, else they are
+            kept. Children with the same tag are ordered like in `new_root`.
+        """
+        element = etree.Element(old_root.tag, dict(old_root.attrib))
+        element.attrib.update(new_root.attrib)
+        element.text = old_root.text if new_root.text is None else new_root.text
+
+        # merged children for each tag in new_root in the order of new_root
+        merged = {}
+        kept = set()
+        for tag in set(child.tag for child in new_root):
+            pairs, unpaired = pair_xml_children(old_root, new_root, tag)
+            merged[tag] = [merge_xml(pairs[new_child], new_child) if new_child in pairs else copy.deepcopy(new_child)
+                           for new_child in new_root if new_child.tag == tag]
+            if tag in IMPLICIT_XML_TAGS:
+                kept.update(unpaired)
+
+        # merged children take the places of the existing children with the same tag, additional children are
+        # inserted after the last of them or appended
+        for old_child in old_root:
+            if old_child.tag not in merged or old_child in kept:
+                element.append(copy.deepcopy(old_child))
+            elif merged[old_child.tag]:
+                element.append(merged[old_child.tag].pop(0))
+
+        for tag in merged:
+            if not merged[tag]:
+                continue
+            siblings = [child for child in element if child.tag == tag]
+            index = element.index(siblings[-1]) + 1 if siblings else len(element)
+            for child in merged[tag]:
+                element.insert(index, child)
+                index += 1
+
+        return element
+
+    def xml_diff(old_xml, new_xml, ignore_xpaths):
+        """ Compare xml strings `old_xml` and `new_xml`, but ignoring nodes that match `ignore_xpaths`
+
+            Returns a dict with lists of XPath expressions to 'added', 'removed' and 'changed' elements and a dict with
+            'before' and 'after' texts for Ansible's diff mode which contain the differing elements only. Either xml
+            string may be None, e.g. if an object is created or deleted.
+        """
+        changes = dict(added=[], removed=[], changed=[])
+        before = []
+        after = []
+
+        def dump(element, path, shallow=False):
+            if shallow:
+                # children are reported separately
+                text = element.text
+                element = etree.Element(element.tag, dict(element.attrib))
+                element.text = text
+            return '%s: %s' % (path, to_native(etree.tostring(element)).strip())
+
+        if old_xml is None or new_xml is None:
+            root = parse_xml(new_xml if old_xml is None else old_xml, ignore_xpaths)
+            path = root.getroottree().getpath(root)
+            if old_xml is None:
+                changes['added'].append(path)
+                after.append(dump(root, path))
+            else:
+                changes['removed'].append(path)
+                before.append(dump(root, path))
+        else:
+            old_root = parse_xml(old_xml, ignore_xpaths)
+            new_root = parse_xml(new_xml, ignore_xpaths)
+            old_tree = old_root.getroottree()
+            new_tree = new_root.getroottree()
+
+            for change, old, new, old_parent in xml_diff_elements(old_root, new_root):
+                if change == 'added':
+                    path = new_tree.getpath(new)
+                    after.append(dump(new, path))
+                elif change == 'removed':
+                    path = old_tree.getpath(old)
+                    before.append(dump(old, path))
+                else:
+                    path = new_tree.getpath(new)
+                    before.append(dump(old, old_tree.getpath(old), shallow=True))
+                    after.append(dump(new, path, shallow=True))
+                changes[change].append(path)
+
+        diff = dict(
+            before=''.join(line + '\n' for line in before),
+            after=''.join(line + '\n' for line in after))
+        return changes, diff
+
+    # libvirt objects which are defined from XML, by tag of the XML root node:
+    # (description in error messages, define method of virConnect, flags for XMLDesc() to dump the persistent config)
+    XML_OBJECTS = {
+        'domain': ('domain', 'defineXML', libvirt.VIR_DOMAIN_XML_INACTIVE),
+        'network': ('network', 'networkDefineXML', libvirt.VIR_NETWORK_XML_INACTIVE),
+        'pool': ('storage pool', 'storagePoolDefineXML', libvirt.VIR_STORAGE_XML_INACTIVE),
+    }
+
+    def lookup_uuid_and_name(xml_root):
+        """ Return uuid and name of the libvirt object described by XML root node `xml_root` """
+        description = XML_OBJECTS[xml_root.tag][0]
+
+        uuids = xml_root.findall('uuid')
+        if len(uuids) > 1:
+            raise ValueError("%s config is invalid: xml has more than one 'uuid' element" % description)
+
+        names = xml_root.findall('name')
+        if len(names) > 1:
+            raise ValueError("%s config is invalid: xml has more than one 'name' element" % description)
+
+        uuid = uuids[0].text if uuids else None
+        name = names[0].text if names else None
+
+        if not uuid and not name:
+            raise ValueError("%s config is invalid: xml requires an 'uuid', an 'name' element or both" % description)
+
+        return uuid, name
+
+    def reconcile_xml(conn, kind, state, xml, ignore_xpaths, update=None, subset=False):
+        """ Define, modify or undefine the libvirt object of `kind` ('domain', 'network' or 'pool') described by xml
+            string `xml`, ignoring nodes that match `ignore_xpaths` when comparing it to the existing config
+
+            If `subset` is true, only elements, attributes and texts which are present in `xml` are compared, see
+            project_xml(), e.g. because libvirt completes the config with defaults, and changes are merged into the
+            existing config, see merge_xml(), instead of replacing it.
+
+            `update` is an optional function update(entry, old_xml, new_xml, ignore_xpaths) which applies changes to
+            an existing object without redefining it and returns False if it cannot do so.
+
+            Returns a tuple (changed, xml, changes, diff) with the resulting config and the output of xml_diff().
+        """
+        xml_root = etree.fromstring(xml)
+        if xml_root.tag != kind:
+            raise ValueError("xml has root element '%s' but '%s' is required" % (xml_root.tag, kind))
+
+        description, define, flags = XML_OBJECTS[kind]
+        uuid, name = lookup_uuid_and_name(xml_root)
+        entry = conn.inventory.lookup(kind, name, uuid)
+
+        if state == 'present':
+            if not entry:
+                # create
+                entry = getattr(conn, define)(xml)
+                conn.inventory.defined(entry)
+                new_xml = entry.XMLDesc(flags=flags)
+                changes, diff = xml_diff(None, new_xml, ignore_xpaths)
+                return True, new_xml, changes, diff
+
+            # maybe modify
+            old_xml = conn.inventory.xml_desc(entry, flags)
+
+            compared_xml = old_xml
+            if subset:
+                compared_xml = to_native(etree.tostring(
+                    project_xml(parse_xml(old_xml, ignore_xpaths), parse_xml(xml, ignore_xpaths))))
+
+            if xml_strings_equal(compared_xml, xml, ignore_xpaths):
+                # object does not require update
+                return False, old_xml, None, None
+
+            changes, diff = xml_diff(compared_xml, xml, ignore_xpaths)
+            if not update or not update(entry, old_xml, xml, ignore_xpaths):
+                new_xml = xml
+                if subset:
+                    # apply changes to existing config instead of replacing it, to keep defaults added by libvirt
+                    new_xml = to_native(etree.tostring(
+                        merge_xml(parse_xml(old_xml, ignore_xpaths), parse_xml(xml, ignore_xpaths))))
+                entry = getattr(conn, define)(update_xml_desc(old_xml, new_xml, ignore_xpaths))
+            conn.inventory.defined(entry)
+            return True, entry.XMLDesc(flags=flags), changes, diff
+
+        else:  # state == 'absent'
+            if not entry:
+                # object absent already
+                return False, None, None, None
+
+            xml = entry.XMLDesc(flags=flags)  # fetch xml before deletion
+            entry.undefine()
+            conn.inventory.undefined(entry)
+            changes, diff = xml_diff(xml, None, ignore_xpaths)
+            return True, xml, changes, diff
+
+    def reconcile_xml_documents(module, kind, result, ignore_xpaths, update=None, subset=False):
+        """ Reconcile the document in option xml or all documents in option xmls of `module` with libvirt objects of
+            `kind`, see reconcile_xml(), and return module result `result` updated with their results
+
+            If option xmls is set, then all objects of `kind` are listed once instead of being looked up for each
+            document and failures of documents are reported with fail_items() instead of being raised, to keep
+            results of other documents, e.g. of objects which have been defined already.
+        """
+        xml = module.params['xml']
+        xmls = module.params['xmls']
+
+        results = []
+        with Connection(module.params['uri'], module) as conn:
+            if xmls is not None:
+                conn.inventory.index(kind)
+
+            for item in ([xml] if xmls is None else xmls):
+                try:
+                    changed, item_xml, changes, diff = reconcile_xml(
+                        conn, kind, module.params['state'], item, ignore_xpaths, update, subset)
+                except Exception as e:
+                    if xmls is None:
+                        raise
+                    results.append(dict(failed=True, msg=to_native(e)))
+                else:
+                    results.append(dict(changed=changed, xml=item_xml, changes=changes, diff=diff))
+
+        if xmls is None:
+            result.update(changed=results[0]['changed'], xml=results[0]['xml'], changes=results[0]['changes'])
+
+            if module._diff and results[0]['diff']:
+                result['diff'] = results[0]['diff']
+
+            return result
+
+        result.update(
+            changed=any(item.get('changed', False) for item in results),
+            xmls=[item if item.get('failed') else dict(changed=item['changed'], xml=item['xml'], changes=item['changes'])
+                  for item in results])
+
+        if module._diff:
+            result['diff'] = [item['diff'] for item in results if item.get('diff')]
+
+        return fail_items(result, 'xmls')
 
     def make_xml_path(xml_root, path):
         """ Create XML node hierarchy, adding child nodes if required, to match the given `path`. """
@@ -162,21 +1411,12 @@ if HAS_LIBVIRT and HAS_LXML:
 
         # drop XML nodes from new xml that should be kept
         for keep_xpath in keep_xpaths:
-            keep_nodes = new_xml_root.xpath(keep_xpath)
-            if type(keep_nodes) != list:
-                raise ValueError(
-                    "XPath expression '%s' is not supported, it must be point to XML node(s)" % keep_xpath)
-
-            for keep_node in keep_nodes:
+            for keep_node in select_nodes(new_xml_root, keep_xpath):
                 keep_node.getparent().remove(keep_node)
 
         # replace XML nodes in new xml that should be kept with XML nodes from old xml
         for keep_xpath in keep_xpaths:
-            for old_node in old_xml_root.xpath(keep_xpath):
-                if type(old_node) != etree._Element and type(old_node) != etree.ElementTree.Element:
-                    raise ValueError(
-                        "XPath expression '%s' is not supported, it must be point to XML node(s)" % keep_xpath)
-
+            for old_node in select_nodes(old_xml_root, keep_xpath):
                 old_parent_path = old_xml_tree.getpath(old_node.getparent())
                 new_parent_node = make_xml_path(new_xml_root, old_parent_path)
                 new_parent_node.append(copy.deepcopy(old_node))
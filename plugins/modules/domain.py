@@ -26,9 +26,35 @@ description:
        It is inspired by Ansible module openstack.cloud.os_server from John Dewey <john@dewey.ws> et al."
 
 requirements:
-   - virt-install (e.g. in debian package virt-inst)
+   - virt-install (e.g. in debian package virt-inst), unless I(backend) is C(libvirt) or C(auto) and all arguments in
+     I(hardware) are supported by libvirt
 
 options:
+    backend:
+        choices: [auto, libvirt, virt-install]
+        default: virt-install
+        description:
+            - "How to define the domain. With C(libvirt), the domain XML is generated from I(hardware) and defined
+               with libvirt directly, which avoids starting C(virt-install) for each domain. With C(virt-install),
+               C(virt-install) is called with I(hardware) as command line arguments. With C(auto), libvirt is used
+               if all arguments in I(hardware) are supported by it and C(virt-install) otherwise."
+            - "Defaults to C(virt-install) because domains defined with C(libvirt) differ from domains created by
+               C(virt-install) from the same I(hardware), e.g. in machine type, channels, timers, rng and input
+               devices, which C(virt-install) chooses from libosinfo. Changing I(backend) does not modify existing
+               domains."
+            - "Supported with C(libvirt) are C(boot) (boot devices and C(uefi)), C(cpu) (C(host), C(host-model),
+               C(host-passthrough) or a cpu model), C(disk) (suboptions C(vol), C(path), C(device), C(bus),
+               C(serial), C(format), C(cache), C(io) and C(discard)), C(graphics) (C(spice), C(vnc) or C(none) with
+               suboptions C(listen), C(port) and C(password)), C(machine), C(arch), C(memory) (suboptions C(memory)
+               and C(currentMemory)), C(network) (C(none), C(default) or suboptions C(network), C(bridge), C(model)
+               and C(mac)), C(pxe), C(vcpus) (suboptions C(vcpus) and C(maxvcpus)) and C(virt_type). Flags
+               C(import), C(noreboot), C(noautoconsole) and C(wait) are ignored."
+            - "Devices are configured for paravirtualized guests, e.g. disks and network interfaces use virtio. Hence
+               C(os_variant) is not supported with C(libvirt) and C(auto) uses C(virt-install) if it is given, so
+               that devices are chosen from libosinfo's defaults for the guest os, e.g. for Windows guests without
+               virtio drivers."
+        required: false
+        type: str
     name:
         description:
             - "Name of the domain."
@@ -56,6 +82,12 @@ options:
         description:
             - "Should the domain be present or absent."
         type: str
+    xml:
+        description:
+            - "Domain XML which is defined with libvirt instead of generating it from I(hardware). If the XML has no
+               'name' element, the domain name is inserted."
+        required: false
+        type: str
 
 notes:
   - "No modifications are applied to existing domains; module is skipped if domain exists already."
@@ -69,6 +101,19 @@ author: "Jakob Meng (@jm1)"
 EXAMPLES = r'''
 - jm1.libvirt.domain:
     name: 'inf.h-brs.de'
+
+- name: Define a domain with libvirt, failing if any hardware argument requires virt-install
+  jm1.libvirt.domain:
+    name: 'inf.h-brs.de'
+    backend: libvirt
+    hardware:
+    - cpu: 'host'
+    - vcpus: '2'
+    - memory: '1024'
+    - virt_type: 'kvm'
+    - graphics: 'spice,listen=none'
+    - disk: "vol='default/inf.h-brs.de.qcow2',device=disk,bus=virtio,serial='root'"
+    - network: 'network=default,model=virtio'
 '''
 
 RETURN = r'''
@@ -78,20 +123,416 @@ RETURN = r'''
 from ansible_collections.jm1.libvirt.plugins.module_utils import libvirt as libvirt_utils
 from ansible.module_utils._text import to_native
 from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.six import iteritems
+import shlex
 import traceback
 
+try:
+    import libvirt
+except ImportError:
+    # error handled in libvirt_utils.try_import() below
+    pass
+
+try:
+    from lxml import etree
+except ImportError:
+    # error handled in libvirt_utils.try_import() below
+    pass
+
+# hardware arguments which only control the virt-install process and have no meaning for a domain definition
+VIRT_INSTALL_FLAGS = ['import', 'noreboot', 'noautoconsole', 'wait']
+
+# prefixes of target device names of disks per bus
+DISK_BUSES = {'virtio': 'vd', 'sata': 'sd', 'scsi': 'sd', 'usb': 'sd', 'ide': 'hd', 'fdc': 'fd'}
+
+BOOT_DEVICES = ['hd', 'cdrom', 'network', 'fd']
+
+
+def parse_suboptions(value):
+    """ Split value of a virt-install argument like "vol='pool/volume',bus=virtio" into a list of (key, value) pairs.
+        Suboptions without a key, e.g. 'spice' in 'spice,listen=none', have a key of None.
+    """
+    lexer = shlex.shlex(str(value), posix=True)
+    lexer.whitespace = ','
+    lexer.whitespace_split = True
+    lexer.commenters = ''
+
+    suboptions = []
+    for token in lexer:
+        if '=' in token:
+            suboptions.append(tuple(token.split('=', 1)))
+        else:
+            suboptions.append((None, token))
+    return suboptions
+
+
+class DomainXML(object):
+    """ Generate domain XML from hardware arguments of virt-install
+
+        Arguments which cannot be translated to XML are collected in 'unsupported'.
+    """
+
+    def __init__(self, conn, name):
+        self.conn = conn
+        self.name = name
+        self.unsupported = []
+        self.virt_type = 'kvm'
+        self.memory = None
+        self.current_memory = None
+        self.vcpus = 1
+        self.max_vcpus = None
+        self.cpu = None
+        self.arch = None
+        self.machine = None
+        self.firmware = None
+        self.boot = []
+        self.disks = []
+        self.interfaces = None
+        self.graphics = None
+
+    def add(self, key, value):
+        key = key.replace('-', '_')
+        if key in VIRT_INSTALL_FLAGS and value is None:
+            return
+
+        handler = getattr(self, 'add_' + key, None)
+        if handler and (value is not None or key == 'pxe') and handler(value):
+            return
+
+        key = key.replace('_', '-')
+        self.unsupported.append('--%s %s' % (key, value) if value is not None else '--%s' % key)
+
+    def add_arch(self, value):
+        self.arch = value
+        return True
+
+    def add_boot(self, value):
+        for key, device in parse_suboptions(value):
+            if key:
+                return False
+            elif device == 'uefi':
+                self.firmware = 'efi'
+            elif device in BOOT_DEVICES:
+                self.boot.append(device)
+            else:
+                return False
+        return True
+
+    def add_cpu(self, value):
+        suboptions = parse_suboptions(value)
+        if len(suboptions) != 1 or suboptions[0][0]:
+            return False
+
+        model = suboptions[0][1]
+        cpu = etree.Element('cpu')
+        if model in ['host', 'host-model']:
+            cpu.set('mode', 'host-model')
+        elif model == 'host-passthrough':
+            cpu.set('mode', 'host-passthrough')
+        else:
+            cpu.set('mode', 'custom')
+            cpu.set('match', 'exact')
+            etree.SubElement(cpu, 'model', fallback='allow').text = model
+        self.cpu = cpu
+        return True
+
+    def add_disk(self, value):
+        options = {}
+        for key, option in parse_suboptions(value):
+            options[key or 'path'] = option
+
+        if set(options) - set(['vol', 'path', 'device', 'bus', 'serial', 'format', 'cache', 'io', 'discard']):
+            return False
+
+        device = options.get('device', 'disk')
+        if device not in ['disk', 'cdrom']:
+            return False
+
+        bus = options.get('bus', 'virtio' if device == 'disk' else 'sata')
+        if bus not in DISK_BUSES:
+            return False
+
+        disk_type, source, disk_format = 'file', None, options.get('format')
+        if 'vol' in options:
+            pool_name, _, volume_name = options['vol'].partition('/')
+            pool = self.conn.inventory.pool(pool_name)
+            if not pool:
+                raise ValueError('storage pool %s does not exist' % pool_name)
+
+            volume = self.conn.inventory.volume(pool, volume_name)
+            if not volume:
+                raise ValueError('volume %s does not exist in storage pool %s' % (volume_name, pool_name))
+
+            # volume_type is of type virStorageVolType, only file (0) and block (1) volumes have a local path
+            volume_type, volume_capacity, volume_allocation = self.conn.inventory.info(volume)
+            if volume_type not in [0, 1]:
+                return False
+
+            disk_type = 'block' if volume_type == 1 else 'file'
+            source = volume.path()
+            if not disk_format:
+                disk_format = libvirt_utils.lookup_attribute(volume, '/volume/target/format', 'type',
+                                                             self.conn.inventory)
+        elif 'path' in options:
+            source = options['path']
+            disk_type = 'block' if source.startswith('/dev/') else 'file'
+            if not disk_format:
+                try:
+                    volume = self.conn.storageVolLookupByPath(source)
+                except libvirt.libvirtError as e:
+                    if e.get_error_code() != libvirt.VIR_ERR_NO_STORAGE_VOL:
+                        raise
+                    # format of images outside of storage pools is probed by virt-install only
+                    return False
+                disk_format = libvirt_utils.lookup_attribute(volume, '/volume/target/format', 'type')
+        elif device == 'disk':
+            return False
+
+        prefix = DISK_BUSES[bus]
+        index = len([disk for disk in self.disks if disk.find('target').get('dev').startswith(prefix)])
+        if index >= 26:
+            return False
+
+        disk = etree.Element('disk', type=disk_type, device=device)
+        driver = etree.SubElement(disk, 'driver', name='qemu', type=disk_format or 'raw')
+        for key in ['cache', 'io', 'discard']:
+            if key in options:
+                driver.set(key, options[key])
+        if source:
+            etree.SubElement(disk, 'source', **{'dev' if disk_type == 'block' else 'file': source})
+        etree.SubElement(disk, 'target', dev=prefix + 'abcdefghijklmnopqrstuvwxyz'[index], bus=bus)
+        if 'serial' in options:
+            etree.SubElement(disk, 'serial').text = options['serial']
+        if device == 'cdrom':
+            etree.SubElement(disk, 'readonly')
+        self.disks.append(disk)
+        return True
+
+    def add_graphics(self, value):
+        suboptions = parse_suboptions(value)
+        graphics_type = 'vnc'
+        if suboptions and suboptions[0][0] is None:
+            graphics_type = suboptions.pop(0)[1]
+
+        if graphics_type == 'none' and not suboptions:
+            self.graphics = []
+            return True
+
+        if graphics_type not in ['spice', 'vnc']:
+            return False
+
+        graphics = etree.Element('graphics', type=graphics_type)
+        for key, option in suboptions:
+            if key == 'listen':
+                if option in ['none', 'socket']:
+                    etree.SubElement(graphics, 'listen', type=option)
+                else:
+                    graphics.set('listen', option)
+                    etree.SubElement(graphics, 'listen', type='address', address=option)
+            elif key == 'port':
+                graphics.set('port', option)
+                graphics.set('autoport', 'yes' if option == '-1' else 'no')
+            elif key == 'password':
+                graphics.set('passwd', option)
+            else:
+                return False
+
+        self.graphics = [graphics]
+        return True
+
+    def add_machine(self, value):
+        self.machine = value
+        return True
+
+    def add_memory(self, value):
+        for key, option in parse_suboptions(value):
+            if not option.isdigit():
+                return False
+            elif key in [None, 'memory']:
+                self.memory = option
+            elif key == 'currentMemory':
+                self.current_memory = option
+            else:
+                return False
+        return True
+
+    def add_network(self, value):
+        options = {}
+        for key, option in parse_suboptions(value):
+            if key is None and option == 'none':
+                self.interfaces = self.interfaces or []
+                return True
+            options[key or 'network'] = option
+
+        if set(options) - set(['network', 'bridge', 'model', 'mac']) or ('network' in options) == ('bridge' in options):
+            return False
+
+        if 'network' in options:
+            interface = etree.Element('interface', type='network')
+            etree.SubElement(interface, 'source', network=options['network'])
+        else:
+            interface = etree.Element('interface', type='bridge')
+            etree.SubElement(interface, 'source', bridge=options['bridge'])
+        if 'mac' in options:
+            etree.SubElement(interface, 'mac', address=options['mac'])
+        etree.SubElement(interface, 'model', type=options.get('model', 'virtio'))
+
+        self.interfaces = (self.interfaces or []) + [interface]
+        return True
+
+    def add_pxe(self, value):
+        if value is not None:
+            return False
+        self.boot.append('network')
+        return True
+
+    def add_vcpus(self, value):
+        for key, option in parse_suboptions(value):
+            if not option.isdigit():
+                return False
+            elif key in [None, 'vcpus']:
+                self.vcpus = option
+            elif key == 'maxvcpus':
+                self.max_vcpus = option
+            else:
+                return False
+        return True
+
+    def add_virt_type(self, value):
+        if value not in ['kvm', 'qemu']:
+            return False
+        self.virt_type = value
+        return True
+
+    def to_xml(self):
+        if self.memory is None:
+            self.unsupported.append('missing --memory')
+            return None
+
+        domain = etree.Element('domain', type=self.virt_type)
+        etree.SubElement(domain, 'name').text = self.name
+        etree.SubElement(domain, 'memory', unit='MiB').text = self.memory
+        if self.current_memory:
+            etree.SubElement(domain, 'currentMemory', unit='MiB').text = self.current_memory
+
+        if self.max_vcpus:
+            etree.SubElement(domain, 'vcpu', placement='static', current=str(self.vcpus)).text = self.max_vcpus
+        else:
+            etree.SubElement(domain, 'vcpu', placement='static').text = str(self.vcpus)
+
+        os_ = etree.SubElement(domain, 'os')
+        if self.firmware:
+            os_.set('firmware', self.firmware)
+        os_type = etree.SubElement(os_, 'type')
+        os_type.text = 'hvm'
+        if self.arch:
+            os_type.set('arch', self.arch)
+        if self.machine:
+            os_type.set('machine', self.machine)
+        for device in self.boot or ['hd']:
+            etree.SubElement(os_, 'boot', dev=device)
+
+        features = etree.SubElement(domain, 'features')
+        etree.SubElement(features, 'acpi')
+        etree.SubElement(features, 'apic')
+
+        if self.cpu is not None:
+            domain.append(self.cpu)
+
+        clock = etree.SubElement(domain, 'clock', offset='utc')
+        etree.SubElement(clock, 'timer', name='rtc', tickpolicy='catchup')
+        etree.SubElement(clock, 'timer', name='pit', tickpolicy='delay')
+        etree.SubElement(clock, 'timer', name='hpet', present='no')
+
+        devices = etree.SubElement(domain, 'devices')
+        for disk in self.disks:
+            devices.append(disk)
+
+        interfaces = self.interfaces
+        if interfaces is None:
+            # like virt-install, attach a single nic to the default network if no network has been specified
+            interface = etree.Element('interface', type='network')
+            etree.SubElement(interface, 'source', network='default')
+            etree.SubElement(interface, 'model', type='virtio')
+            if not self.conn.inventory.network('default'):
+                interface = etree.Element('interface', type='user')
+                etree.SubElement(interface, 'model', type='virtio')
+            interfaces = [interface]
+        for interface in interfaces:
+            devices.append(interface)
+
+        etree.SubElement(devices, 'serial', type='pty')
+        etree.SubElement(devices, 'console', type='pty')
+        channel = etree.SubElement(devices, 'channel', type='unix')
+        etree.SubElement(channel, 'target', type='virtio', name='org.qemu.guest_agent.0')
+
+        graphics = self.graphics
+        if graphics is None:
+            graphics = [etree.Element('graphics', type='vnc')]
+        for graphic in graphics:
+            devices.append(graphic)
+            if graphic.get('type') == 'spice':
+                channel = etree.SubElement(devices, 'channel', type='spicevmc')
+                etree.SubElement(channel, 'target', type='virtio', name='com.redhat.spice.0')
+            video = etree.SubElement(devices, 'video')
+            etree.SubElement(video, 'model', type='qxl' if graphic.get('type') == 'spice' else 'vga')
+            etree.SubElement(devices, 'input', type='tablet', bus='usb')
+
+        etree.SubElement(devices, 'memballoon', model='virtio')
+        rng = etree.SubElement(devices, 'rng', model='virtio')
+        etree.SubElement(rng, 'backend', model='random').text = '/dev/urandom'
+
+        return to_native(etree.tostring(domain))
+
+
+def make_domain_xml(conn, domain_name, hardware):
+    """ Return domain XML for hardware arguments of virt-install and a list of arguments which are not supported """
+    domain_xml = DomainXML(conn, domain_name)
+    for item in hardware or []:
+        if isinstance(item, dict):
+            for key, value in iteritems(item):
+                domain_xml.add(key, value)
+        else:
+            domain_xml.unsupported.append(str(item))
+
+    if domain_xml.unsupported:
+        return None, domain_xml.unsupported
+
+    return domain_xml.to_xml(), domain_xml.unsupported
+
 
 def create(uri,
            domain_name,
            hardware,
+           backend,
+           xml,
            module):
     with libvirt_utils.Connection(uri, module) as conn:
-        domains = conn.listAllDomains()
-        domain = next((domain for domain in domains if domain.name() == domain_name), None)
+        domain = conn.inventory.domain(domain_name)
         if domain:
             # domain exists already
             return False
 
+        if xml:
+            xml_root = etree.fromstring(xml)
+            names = xml_root.xpath('/domain/name')
+            if not names:
+                etree.SubElement(xml_root, 'name').text = domain_name
+            elif names[0].text != domain_name:
+                raise ValueError("domain xml has name '%s' but name '%s' was given" % (names[0].text, domain_name))
+
+            conn.defineXML(to_native(etree.tostring(xml_root)))
+            return True
+
+        if backend in ['auto', 'libvirt']:
+            xml, unsupported = make_domain_xml(conn, domain_name, hardware)
+            if xml:
+                conn.defineXML(xml)
+                return True
+
+            if backend == 'libvirt':
+                raise ValueError('hardware arguments are not supported by libvirt backend: %s' % ', '.join(unsupported))
+
         # Prepare virt-install options
         virt_install_args = libvirt_utils.to_cli_args(hardware)
 
@@ -118,8 +559,7 @@ def delete(uri,
            hardware,
            module):
     with libvirt_utils.Connection(uri, module) as conn:
-        domains = conn.listAllDomains()
-        domain = next((domain for domain in domains if domain.name() == domain_name), None)
+        domain = conn.inventory.domain(domain_name)
         if not domain:
             # domain absent already
             return False
@@ -142,7 +582,7 @@ def delete(uri,
         #
         # Ref.: https://libvirt.org/html/libvirt-libvirt-domain.html#virDomainState
 
-        domain_state, domain_maxMem, domain_memory, domain_nrVirtCpu, domain_cpuTime = domain.info()
+        domain_state, domain_maxMem, domain_memory, domain_nrVirtCpu, domain_cpuTime = conn.inventory.info(domain)
         if domain_state > 7:
             raise Exception('Unknown domain state %s' % domain_state)
 
@@ -150,6 +590,7 @@ def delete(uri,
             domain.destroy()
 
         domain.undefine()
+        conn.inventory.invalidate(domain)
         return True
 
 
@@ -158,6 +599,8 @@ def core(module):
     uri = module.params['uri']
     domain_name = module.params['name']
     hardware = module.params['hardware']
+    backend = module.params['backend']
+    xml = module.params['xml']
 
     if module.check_mode:
         return dict(
@@ -165,13 +608,17 @@ def core(module):
             state=state,
             uri=uri,
             name=domain_name,
-            hardware=hardware)
+            hardware=hardware,
+            backend=backend,
+            xml=xml)
 
     if state == 'present':
         changed = create(
             uri,
             domain_name,
             hardware,
+            backend,
+            xml,
             module)
     elif state == 'absent':
         changed = delete(
@@ -185,7 +632,9 @@ def core(module):
         state=state,
         uri=uri,
         name=domain_name,
-        hardware=hardware)
+        hardware=hardware,
+        backend=backend,
+        xml=xml)
 
 
 def main():
@@ -193,6 +642,7 @@ def main():
         argument_spec=dict(
             state=dict(type='str', choices=['present', 'absent'], default='present'),
             uri=dict(default='qemu:///system'),
+            broker_dir=dict(type='path'),
             name=dict(required=True, type='str'),
             hardware=dict(
                 type='list',
@@ -202,7 +652,9 @@ def main():
                     {'memory': '1024'},
                     {'virt-type': 'kvm'},
                     {'graphics': 'spice,listen=none'}
-                ])
+                ]),
+            backend=dict(type='str', choices=['auto', 'libvirt', 'virt-install'], default='virt-install'),
+            xml=dict(type='str')
         ),
         supports_check_mode=True,
     )
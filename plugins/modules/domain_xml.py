@@ -0,0 +1,245 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# vim:set fileformat=unix shiftwidth=4 softtabstop=4 expandtab:
+# kate: end-of-line unix; space-indent on; indent-width 4; remove-trailing-spaces modified;
+
+# Copyright: (c) 2020, Jakob Meng <jakobmeng@web.de>
+# Based on community.libvirt.virt_pool module written by Maciej Delmanowski <drybjed@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = r'''
+---
+
+module: domain_xml
+
+short_description: Create/Modify/Delete a libvirt domain.
+
+description:
+    - "This module allows one to create, modify and delete a libvirt domain a.k.a. virtual machine from its XML
+       definition."
+    - "For use in addition to M(community.libvirt.virt)."
+    - "Compared to M(community.libvirt.virt), this module applies changes to a domain whenever necessary while the
+       former has to be called with 'C(command): I(define)' explicitly to apply any changes."
+    - "Compared to M(jm1.libvirt.domain), this module modifies existing domains instead of skipping them."
+
+requirements: []
+
+options:
+    compare:
+        choices: [subset, full]
+        default: subset
+        description:
+            - "How to compare I(xml) to the existing domain configuration."
+            - "With C(subset), only elements, attributes and texts which are present in I(xml) are compared. Defaults
+               which libvirt adds to domain definitions, e.g. device addresses, mac addresses, implicit controllers,
+               input devices, C(resource) elements and attributes such as the machine type or memory units, do not
+               cause changes. Existing elements are removed if siblings with the same tag are given in I(xml), e.g.
+               a disk which is missing from a list of disks, except for implicit controllers, input devices and
+               consoles."
+            - "With C(subset), changes are merged into the existing domain configuration, i.e. elements, attributes
+               and texts which are not present in I(xml) are kept when the domain is redefined."
+            - "With C(full), the complete domain configuration is compared, except for nodes which match I(ignore), and
+               the domain is redefined from I(xml)."
+            - "Values are compared as strings, e.g. memory sizes have to be given in the unit libvirt uses for the
+               domain definition, usually KiB."
+        required: false
+        type: str
+    ignore:
+        default:
+            - /domain/uuid
+        description:
+            - "XPath expressions to XML nodes that are ignored when comparing I(xml) to existing domain configuration."
+            - "XPath expressions must return XML nodes only, e.g. '/domain/uuid'. Other XPath expressions, such as
+               '/domain/uuid/text()' are not supported."
+            - "When modifying a domain, ignored XML nodes will be taken from existing domain, i.e. they will not be
+               overwritten."
+            - "With I(compare) set to C(full), libvirt's defaults such as device addresses, controllers and mac
+               addresses have to be ignored unless I(xml) specifies them, else the domain is redefined in every run."
+        type: list
+    state:
+        choices: [present, absent]
+        default: present
+        description:
+            - "Should the domain be present or absent."
+            - "If domain does not exist and I(state) is C(present), then the domain will be defined, but not started.
+               Use M(community.libvirt.virt) to start the domain."
+            - "If domain does exist and I(state) is C(absent), then the domain will not be stopped prior to undefine.
+               Use M(community.libvirt.virt) to stop the domain."
+        type: str
+    xml:
+        description:
+            - "XML document used to define or modify the domain."
+            - "Must be raw XML content using C(lookup). XML cannot be reference to a file."
+            - "Either I(xml) or I(xmls) is required."
+        required: false
+        type: str
+    xmls:
+        description:
+            - "List of XML documents used to define or modify several domains in a single module run, instead of a single
+               I(xml). Existing domains are listed once instead of being looked up for each document and all documents
+               are reconciled using the same connection."
+            - "Options I(ignore) and I(state) apply to all documents."
+        elements: str
+        required: false
+        type: list
+
+notes:
+  - "I(xml) is compared to the persistent (inactive) configuration of a domain. For changes to take effect, a running
+     domain has to be restarted. To do so, e.g. call M(community.libvirt.virt) with 'C(state): I(shutdown)' and
+     'C(state): I(running)'."
+
+extends_documentation_fragment:
+  - jm1.libvirt.libvirt
+
+author: "Jakob Meng (@jm1)"
+'''
+
+EXAMPLES = r'''
+- name: Create or modify a domain
+  jm1.libvirt.domain_xml:
+    ignore:
+    - '/domain/uuid'
+    - '/domain/devices/*/address'
+    - '/domain/devices/controller'
+    - '/domain/devices/interface/mac'
+    state: present
+    xml: |
+      <domain type='kvm'>
+        <name>inf.h-brs.de</name>
+        <memory unit='MiB'>1024</memory>
+        <vcpu>2</vcpu>
+        <os>
+          <type arch='x86_64' machine='q35'>hvm</type>
+          <boot dev='hd'/>
+        </os>
+        <devices>
+          <disk type='volume' device='disk'>
+            <driver name='qemu' type='qcow2'/>
+            <source pool='default' volume='inf.h-brs.de.qcow2'/>
+            <target dev='vda' bus='virtio'/>
+          </disk>
+          <interface type='network'>
+            <source network='default'/>
+            <model type='virtio'/>
+          </interface>
+        </devices>
+      </domain>
+
+- name: Create or modify all domains defined in XML files of a directory on the controller
+  jm1.libvirt.domain_xml:
+    state: present
+    xmls: "{{ query('ansible.builtin.file', *query('ansible.builtin.fileglob', 'domains/*.xml')) }}"
+'''
+
+RETURN = r'''
+changes:
+    description:
+      - "XPath expressions to elements of the domain config which have been added, removed or changed, not including
+         ignored XML element tags. Children of changed elements are listed on their own."
+      - "In diff mode, the differing elements are shown only instead of the full XML dumps."
+    returned: changed
+    type: dict
+    sample:
+        added: ['/domain/devices/interface[2]']
+        removed: []
+        changed: ['/domain/memory']
+xml:
+    description: Full XML dump of libvirt's domain config, including ignored XML element tags
+    returned: changed or success
+    type: str
+    sample: |
+      <domain type='kvm'>
+        <name>inf.h-brs.de</name>
+        <uuid>0b0c3bfc-4f45-4a5a-8c1e-1f3c1e4b5f9e</uuid>
+        <memory unit='KiB'>1048576</memory>
+        <currentMemory unit='KiB'>1048576</currentMemory>
+        <vcpu placement='static'>2</vcpu>
+        ...
+      </domain>
+xmls:
+    description:
+      - "Results for each item of I(xmls), with keys I(changed), I(xml) and I(changes) as returned for I(xml)."
+      - "Items which failed have keys I(failed) and I(msg) instead. Other items are processed anyway and the
+         module fails after all items have been processed."
+    returned: always if I(xmls) is set
+    type: list
+    elements: dict
+'''
+
+# NOTE: Synchronize imports with DOCUMENTATION string above and chapter Requirements in roles/server/README.md
+from ansible_collections.jm1.libvirt.plugins.module_utils import libvirt as libvirt_utils
+from ansible.module_utils._text import to_native
+from ansible.module_utils.basic import AnsibleModule
+import traceback
+
+
+def core(module):
+    compare = module.params['compare']
+    ignore = module.params['ignore']
+    state = module.params['state']
+    uri = module.params['uri']
+    xml = module.params['xml']
+    xmls = module.params['xmls']
+
+    libvirt_utils.validate_xpaths(ignore)
+
+    if module.check_mode:
+        return dict(
+            changed=False,
+            compare=compare,
+            ignore=ignore,
+            state=state,
+            uri=uri,
+            xml=xml,
+            xmls=xmls)
+
+    result = dict(
+        compare=compare,
+        ignore=ignore,
+        state=state,
+        uri=uri)
+
+    return libvirt_utils.reconcile_xml_documents(module, 'domain', result, ignore, subset=(compare == 'subset'))
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            compare=dict(type='str', choices=['subset', 'full'], default='subset'),
+            ignore=dict(type='list', default=['/domain/uuid']),
+            state=dict(type='str', choices=['present', 'absent'], default='present'),
+            uri=dict(default='qemu:///system'),
+            broker_dir=dict(type='path'),
+            xml=dict(type='str'),
+            xmls=dict(type='list', elements='str')
+        ),
+        supports_check_mode=True,
+        mutually_exclusive=[
+            ['xml', 'xmls']
+        ],
+        required_one_of=[
+            ['xml', 'xmls']
+        ]
+    )
+
+    libvirt_utils.try_import(module)
+
+    try:
+        result = core(module)
+    except Exception as e:
+        module.fail_json(msg=to_native(e), exception=traceback.format_exc())
+    else:
+        if result.get('failed'):
+            module.fail_json(**result)
+        module.exit_json(**result)
+
+
+if __name__ == '__main__':
+    main()
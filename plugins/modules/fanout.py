@@ -0,0 +1,295 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# vim:set fileformat=unix shiftwidth=4 softtabstop=4 expandtab:
+# kate: end-of-line unix; space-indent on; indent-width 4; remove-trailing-spaces modified;
+
+# Copyright: (c) 2020, Jakob Meng <jakobmeng@web.de>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = r'''
+---
+
+module: fanout
+
+short_description: Create/Modify/Delete libvirt domains, networks and storage pools on several hypervisors at once.
+
+description:
+    - "This module applies the same XML documents of libvirt domains, networks or storage pools to several libvirt
+       daemons from a single module run or lists their domains, networks, storage pools and storage volumes."
+    - "Hypervisors are processed in parallel threads with one connection per uri, which avoids the startup costs of a
+       module run per hypervisor when a fleet of hypervisors is managed from the Ansible controller."
+    - "Documents are reconciled like M(jm1.libvirt.domain_xml), M(jm1.libvirt.net_xml) and M(jm1.libvirt.pool_xml) do,
+       but changes to existing objects are always applied by redefining them. Domains are compared like with
+       'C(compare): I(subset)' of M(jm1.libvirt.domain_xml)."
+
+requirements:
+    - libvirt (e.g. in debian package python3-libvirt)
+    - lxml (e.g. in debian package python3-lxml)
+    - futures (Python 2 only, e.g. in debian package python-concurrent.futures)
+
+options:
+    broker_dir:
+        description:
+            - "Directory for unix sockets of ssh tunnels to remote libvirt daemons, see M(jm1.libvirt.domain_xml)."
+        required: false
+        type: path
+    ignore:
+        description:
+            - "XPath expressions to XML nodes that are ignored when comparing documents to existing configuration."
+            - "Defaults to the I(ignore) defaults of M(jm1.libvirt.domain_xml), M(jm1.libvirt.net_xml) and
+               M(jm1.libvirt.pool_xml), depending on the root element of each document."
+        required: false
+        type: list
+    max_workers:
+        default: 16
+        description:
+            - "Maximum number of hypervisors which are processed in parallel."
+        required: false
+        type: int
+    state:
+        choices: [present, absent, query]
+        default: present
+        description:
+            - "Should the domains, networks or storage pools described by I(xml) or I(xmls) be present or absent."
+            - "If I(state) is C(query), then nothing is changed and the names of all domains, networks, storage pools
+               and storage volumes of each hypervisor are returned in I(hosts) instead."
+            - "Domains, networks and storage pools are neither started nor stopped, like with M(jm1.libvirt.domain_xml),
+               M(jm1.libvirt.net_xml) and M(jm1.libvirt.pool_xml)."
+        type: str
+    uris:
+        description:
+            - "libvirt connection uris of all hypervisors. Each uri must be given only once."
+        elements: str
+        required: true
+        type: list
+    xml:
+        description:
+            - "XML document of a domain, network or storage pool which is applied to all hypervisors."
+            - "Either I(xml) or I(xmls) is required if I(state) is C(present) or C(absent)."
+        required: false
+        type: str
+    xmls:
+        description:
+            - "List of XML documents which are applied to all hypervisors, instead of a single I(xml). Documents may
+               describe different kinds of objects, e.g. a network and the domains which are attached to it."
+        elements: str
+        required: false
+        type: list
+
+notes:
+  - "Failures on some hypervisors do not stop the other hypervisors from being processed. The module fails after all
+     hypervisors have been processed if any of them failed, with the results of all hypervisors in I(hosts)."
+
+author: "Jakob Meng (@jm1)"
+'''
+
+EXAMPLES = r'''
+- name: Create or modify a network on all hypervisors
+  jm1.libvirt.fanout:
+    uris: "{{ groups['hypervisors'] | map('regex_replace', '^(.*)$', 'qemu+ssh://\\1/system') | list }}"
+    xml: "{{ lookup('template', 'network.xml.j2') }}"
+  run_once: true
+  delegate_to: localhost
+
+- name: List domains, networks, storage pools and storage volumes of all hypervisors
+  jm1.libvirt.fanout:
+    uris:
+    - qemu+ssh://hypervisor-01/system
+    - qemu+ssh://hypervisor-02/system
+    state: query
+  register: fanout_result
+'''
+
+RETURN = r'''
+hosts:
+    description:
+      - "Results for each uri of I(uris)."
+      - "If I(state) is C(present) or C(absent), then each result has keys I(changed), I(xml) and I(changes) as returned
+         by M(jm1.libvirt.domain_xml) for I(xml) or key I(xmls) with a list of such results for I(xmls)."
+      - "If I(state) is C(query), then each result has keys I(domains), I(networks) and I(pools) with lists of dicts
+         with keys I(name) and I(active). Storage pools have an additional key I(volumes) with the names of their
+         storage volumes, which is empty for inactive storage pools."
+      - "Results of hypervisors which failed have keys I(failed) and I(msg) instead."
+    returned: always
+    type: dict
+    sample:
+        qemu+ssh://hypervisor-01/system:
+            changed: true
+            changes:
+                added: ['/network']
+                removed: []
+                changed: []
+            xml: "<network>...</network>"
+        qemu+ssh://hypervisor-02/system:
+            failed: true
+            msg: "Cannot recv data: ssh: connect to host hypervisor-02 port 22: Connection refused"
+'''
+
+# NOTE: Synchronize imports with DOCUMENTATION string above and chapter Requirements in roles/server/README.md
+from ansible_collections.jm1.libvirt.plugins.module_utils import libvirt as libvirt_utils
+from ansible.module_utils._text import to_native
+from ansible.module_utils.basic import AnsibleModule
+import traceback
+
+try:
+    from lxml import etree
+except ImportError:
+    # error handled in libvirt_utils.try_import() below
+    pass
+
+
+# Defaults for option ignore, by tag of the XML root node, synchronize with modules domain_xml, net_xml and pool_xml
+IGNORE_DEFAULTS = {
+    'domain': ['/domain/uuid'],
+    'network': ['/network/mac', '/network/uuid'],
+    'pool': ['/pool/uuid'],
+}
+
+
+def lookup_kind(xml):
+    """ Return kind of libvirt object, i.e. tag of the XML root node, which is described by xml string `xml` """
+    kind = etree.fromstring(xml).tag
+    if kind not in libvirt_utils.XML_OBJECTS:
+        raise ValueError("xml has root element '%s' but one of %s is required" %
+                         (kind, ', '.join("'%s'" % k for k in sorted(libvirt_utils.XML_OBJECTS))))
+    return kind
+
+
+def reconcile(conn, state, items, ignore):
+    results = []
+    for kind, xml in items:
+        changed, item_xml, changes, diff = libvirt_utils.reconcile_xml(
+            conn, kind, state, xml, IGNORE_DEFAULTS[kind] if ignore is None else ignore, subset=(kind == 'domain'))
+        results.append(dict(changed=changed, xml=item_xml, changes=changes, diff=diff))
+    return results
+
+
+def query(conn):
+    def describe(entry):
+        return dict(name=entry.name(), active=bool(entry.isActive()))
+
+    pools = []
+    for pool in conn.inventory.entries('pool'):
+        description = describe(pool)
+        description['volumes'] = []
+        if description['active']:
+            description['volumes'] = sorted(volume.name() for volume in conn.inventory.volumes_of(pool))
+        pools.append(description)
+
+    return dict(
+        domains=sorted((describe(domain) for domain in conn.inventory.entries('domain')), key=lambda e: e['name']),
+        networks=sorted((describe(network) for network in conn.inventory.entries('network')), key=lambda e: e['name']),
+        pools=sorted(pools, key=lambda e: e['name']))
+
+
+def core(module):
+    ignore = module.params['ignore']
+    max_workers = module.params['max_workers']
+    state = module.params['state']
+    uris = module.params['uris']
+    xml = module.params['xml']
+    xmls = module.params['xmls']
+
+    if ignore is not None:
+        libvirt_utils.validate_xpaths(ignore)
+
+    duplicates = sorted(set(uri for uri in uris if uris.count(uri) > 1))
+    if duplicates:
+        raise ValueError('uris must be unique but contain duplicates: %s' % ', '.join(duplicates))
+
+    # fail early on invalid documents instead of once per hypervisor
+    items = [] if state == 'query' else [(lookup_kind(item), item) for item in ([xml] if xmls is None else xmls)]
+
+    if module.check_mode and state != 'query':
+        return dict(
+            changed=False,
+            ignore=ignore,
+            state=state,
+            uris=uris,
+            xml=xml,
+            xmls=xmls)
+
+    def process(uri):
+        try:
+            with libvirt_utils.Connection(uri, module) as conn:
+                if state == 'query':
+                    return query(conn)
+                return reconcile(conn, state, items, ignore)
+        except Exception as e:
+            return dict(failed=True, msg=to_native(e))
+
+    hosts = dict(zip(uris, libvirt_utils.map_parallel(process, uris, max_workers)))
+
+    diffs = []
+    for uri, results in hosts.items():
+        if state == 'query' or isinstance(results, dict):
+            # inventory or failure
+            continue
+
+        if module._diff:
+            diffs.extend(dict(item['diff'], before_header=uri, after_header=uri) for item in results if item['diff'])
+
+        if xmls is None:
+            hosts[uri] = dict(changed=results[0]['changed'], xml=results[0]['xml'], changes=results[0]['changes'])
+        else:
+            hosts[uri] = dict(
+                changed=any(item['changed'] for item in results),
+                xmls=[dict(changed=item['changed'], xml=item['xml'], changes=item['changes']) for item in results])
+
+    result = dict(
+        changed=any(host.get('changed', False) for host in hosts.values()),
+        hosts=hosts,
+        ignore=ignore,
+        state=state,
+        uris=uris,
+        xml=xml,
+        xmls=xmls)
+
+    if module._diff and diffs:
+        result['diff'] = diffs
+
+    return libvirt_utils.fail_items(result, 'hosts')
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            broker_dir=dict(type='path'),
+            ignore=dict(type='list'),
+            max_workers=dict(type='int', default=16),
+            state=dict(type='str', choices=['present', 'absent', 'query'], default='present'),
+            uris=dict(type='list', elements='str', required=True),
+            xml=dict(type='str'),
+            xmls=dict(type='list', elements='str')
+        ),
+        supports_check_mode=True,
+        mutually_exclusive=[
+            ['xml', 'xmls']
+        ],
+        required_if=[
+            ['state', 'present', ['xml', 'xmls'], True],
+            ['state', 'absent', ['xml', 'xmls'], True]
+        ]
+    )
+
+    libvirt_utils.try_import(module)
+
+    try:
+        result = core(module)
+    except Exception as e:
+        module.fail_json(msg=to_native(e), exception=traceback.format_exc())
+    else:
+        if result.get('failed'):
+            module.fail_json(**result)
+        module.exit_json(**result)
+
+
+if __name__ == '__main__':
+    main()
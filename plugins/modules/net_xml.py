@@ -41,6 +41,16 @@ options:
             - "When modifying a network, ignored XML nodes will be taken from existing network, i.e. they will not be
                overwritten."
         type: list
+    live_update:
+        default: true
+        description:
+            - "Apply changes to DHCP hosts and ranges, DNS hosts, TXT and SRV records, port groups and forward
+               interfaces and physical functions of an existing network with C(virNetworkUpdate) instead of redefining
+               the network. Changes apply to both the persistent config and, if the network is active, to the running
+               network without restarting it."
+            - "Other changes, e.g. to the bridge or to ip addresses, are applied by redefining the network."
+        required: false
+        type: bool
     state:
         choices: [present, absent]
         default: present
@@ -55,12 +65,23 @@ options:
         description:
             - "XML document used to define or modify the network."
             - "Must be raw XML content using C(lookup). XML cannot be reference to a file."
-        required: true
+            - "Either I(xml) or I(xmls) is required."
+        required: false
         type: str
+    xmls:
+        description:
+            - "List of XML documents used to define or modify several networks in a single module run, instead of a single
+               I(xml). Existing networks are listed once instead of being looked up for each document and all documents
+               are reconciled using the same connection."
+            - "Options I(ignore) and I(state) apply to all documents."
+        elements: str
+        required: false
+        type: list
 
 notes:
-  - "For changes to take effect, a modified network might have to be restarted. To do so, e.g. call
-     M(community.libvirt.virt_net) with 'C(command): I(stop)' and 'C(command): I(start)'."
+  - "For changes which have not been applied with I(live_update) to take effect, a modified network might have to be
+     restarted. To do so, e.g. call M(community.libvirt.virt_net) with 'C(command): I(stop)' and
+     'C(command): I(start)'."
 
 extends_documentation_fragment:
   - jm1.libvirt.libvirt
@@ -84,9 +105,25 @@ EXAMPLES = r'''
           </dhcp>
         </ip>
       </network>
+
+- name: Create or modify all networks defined in XML files of a directory on the controller
+  jm1.libvirt.net_xml:
+    state: present
+    xmls: "{{ query('ansible.builtin.file', *query('ansible.builtin.fileglob', 'networks/*.xml')) }}"
 '''
 
 RETURN = r'''
+changes:
+    description:
+      - "XPath expressions to elements of the network config which have been added, removed or changed, not including
+         ignored XML element tags. Children of changed elements are listed on their own."
+      - "In diff mode, the differing elements are shown only instead of the full XML dumps."
+    returned: changed
+    type: dict
+    sample:
+        added: ['/network/ip/dhcp/host[3]']
+        removed: []
+        changed: ['/network/ip/dhcp/host[1]']
 xml:
     description: Full XML dump of libvirt's network config, including ignored XML element tags
     returned: changed or success
@@ -104,6 +141,14 @@ xml:
           </dhcp>
         </ip>
       </network>
+xmls:
+    description:
+      - "Results for each item of I(xmls), with keys I(changed), I(xml) and I(changes) as returned for I(xml)."
+      - "Items which failed have keys I(failed) and I(msg) instead. Other items are processed anyway and the
+         module fails after all items have been processed."
+    returned: always if I(xmls) is set
+    type: list
+    elements: dict
 '''
 
 # NOTE: Synchronize imports with DOCUMENTATION string above and chapter Requirements in roles/server/README.md
@@ -112,12 +157,6 @@ from ansible.module_utils._text import to_native
 from ansible.module_utils.basic import AnsibleModule
 import traceback
 
-try:
-    import libvirt
-except ImportError:
-    # error handled in libvirt_utils.try_import() below
-    pass
-
 try:
     from lxml import etree
 except ImportError:
@@ -125,126 +164,182 @@ except ImportError:
     pass
 
 
-def lookup_uuid(xml):
-    uuids = xml.xpath('/network/uuid')
-    if len(uuids) > 1:
-        raise ValueError("network config is invalid: xml has more than one 'uuid' element")
-
-    if uuids:
-        return uuids[0].text
-
-    return None
-
-
-def lookup_name(xml):
-    names = xml.xpath('/network/name')
-    if len(names) > 1:
-        raise ValueError("network config is invalid: xml has more than one 'name' element")
-
-    if names:
-        return names[0].text
-
-    return None
-
-
-def lookup_uuid_and_name(xml):
-    uuid = lookup_uuid(xml)
-    name = lookup_name(xml)
-
-    if not uuid and not name:
-        raise ValueError("network config is invalid: xml requires an 'uuid', an 'name' element or both")
-
-    return uuid, name
-
-
-def lookup_network(conn, uuid, name):
-    try:
-        if uuid:
-            return conn.networkLookupByUUIDString(uuid)
-        elif name:
-            return conn.networkLookupByName(name)
-    except libvirt.libvirtError as e:
-        if e.get_error_code() != libvirt.VIR_ERR_NO_NETWORK:
-            raise
-    return None
-
-
-def create_or_modify(ignore_xpaths, uri, xml, module):
-    xml_root = etree.fromstring(xml)
-    uuid, name = lookup_uuid_and_name(xml_root)
-
-    with libvirt_utils.Connection(uri, module) as conn:
-        network = lookup_network(conn, uuid, name)
-
-        if not network:
-            # create
-            network = conn.networkDefineXML(xml)
-            return True, network.XMLDesc(flags=libvirt.VIR_NETWORK_XML_INACTIVE)
+# Sections of network config which can be changed with virNetwork.update(), by path of tags to the updated element
+#
+# enum virNetworkUpdateSection {
+#     VIR_NETWORK_SECTION_NONE              = 0 (0x0)   : invalid
+#     VIR_NETWORK_SECTION_BRIDGE            = 1 (0x1)   : <bridge>
+#     VIR_NETWORK_SECTION_DOMAIN            = 2 (0x2)   : <domain>
+#     VIR_NETWORK_SECTION_IP                = 3 (0x3)   : <ip>
+#     VIR_NETWORK_SECTION_IP_DHCP_HOST      = 4 (0x4)   : <ip>/<dhcp>/<host>
+#     VIR_NETWORK_SECTION_IP_DHCP_RANGE     = 5 (0x5)   : <ip>/<dhcp>/<range>
+#     VIR_NETWORK_SECTION_FORWARD           = 6 (0x6)   : <forward>
+#     VIR_NETWORK_SECTION_FORWARD_INTERFACE = 7 (0x7)   : <forward>/<interface>
+#     VIR_NETWORK_SECTION_FORWARD_PF        = 8 (0x8)   : <forward>/<pf>
+#     VIR_NETWORK_SECTION_PORTGROUP         = 9 (0x9)   : <portgroup>
+#     VIR_NETWORK_SECTION_DNS_HOST          = 10 (0xa)  : <dns>/<host>
+#     VIR_NETWORK_SECTION_DNS_TXT           = 11 (0xb)  : <dns>/<txt>
+#     VIR_NETWORK_SECTION_DNS_SRV           = 12 (0xc)  : <dns>/<srv>
+#     VIR_NETWORK_SECTION_LAST              = 13 (0xd)
+# }
+#
+# Ref.: https://libvirt.org/html/libvirt-libvirt-network.html#virNetworkUpdateSection
+NETWORK_UPDATE_SECTIONS = {
+    'network/ip/dhcp/host': 4,
+    'network/ip/dhcp/range': 5,
+    'network/forward/interface': 7,
+    'network/forward/pf': 8,
+    'network/portgroup': 9,
+    'network/dns/host': 10,
+    'network/dns/txt': 11,
+    'network/dns/srv': 12,
+}
+
+
+def lookup_update_section(element):
+    """ Return virNetworkUpdateSection and the element of that section which contains `element` or (None, None) """
+    elements = [element] + list(element.iterancestors())
+    elements.reverse()
+
+    for depth in range(len(elements), 0, -1):
+        section = NETWORK_UPDATE_SECTIONS.get('/'.join(e.tag for e in elements[:depth]))
+        if section:
+            return section, elements[depth - 1]
+    return None, None
+
+
+def plan_updates(old_xml, new_xml, ignore_xpaths):
+    """ Return list of arguments (command, section, parent_index, xml) to virNetwork.update() which change network
+        config `old_xml` to `new_xml` or None if some changes can only be applied by redefining the network """
+
+    old_root = libvirt_utils.parse_xml(old_xml, ignore_xpaths)
+    new_root = libvirt_utils.parse_xml(new_xml, ignore_xpaths)
+    pairs = []
+    differences = libvirt_utils.xml_diff_elements(old_root, new_root, pairs)
+    old_to_new = dict(pairs)
+    new_to_old = dict((new, old) for old, new in pairs)
+
+    # changed sections as tuples (section, old_element, new_element)
+    sections = []
+    for change, old, new, old_parent in differences:
+        section, element = lookup_update_section(new if change == 'added' else old)
+        if not section:
+            return None
+
+        if change == 'added' and element is new:
+            sections.append((section, None, new))
+        elif change == 'removed' and element is old:
+            sections.append((section, old, None))
+        elif change == 'added':
+            # children of section element have been added
+            sections.append((section, new_to_old[element], element))
         else:
-            # maybe modify
-            old_xml = network.XMLDesc(flags=libvirt.VIR_NETWORK_XML_INACTIVE)
-
-            if libvirt_utils.xml_strings_equal(old_xml, xml, ignore_xpaths):
-                # network does not require update
-                return False, old_xml
-
-            xml = libvirt_utils.update_xml_desc(old_xml, xml, ignore_xpaths)
-            network = conn.networkDefineXML(xml)
-            return True, network.XMLDesc(flags=libvirt.VIR_NETWORK_XML_INACTIVE)
-
-
-def delete(ignore_xpaths, uri, xml, module):
-    xml_root = etree.fromstring(xml)
-    uuid, name = lookup_uuid_and_name(xml_root)
-
-    with libvirt_utils.Connection(uri, module) as conn:
-        network = lookup_network(conn, uuid, name)
-
-        if not network:
-            # network absent already
-            return False, None
-
-        xml = network.XMLDesc(flags=libvirt.VIR_NETWORK_XML_INACTIVE)  # fetch xml before deletion
-        network.undefine()
-        return True, xml
+            # section element or its children have been changed or removed
+            sections.append((section, element, old_to_new[element]))
+
+    # enum virNetworkUpdateCommand {
+    #     VIR_NETWORK_UPDATE_COMMAND_NONE      = 0 (0x0) : (invalid)
+    #     VIR_NETWORK_UPDATE_COMMAND_MODIFY    = 1 (0x1) : modify an existing element
+    #     VIR_NETWORK_UPDATE_COMMAND_DELETE    = 2 (0x2) : delete an existing element
+    #     VIR_NETWORK_UPDATE_COMMAND_ADD_LAST  = 3 (0x3) : add an element at end of list
+    #     VIR_NETWORK_UPDATE_COMMAND_ADD_FIRST = 4 (0x4) : add an element at start of list
+    #     VIR_NETWORK_UPDATE_COMMAND_LAST      = 5 (0x5)
+    # }
+    #
+    # Ref.: https://libvirt.org/html/libvirt-libvirt-network.html#virNetworkUpdateCommand
+    deletions = []
+    additions = []
+    for section, old, new in sections:
+        parent_index = -1
+        if section in [4, 5]:
+            # index of ip element in old network config
+            ip = (old if old is not None else new).getparent().getparent()
+            ip = new_to_old.get(ip, ip)
+            parent_index = [e for e in ip.getparent() if e.tag == 'ip'].index(ip)
+
+        # changed elements are replaced, because matching rules of VIR_NETWORK_UPDATE_COMMAND_MODIFY differ per section
+        if old is not None:
+            update = (2, section, parent_index, to_native(etree.tostring(old)))
+            if update not in deletions:
+                deletions.append(update)
+        if new is not None:
+            update = (3, section, parent_index, to_native(etree.tostring(new)))
+            if update not in additions:
+                additions.append(update)
+
+    return deletions + additions
+
+
+def apply_updates(network, old_xml, new_xml, ignore_xpaths):
+    """ Apply changes from `old_xml` to `new_xml` with virNetwork.update(), return False if some changes require
+        redefining the network """
+
+    updates = plan_updates(old_xml, new_xml, ignore_xpaths)
+    if not updates:
+        return False
+
+    # enum virNetworkUpdateFlags {
+    #     VIR_NETWORK_UPDATE_AFFECT_CURRENT = 0 (0x0) : affect live if network is active, config if it's not active
+    #     VIR_NETWORK_UPDATE_AFFECT_LIVE    = 1 (0x1) : affect live state of network only
+    #     VIR_NETWORK_UPDATE_AFFECT_CONFIG  = 2 (0x2) : affect persistent config only
+    # }
+    #
+    # Ref.: https://libvirt.org/html/libvirt-libvirt-network.html#virNetworkUpdateFlags
+    flags = 2 | (1 if network.isActive() else 0)
+
+    for command, section, parent_index, update_xml in updates:
+        network.update(command, section, parent_index, update_xml, flags)
+    return True
 
 
 def core(module):
     ignore = module.params['ignore']
+    live_update = module.params['live_update']
     state = module.params['state']
     uri = module.params['uri']
     xml = module.params['xml']
+    xmls = module.params['xmls']
+
+    libvirt_utils.validate_xpaths(ignore)
 
     if module.check_mode:
         return dict(
             changed=False,
             ignore=ignore,
+            live_update=live_update,
             state=state,
             uri=uri,
-            xml=xml)
+            xml=xml,
+            xmls=xmls)
 
-    if state == 'present':
-        changed, xml = create_or_modify(ignore, uri, xml, module)
-    elif state == 'absent':
-        changed, xml = delete(ignore, uri, xml, module)
-
-    return dict(
-        changed=changed,
+    result = dict(
         ignore=ignore,
+        live_update=live_update,
         state=state,
-        uri=uri,
-        xml=xml)
+        uri=uri)
+
+    return libvirt_utils.reconcile_xml_documents(module, 'network', result, ignore,
+                                                 apply_updates if live_update else None)
 
 
 def main():
     module = AnsibleModule(
         argument_spec=dict(
             ignore=dict(type='list', default=['/network/mac', '/network/uuid']),
+            live_update=dict(type='bool', default=True),
             state=dict(type='str', choices=['present', 'absent'], default='present'),
             uri=dict(default='qemu:///system'),
-            xml=dict(required=True, type='str')
+            broker_dir=dict(type='path'),
+            xml=dict(type='str'),
+            xmls=dict(type='list', elements='str')
         ),
-        supports_check_mode=True
+        supports_check_mode=True,
+        mutually_exclusive=[
+            ['xml', 'xmls']
+        ],
+        required_one_of=[
+            ['xml', 'xmls']
+        ]
     )
 
     libvirt_utils.try_import(module)
@@ -254,6 +349,8 @@ def main():
     except Exception as e:
         module.fail_json(msg=to_native(e), exception=traceback.format_exc())
     else:
+        if result.get('failed'):
+            module.fail_json(**result)
         module.exit_json(**result)
 
 
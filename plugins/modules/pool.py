@@ -26,9 +26,22 @@ description:
        It is based on Ansible module community.libvirt.virt_pool from Maciej Delmanowski <drybjed@gmail.com>."
 
 requirements:
-   - virsh (e.g. in debian package libvirt-clients)
+   - virsh (e.g. in debian package libvirt-clients), unless hardware is defined with libvirt only
 
 options:
+    backend:
+        choices: [auto, libvirt, virsh]
+        default: auto
+        description:
+            - "How to define the storage pool. With C(libvirt), the storage pool XML is generated from I(hardware) and
+               defined with libvirt directly, which avoids starting C(virsh) for each pool. With C(virsh),
+               C(virsh pool-define-as) is called with I(hardware) as command line arguments. With C(auto), libvirt is
+               used if all arguments in I(hardware) are supported by it and C(virsh) otherwise."
+            - "Supported with C(libvirt) are C(type), C(source_host), C(source_initiator), C(source_dev),
+               C(source_path), C(source_format), C(source_name), C(auth_type), C(auth_username), C(secret_usage),
+               C(secret_uuid), C(source_protocol_ver) and C(target). Flags C(build) and C(print_xml) are ignored."
+        required: false
+        type: str
     name:
         description:
             - "Name or UUID of the storage pool."
@@ -49,6 +62,11 @@ options:
         description:
             - "Should the pool be present or absent."
         type: str
+    timeout:
+        default: 60
+        description:
+            - "Maximum time in seconds to wait for a storage pool to appear after it has been defined with C(virsh)."
+        type: int
 
 notes:
   - "No modifications are applied to existing pools; module is skipped if pool exists already."
@@ -63,6 +81,16 @@ EXAMPLES = r'''
 - jm1.libvirt.pool:
     name: default
     hardware: [{ 'type': 'dir', 'target': '/var/lib/libvirt/images' }]
+
+- jm1.libvirt.pool:
+    name: nfs
+    backend: libvirt
+    hardware:
+    - type: netfs
+    - source_host: nfs.home.arpa
+    - source_path: /srv/images
+    - source_format: nfs
+    - target: /var/lib/libvirt/nfs
 '''
 
 RETURN = r'''
@@ -89,62 +117,144 @@ available:
 from ansible_collections.jm1.libvirt.plugins.module_utils import libvirt as libvirt_utils
 from ansible.module_utils._text import to_native
 from ansible.module_utils.basic import AnsibleModule
-import time
+from ansible.module_utils.six import iteritems
 import traceback
 
 try:
-    import libvirt
+    from lxml import etree
 except ImportError:
     # error handled in libvirt_utils.try_import() below
     pass
 
+# arguments of 'virsh pool-define-as' which are translated to storage pool XML
+POOL_XML_ARGS = ['type', 'source_host', 'source_initiator', 'source_dev', 'source_path', 'source_format',
+                 'source_name', 'auth_type', 'auth_username', 'secret_usage', 'secret_uuid', 'source_protocol_ver',
+                 'target']
+
+# arguments of 'virsh pool-define-as' which are removed before a storage pool is defined
+POOL_FORBIDDEN_ARGS = ['build', 'print_xml']
+
+
+def make_pool_xml(pool_name, hardware):
+    """ Return storage pool XML for arguments of 'virsh pool-define-as' and a list of arguments which are not supported
+
+        Elements are generated in the same way as 'virsh pool-define-as --print-xml' does.
+    """
+    args = {}
+    unsupported = []
+    for item in hardware or []:
+        if not isinstance(item, dict):
+            unsupported.append(str(item))
+            continue
+
+        for key, value in iteritems(item):
+            key = key.replace('-', '_')
+            if key in POOL_FORBIDDEN_ARGS and value is None:
+                continue
+            if key in POOL_XML_ARGS and value is not None:
+                args[key] = to_native(value)
+                continue
+
+            key = key.replace('_', '-')
+            unsupported.append('--%s %s' % (key, value) if value is not None else '--%s' % key)
+
+    if 'type' not in args:
+        unsupported.append('missing --type')
+
+    if unsupported:
+        return None, unsupported
+
+    pool = etree.Element('pool', type=args['type'])
+    etree.SubElement(pool, 'name').text = pool_name
+
+    source = etree.Element('source')
+    if 'source_host' in args:
+        etree.SubElement(source, 'host', name=args['source_host'])
+    if 'source_initiator' in args:
+        initiator = etree.SubElement(source, 'initiator')
+        etree.SubElement(initiator, 'iqn', name=args['source_initiator'])
+    if 'source_dev' in args:
+        etree.SubElement(source, 'device', path=args['source_dev'])
+    if 'source_path' in args:
+        etree.SubElement(source, 'dir', path=args['source_path'])
+    if 'source_format' in args:
+        etree.SubElement(source, 'format', type=args['source_format'])
+    if 'source_name' in args:
+        etree.SubElement(source, 'name').text = args['source_name']
+    if 'auth_type' in args:
+        auth = etree.SubElement(source, 'auth', type=args['auth_type'])
+        if 'auth_username' in args:
+            auth.set('username', args['auth_username'])
+        secret = etree.SubElement(auth, 'secret')
+        if 'secret_usage' in args:
+            secret.set('usage', args['secret_usage'])
+        if 'secret_uuid' in args:
+            secret.set('uuid', args['secret_uuid'])
+    if 'source_protocol_ver' in args:
+        etree.SubElement(source, 'protocol', ver=args['source_protocol_ver'])
+
+    if len(source):
+        pool.append(source)
+
+    if 'target' in args:
+        target = etree.SubElement(pool, 'target')
+        etree.SubElement(target, 'path').text = args['target']
+
+    return to_native(etree.tostring(pool)), unsupported
+
 
 def create(uri,
            pool_name,
            pool_hardware,
+           backend,
+           timeout,
            module):
 
     with libvirt_utils.Connection(uri, module) as conn:
-        pools = conn.listAllStoragePools()
-        pool = next((pool for pool in pools if pool.name() == pool_name), None)
+        pool = conn.inventory.pool(pool_name)
         if pool:
             # Pool present already
             if not pool.isActive():
                 pool.create(0)
+                conn.inventory.invalidate(pool)
 
-            pool_state, pool_capacity, pool_allocation, pool_available = pool.info()
+            pool_state, pool_capacity, pool_allocation, pool_available = conn.inventory.info(pool)
             return False, pool_capacity, pool_allocation, pool_available
 
-        virsh_args = libvirt_utils.to_cli_args(pool_hardware)
+        if backend in ['auto', 'libvirt']:
+            xml, unsupported = make_pool_xml(pool_name, pool_hardware)
+            if not xml and backend == 'libvirt':
+                raise ValueError('hardware arguments are not supported by libvirt backend: %s' % ', '.join(unsupported))
+        else:
+            xml = None
 
-        # Remove forbidden args
-        for arg in ['--build', '--print-xml']:
-            virsh_args = list(filter(lambda x: x != arg, virsh_args))
+        pool = None
+        try:
+            if xml:
+                pool = conn.storagePoolDefineXML(xml, 0)
+            else:
+                virsh_args = libvirt_utils.to_cli_args(pool_hardware)
 
-        # Create, start and build pool
-        cmd = """
-            virsh
-                --connect '{uri}'
-                pool-define-as
-                --name '{pool_name}'
-                {virsh_args}
-            """.replace('\n', ' ').format(uri=uri,
-                                          pool_name=pool_name,
-                                          virsh_args=' '.join(virsh_args))
+                # Remove forbidden args
+                for arg in ['--build', '--print-xml']:
+                    virsh_args = list(filter(lambda x: x != arg, virsh_args))
 
-        module.run_command(cmd, check_rc=True)
+                # Define pool
+                cmd = """
+                    virsh
+                        --connect '{uri}'
+                        pool-define-as
+                        --name '{pool_name}'
+                        {virsh_args}
+                    """.replace('\n', ' ').format(uri=uri,
+                                                  pool_name=pool_name,
+                                                  virsh_args=' '.join(virsh_args))
 
-        try:
-            # Wait until pool has been created
-            while True:
+                module.run_command(cmd, check_rc=True)
 
-                try:
-                    pool = conn.storagePoolLookupByName(pool_name)
-                    break
-                except libvirt.libvirtError as e:
-                    if e.get_error_code() != 49:  # VIR_ERR_NO_STORAGE_POOL
-                        raise
-                time.sleep(1)
+                # Wait until pool has been defined by virsh
+                pool = libvirt_utils.wait_for(lambda: libvirt_utils.lookup_pool_by_name(conn, pool_name),
+                                              timeout, 'definition of storage pool %s' % pool_name)
 
             # enum virStoragePoolCreateFlags {
             #     VIR_STORAGE_POOL_CREATE_NORMAL                  = 0 (0x0)         : Create the pool and perform pool build without any flags
@@ -160,6 +270,7 @@ def create(uri,
             # Ref.: https://libvirt.org/html/libvirt-libvirt-storage.html#virStoragePoolCreateFlags
             pool.create(1)
             pool.setAutostart(True)
+            conn.inventory.invalidate(pool)
 
             pool_state, pool_capacity, pool_allocation, pool_available = pool.info()
             return True, pool_capacity, pool_allocation, pool_available
@@ -168,13 +279,8 @@ def create(uri,
         except:  # noqa: E722
             try:
                 # Destroy (stop) pool if creation failed
-                cmd = """
-                    virsh
-                        --connect '{uri}'
-                        pool-destroy
-                        '{pool_name}'
-                    """.replace('\n', ' ').format(uri=uri, pool_name=pool_name)
-                module.run_command(cmd, check_rc=True)
+                if pool and pool.isActive():
+                    pool.destroy()
 
             # bare 'except' is no issue because we reraise the outer exception unconditionally below
             except:  # noqa: E722
@@ -190,8 +296,7 @@ def delete(uri,
            module):
 
     with libvirt_utils.Connection(uri, module) as conn:
-        pools = conn.listAllStoragePools()
-        pool = next((pool for pool in pools if pool.name() == pool_name), None)
+        pool = conn.inventory.pool(pool_name)
         if not pool:
             # Pool absent already
             return False, None, None, None
@@ -208,7 +313,7 @@ def delete(uri,
         # }
         #
         # Ref.: https://libvirt.org/html/libvirt-libvirt-storage.html#virStoragePoolState
-        pool_state, pool_capacity, pool_allocation, pool_available = pool.info()
+        pool_state, pool_capacity, pool_allocation, pool_available = conn.inventory.info(pool)
 
         # Stop pool
         if pool.isActive():
@@ -216,6 +321,7 @@ def delete(uri,
 
         # Undefine pool
         pool.undefine()
+        conn.inventory.invalidate(pool)
 
         return True, pool_capacity, pool_allocation, pool_available
 
@@ -225,6 +331,8 @@ def core(module):
     uri = module.params['uri']
     pool_name = module.params['name']
     pool_hardware = module.params['hardware']
+    backend = module.params['backend']
+    timeout = module.params['timeout']
 
     if module.check_mode:
         return dict(
@@ -232,12 +340,15 @@ def core(module):
             state=state,
             uri=uri,
             name=pool_name,
-            hardware=pool_hardware)
+            hardware=pool_hardware,
+            backend=backend)
 
     if state == 'present':
         changed, pool_capacity, pool_allocation, pool_available = create(
             uri,
             pool_name, pool_hardware,
+            backend,
+            timeout,
             module)
     elif state == 'absent':
         changed, pool_capacity, pool_allocation, pool_available = delete(
@@ -251,6 +362,7 @@ def core(module):
         uri=uri,
         name=pool_name,
         hardware=pool_hardware,
+        backend=backend,
         capacity=(int(pool_capacity) if pool_capacity is not None else None),
         allocation=(int(pool_allocation) if pool_allocation is not None else None),
         available=(int(pool_available) if pool_available is not None else None)
@@ -262,8 +374,11 @@ def main():
         argument_spec=dict(
             state=dict(type='str', choices=['present', 'absent'], default='present'),
             uri=dict(default='qemu:///system'),
+            broker_dir=dict(type='path'),
             name=dict(required=True, type='str'),
-            hardware=dict(type='list')
+            hardware=dict(type='list'),
+            backend=dict(type='str', choices=['auto', 'libvirt', 'virsh'], default='auto'),
+            timeout=dict(type='int', default=60)
         ),
         supports_check_mode=True,
     )
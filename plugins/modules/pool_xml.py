@@ -54,8 +54,18 @@ options:
         description:
             - "XML document used to define or modify the pool."
             - "Must be raw XML content using C(lookup). XML cannot be reference to a file."
-        required: true
+            - "Either I(xml) or I(xmls) is required."
+        required: false
         type: str
+    xmls:
+        description:
+            - "List of XML documents used to define or modify several pools in a single module run, instead of a single
+               I(xml). Existing pools are listed once instead of being looked up for each document and all documents
+               are reconciled using the same connection."
+            - "Options I(ignore) and I(state) apply to all documents."
+        elements: str
+        required: false
+        type: list
 
 notes:
   - "For changes to take effect, a modified pool has to be restarted. To do so, e.g. call M(community.libvirt.virt_pool)
@@ -88,9 +98,25 @@ EXAMPLES = r'''
           </permissions>
         </target>
       </pool>
+
+- name: Create or modify all pools defined in XML files of a directory on the controller
+  jm1.libvirt.pool_xml:
+    state: present
+    xmls: "{{ query('ansible.builtin.file', *query('ansible.builtin.fileglob', 'pools/*.xml')) }}"
 '''
 
 RETURN = r'''
+changes:
+    description:
+      - "XPath expressions to elements of the pool config which have been added, removed or changed, not including
+         ignored XML element tags. Children of changed elements are listed on their own."
+      - "In diff mode, the differing elements are shown only instead of the full XML dumps."
+    returned: changed
+    type: dict
+    sample:
+        added: []
+        removed: []
+        changed: ['/pool/target/permissions/mode']
 xml:
     description: Full XML dump of libvirt's storage pool config, including ignored XML element tags
     returned: changed or success
@@ -113,6 +139,14 @@ xml:
           </permissions>
         </target>
       </pool>
+xmls:
+    description:
+      - "Results for each item of I(xmls), with keys I(changed), I(xml) and I(changes) as returned for I(xml)."
+      - "Items which failed have keys I(failed) and I(msg) instead. Other items are processed anyway and the
+         module fails after all items have been processed."
+    returned: always if I(xmls) is set
+    type: list
+    elements: dict
 '''
 
 # NOTE: Synchronize imports with DOCUMENTATION string above and chapter Requirements in roles/server/README.md
@@ -121,108 +155,15 @@ from ansible.module_utils._text import to_native
 from ansible.module_utils.basic import AnsibleModule
 import traceback
 
-try:
-    import libvirt
-except ImportError:
-    # error handled in libvirt_utils.try_import() below
-    pass
-
-try:
-    from lxml import etree
-except ImportError:
-    # error handled in libvirt_utils.try_import() below
-    pass
-
-
-def lookup_uuid(xml):
-    uuids = xml.xpath('/pool/uuid')
-    if len(uuids) > 1:
-        raise ValueError("storage pool config is invalid: xml has more than one 'uuid' element")
-
-    if uuids:
-        return uuids[0].text
-
-    return None
-
-
-def lookup_name(xml):
-    names = xml.xpath('/pool/name')
-    if len(names) > 1:
-        raise ValueError("storage pool config is invalid: xml has more than one 'name' element")
-
-    if names:
-        return names[0].text
-
-    return None
-
-
-def lookup_uuid_and_name(xml):
-    uuid = lookup_uuid(xml)
-    name = lookup_name(xml)
-
-    if not uuid and not name:
-        raise ValueError("storage pool config is invalid: xml requires an 'uuid', an 'name' element or both")
-
-    return uuid, name
-
-
-def lookup_storage_pool(conn, uuid, name):
-    try:
-        if uuid:
-            return conn.storagePoolLookupByUUIDString(uuid)
-        elif name:
-            return conn.storagePoolLookupByName(name)
-    except libvirt.libvirtError as e:
-        if e.get_error_code() != libvirt.VIR_ERR_NO_STORAGE_POOL:
-            raise
-    return None
-
-
-def create_or_modify(ignore_xpaths, uri, xml, module):
-    xml_root = etree.fromstring(xml)
-    uuid, name = lookup_uuid_and_name(xml_root)
-
-    with libvirt_utils.Connection(uri, module) as conn:
-        pool = lookup_storage_pool(conn, uuid, name)
-
-        if not pool:
-            # create
-            pool = conn.storagePoolDefineXML(xml)
-            return True, pool.XMLDesc(flags=libvirt.VIR_STORAGE_XML_INACTIVE)
-        else:
-            # maybe modify
-            old_xml = pool.XMLDesc(flags=libvirt.VIR_STORAGE_XML_INACTIVE)
-
-            if libvirt_utils.xml_strings_equal(old_xml, xml, ignore_xpaths):
-                # pool does not require update
-                return False, old_xml
-
-            xml = libvirt_utils.update_xml_desc(old_xml, xml, ignore_xpaths)
-            pool = conn.storagePoolDefineXML(xml)
-            return True, pool.XMLDesc(flags=libvirt.VIR_STORAGE_XML_INACTIVE)
-
-
-def delete(ignore_xpaths, uri, xml, module):
-    xml_root = etree.fromstring(xml)
-    uuid, name = lookup_uuid_and_name(xml_root)
-
-    with libvirt_utils.Connection(uri, module) as conn:
-        pool = lookup_storage_pool(conn, uuid, name)
-
-        if not pool:
-            # pool absent already
-            return False, None
-
-        xml = pool.XMLDesc(flags=libvirt.VIR_STORAGE_XML_INACTIVE)  # fetch xml before deletion
-        pool.undefine()
-        return True, xml
-
 
 def core(module):
     ignore = module.params['ignore']
     state = module.params['state']
     uri = module.params['uri']
     xml = module.params['xml']
+    xmls = module.params['xmls']
+
+    libvirt_utils.validate_xpaths(ignore)
 
     if module.check_mode:
         return dict(
@@ -230,19 +171,15 @@ def core(module):
             ignore=ignore,
             state=state,
             uri=uri,
-            xml=xml)
+            xml=xml,
+            xmls=xmls)
 
-    if state == 'present':
-        changed, xml = create_or_modify(ignore, uri, xml, module)
-    elif state == 'absent':
-        changed, xml = delete(ignore, uri, xml, module)
-
-    return dict(
-        changed=changed,
+    result = dict(
         ignore=ignore,
         state=state,
-        uri=uri,
-        xml=xml)
+        uri=uri)
+
+    return libvirt_utils.reconcile_xml_documents(module, 'pool', result, ignore)
 
 
 def main():
@@ -251,9 +188,17 @@ def main():
             ignore=dict(type='list', default=['/pool/uuid']),
             state=dict(type='str', choices=['present', 'absent'], default='present'),
             uri=dict(default='qemu:///system'),
-            xml=dict(required=True, type='str')
+            broker_dir=dict(type='path'),
+            xml=dict(type='str'),
+            xmls=dict(type='list', elements='str')
         ),
-        supports_check_mode=True
+        supports_check_mode=True,
+        mutually_exclusive=[
+            ['xml', 'xmls']
+        ],
+        required_one_of=[
+            ['xml', 'xmls']
+        ]
     )
 
     libvirt_utils.try_import(module)
@@ -263,6 +208,8 @@ def main():
     except Exception as e:
         module.fail_json(msg=to_native(e), exception=traceback.format_exc())
     else:
+        if result.get('failed'):
+            module.fail_json(**result)
         module.exit_json(**result)
 
 
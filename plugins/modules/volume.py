@@ -40,7 +40,8 @@ options:
             - "Name of the new volume. For a disk pool, this must match the partition name as determined from the pool's
                source device path and the next available partition. For example, a source device path of /dev/sdb and
                there are no partitions on the disk, then the name must be sdb1 with the next name being sdb2 and so on."
-        required: true
+            - "Either I(name) or I(volumes) is required."
+        required: false
         type: str
     capacity:
         description:
@@ -56,6 +57,29 @@ options:
                validity checked but not preserved when libvirtd is restarted or the pool is refreshed)."
         required: false
         type: str
+    allocation:
+        description:
+            - "Initial allocation of the volume, as a scaled integer (see NOTES in `man virsh`), defaulting to bytes if
+               there is no suffix. Use C(0) for a sparse volume which allocates space on demand and the I(capacity) for
+               a fully allocated volume. Defaults to I(capacity) for raw volumes, i.e. raw volumes are fully allocated
+               unless the storage pool does not support it."
+        required: false
+        type: str
+    cluster_size:
+        description:
+            - "Cluster size of qcow2 volumes, as a scaled integer (see NOTES in `man virsh`), e.g. C(2M) for large
+               volumes with sequential access patterns. Requires libvirt 7.4.0 or later. Defaults to the default cluster
+               size of qemu-img, i.e. 64KiB."
+        required: false
+        type: str
+    lazy_refcounts:
+        default: false
+        description:
+            - "Enable lazy reference counts of qcow2 volumes, which avoid metadata updates on write and hence speed up
+               writes with C(cache=writethrough), at the cost of a metadata repair after a host crash. Implies qcow2
+               compatibility level 1.1."
+        required: false
+        type: bool
     prealloc_metadata:
         default: false
         description:
@@ -70,6 +94,21 @@ options:
         description:
             - "Should the volume be present or absent."
         type: str
+    max_workers:
+        default: 1
+        description:
+            - "Maximum number of volumes from I(volumes) which are created or deleted in parallel."
+        required: false
+        type: int
+    volumes:
+        description:
+            - "List of volumes to create or delete in a single module run, instead of a single volume I(name).
+               Each item accepts the options I(name), I(capacity), I(format), I(allocation), I(prealloc_metadata),
+               I(cluster_size) and I(lazy_refcounts). Options which are not set for an item default to the module
+               options with the same name."
+        elements: dict
+        required: false
+        type: list
 
 notes:
   - "No modifications are applied to existing volumes; module is skipped if volume exists already."
@@ -86,9 +125,39 @@ EXAMPLES = r'''
     pool: "default"
     name: "data.qcow2"
     capacity: 10GB
+
+- name: Create several volumes at once
+  jm1.libvirt.volume:
+    pool: "default"
+    format: "qcow2"
+    capacity: 10GB
+    volumes:
+    - name: "data-1.qcow2"
+    - name: "data-2.qcow2"
+    - name: "logs.qcow2"
+      capacity: 1GB
+
+- name: Create a sparse qcow2 volume tuned for large sequential I/O
+  jm1.libvirt.volume:
+    pool: "default"
+    name: "backup.qcow2"
+    format: "qcow2"
+    capacity: 500GB
+    allocation: 0
+    prealloc_metadata: true
+    cluster_size: 2M
+    lazy_refcounts: true
 '''
 
 RETURN = r'''
+volumes:
+    description:
+      - "Results for each item of I(volumes), with the same keys as returned for a single volume."
+      - "Items which failed have keys I(failed) and I(msg) instead. Other items are processed anyway and the
+         module fails after all items have been processed."
+    returned: always if I(volumes) is set
+    type: list
+    elements: dict
 '''
 
 # NOTE: Synchronize imports with DOCUMENTATION string above and chapter Requirements in roles/server/README.md
@@ -103,42 +172,37 @@ def create(uri,
            volume_name,
            volume_capacity,
            volume_format,
+           volume_allocation,
            prealloc_metadata,
+           cluster_size,
+           lazy_refcounts,
            module):
     with libvirt_utils.Connection(uri, module) as conn:
-        pool = conn.storagePoolLookupByName(pool_name)
+        pool = conn.inventory.pool(pool_name)
+        if not pool:
+            raise ValueError('storage pool %s does not exist' % pool_name)
 
-        if volume_name in pool.listVolumes():
+        volume = conn.inventory.volume(pool, volume_name)
+        if volume:
             # volume exists already
-            volume = pool.storageVolLookupByName(volume_name)
-            volume_type, volume_capacity, volume_allocation = volume.info()
+            volume_type, volume_capacity, volume_allocation = conn.inventory.info(volume)
             return False, volume_capacity, volume_format
 
-        cmd = """
-            virsh
-                --connect '{uri}'
-                vol-create-as
-                '{pool_name}'
-                '{volume_name}'
-                '{volume_capacity}'
-            """
-
-        if volume_format:
-            cmd += "--format '{volume_format}'"
-
+        # enum virStorageVolCreateFlags {
+        #     VIR_STORAGE_VOL_CREATE_PREALLOC_METADATA = 1 (0x1; 1 << 0)
+        #     VIR_STORAGE_VOL_CREATE_REFLINK           = 2 (0x2; 1 << 1) : perform a btrfs lightweight copy
+        # }
+        #
+        # Ref.: https://libvirt.org/html/libvirt-libvirt-storage.html#virStorageVolCreateFlags
+        flags = 0
         if prealloc_metadata:
-            cmd += '--prealloc-metadata'
+            flags |= 1
 
-        cmd = cmd.replace('\n', ' ')
+        volume_xml = libvirt_utils.make_volume_xml(volume_name, volume_capacity, volume_format, volume_allocation,
+                                                   cluster_size, ['lazy_refcounts'] if lazy_refcounts else None)
+        volume = pool.createXML(volume_xml, flags)
 
-        cmd = cmd.format(
-            uri=uri,
-            pool_name=pool_name,
-            volume_name=volume_name,
-            volume_capacity=volume_capacity,
-            volume_format=volume_format)
-
-        rc, stdout, stderr = module.run_command(cmd, check_rc=True)
+        volume_type, volume_capacity, volume_allocation = volume.info()
         return True, volume_capacity, volume_format
 
 
@@ -147,11 +211,13 @@ def delete(uri,
            volume_name,
            volume_capacity,
            volume_format,
+           volume_allocation,
            prealloc_metadata,
+           cluster_size,
+           lazy_refcounts,
            module):
     with libvirt_utils.Connection(uri, module) as conn:
-        pools = conn.listAllStoragePools()
-        pool = next((pool for pool in pools if pool.name() == pool_name), None)
+        pool = conn.inventory.pool(pool_name)
         if not pool:
             # pool absent already and hence volume as well
             return False, None, None
@@ -159,24 +225,31 @@ def delete(uri,
         if not volume_name:
             raise ValueError('name is required for deleting volumes')
 
-        if volume_name not in pool.listVolumes():
+        volume = conn.inventory.volume(pool, volume_name)
+        if not volume:
             # volume absent already
             return False, None, None
 
-        volume = pool.storageVolLookupByName(volume_name)
-        volume_type, volume_capacity, volume_allocation = volume.info()
+        volume_type, volume_capacity, volume_allocation = conn.inventory.info(volume)
         volume.delete()
+        conn.inventory.invalidate(volume)
         return True, volume_capacity, volume_format
 
 
-def core(module):
-    state = module.params['state']
-    uri = module.params['uri']
-    pool_name = module.params['pool']
-    volume_name = module.params['name']
-    volume_capacity = module.params['capacity']
-    volume_format = module.params['format']
-    prealloc_metadata = module.params['prealloc_metadata']
+def reconcile(module,
+              state,
+              uri,
+              pool_name,
+              volume_name,
+              volume_capacity,
+              volume_format,
+              volume_allocation,
+              prealloc_metadata,
+              cluster_size,
+              lazy_refcounts):
+
+    if state == 'present' and not volume_capacity:
+        raise ValueError('capacity is required for creating volume %s' % volume_name)
 
     if module.check_mode:
         return dict(
@@ -187,21 +260,30 @@ def core(module):
             name=volume_name,
             capacity=volume_capacity,
             format=volume_format,
-            prealloc_metadata=prealloc_metadata)
+            allocation=volume_allocation,
+            prealloc_metadata=prealloc_metadata,
+            cluster_size=cluster_size,
+            lazy_refcounts=lazy_refcounts)
 
     if state == 'present':
         changed, volume_capacity, volume_format = create(
             uri,
             pool_name,
             volume_name, human_to_bytes(volume_capacity) if volume_capacity else None, volume_format,
+            human_to_bytes(volume_allocation) if volume_allocation is not None else None,
             prealloc_metadata,
+            human_to_bytes(cluster_size) if cluster_size else None,
+            lazy_refcounts,
             module)
     elif state == 'absent':
         changed, volume_capacity, volume_format = delete(
             uri,
             pool_name,
             volume_name, human_to_bytes(volume_capacity) if volume_capacity else None, volume_format,
+            human_to_bytes(volume_allocation) if volume_allocation is not None else None,
             prealloc_metadata,
+            human_to_bytes(cluster_size) if cluster_size else None,
+            lazy_refcounts,
             module)
 
     return dict(
@@ -212,7 +294,46 @@ def core(module):
         name=volume_name,
         capacity=volume_capacity,
         format=volume_format,
-        prealloc_metadata=prealloc_metadata)
+        allocation=volume_allocation,
+        prealloc_metadata=prealloc_metadata,
+        cluster_size=cluster_size,
+        lazy_refcounts=lazy_refcounts)
+
+
+def core(module):
+    state = module.params['state']
+    uri = module.params['uri']
+    pool_name = module.params['pool']
+
+    volumes = libvirt_utils.list_params(
+        module,
+        'volumes',
+        ['name', 'capacity', 'format', 'allocation', 'prealloc_metadata', 'cluster_size', 'lazy_refcounts'])
+
+    def reconcile_volume(volume):
+        return reconcile(module,
+                         state,
+                         uri,
+                         pool_name,
+                         volume['name'],
+                         volume['capacity'],
+                         volume['format'],
+                         volume['allocation'],
+                         volume['prealloc_metadata'],
+                         volume['cluster_size'],
+                         volume['lazy_refcounts'])
+
+    if module.params['volumes'] is None:
+        return reconcile_volume(volumes[0])
+
+    results = libvirt_utils.map_items(reconcile_volume, volumes, module.params['max_workers'])
+
+    return libvirt_utils.fail_items(dict(
+        changed=any(result.get('changed', False) for result in results),
+        state=state,
+        uri=uri,
+        pool=pool_name,
+        volumes=results), 'volumes')
 
 
 def main():
@@ -220,15 +341,35 @@ def main():
         argument_spec=dict(
             state=dict(type='str', choices=['present', 'absent'], default='present'),
             uri=dict(default='qemu:///system'),
+            broker_dir=dict(type='path'),
             pool=dict(required=True, type='str'),
-            name=dict(required=True, type='str'),
+            name=dict(type='str'),
             capacity=dict(type='str'),
             format=dict(type='str'),
-            prealloc_metadata=dict(type='bool', default=False)
+            allocation=dict(type='str'),
+            prealloc_metadata=dict(type='bool', default=False),
+            cluster_size=dict(type='str'),
+            lazy_refcounts=dict(type='bool', default=False),
+            max_workers=dict(type='int', default=1),
+            volumes=dict(
+                type='list',
+                elements='dict',
+                options=dict(
+                    name=dict(required=True, type='str'),
+                    capacity=dict(type='str'),
+                    format=dict(type='str'),
+                    allocation=dict(type='str'),
+                    prealloc_metadata=dict(type='bool'),
+                    cluster_size=dict(type='str'),
+                    lazy_refcounts=dict(type='bool')
+                ))
         ),
         supports_check_mode=True,
-        required_if=[
-            ['state', 'present', ['capacity']]
+        mutually_exclusive=[
+            ['name', 'volumes']
+        ],
+        required_one_of=[
+            ['name', 'volumes']
         ]
     )
 
@@ -239,6 +380,8 @@ def main():
     except Exception as e:
         module.fail_json(msg=to_native(e), exception=traceback.format_exc())
     else:
+        if result.get('failed'):
+            module.fail_json(**result)
         module.exit_json(**result)
 
 
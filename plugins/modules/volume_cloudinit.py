@@ -26,8 +26,7 @@ description:
        new volumes in libvirt storage pools. It is inspired by Ansible module openstack.cloud.os_volume."
 
 requirements:
-   - cloud-localds (e.g. in debian package cloud-image-utils)
-   - virsh (e.g. in debian package libvirt-clients)
+   - cloud-localds (e.g. in debian package cloud-image-utils), only if format is not raw
 
 options:
     pool:
@@ -38,14 +37,26 @@ options:
     name:
         description:
             - "Name of the config drive volume."
-        required: true
+            - "Either I(name) or I(volumes) is required."
+        required: false
         type: str
     format:
         default: raw
         description:
-            - "Disk image format (see manpage of qemu-img for allowed image file formats), defaulting to raw."
+            - "Disk image format (see manpage of qemu-img for allowed image file formats), defaulting to raw.
+               Raw images are built by this module itself, images in all other formats are created with
+               C(cloud-localds)."
         required: false
         type: str
+    force:
+        default: false
+        description:
+            - "Replace existing volumes in raw format which do not contain a config drive created by this module, e.g.
+               config drives created with C(cloud-localds) by earlier versions of this module. Such volumes are kept
+               by default, because they might be unrelated volumes which happen to have the same name."
+            - "Volumes are replaced even if they are used by domains."
+        required: false
+        type: bool
     filesystem:
         default: iso
         description:
@@ -72,9 +83,45 @@ options:
         description:
             - "Should the config drive be present or absent."
         type: str
+    template:
+        default: false
+        description:
+            - "Build config drives in raw format from a template image which is built once per module run, instead of
+               building a new filesystem for each config drive. Each file in the template has as much space as the
+               largest file with the same name of all config drives in I(volumes) which have the same I(filesystem)
+               and the same files. Each config drive is a copy of its template with file contents and sizes patched
+               in. Use I(max_workers) to upload config drives in parallel."
+            - "Config drives built from templates are larger than config drives built from scratch because files are
+               padded to the size of the largest file."
+        required: false
+        type: bool
+    max_workers:
+        default: 1
+        description:
+            - "Maximum number of config drives from I(volumes) which are created or deleted in parallel."
+        required: false
+        type: int
+    volumes:
+        description:
+            - "List of config drives to create or delete in a single module run, instead of a single config drive
+               I(name). Each item accepts the options I(name), I(format), I(filesystem), I(metadata), I(userdata) and
+               I(networkconfig). Options which are not set for an item default to the module options with the same
+               name."
+        elements: dict
+        required: false
+        type: list
 
 notes:
-  - "No modifications are applied to existing config drive volumes; module is skipped if volume exists already."
+  - "Config drives in raw format contain a digest of their files. Existing config drive volumes in raw format which
+     have been created by this module are replaced if this digest differs from the digest of I(filesystem),
+     I(metadata), I(userdata) and I(networkconfig), e.g. when I(filesystem) has been changed. Other existing volumes
+     are kept unless I(force) is set. Only the digest is read from existing volumes. The new config drive is built
+     before the existing volume is deleted."
+  - "No modifications are applied to existing config drive volumes in other formats than raw; module is skipped if
+     such a volume exists already."
+  - "Raw images are built in memory with an ISO 9660 filesystem with Joliet extension (but without Rock Ridge
+     extensions) or with a FAT12 filesystem with long file names, labeled C(cidata) and containing the same files as
+     images created by C(cloud-localds)."
 
 extends_documentation_fragment:
   - jm1.libvirt.libvirt
@@ -93,16 +140,55 @@ EXAMPLES = r'''
         # Ref.: https://cloudinit.readthedocs.io/
 
         hostname: inf.h-brs.de
+
+- jm1.libvirt.volume_cloudinit:
+    pool: 'default'
+    volumes:
+    - name: 'vm-1_cidata.raw'
+      userdata: |
+          #cloud-config
+          hostname: vm-1
+    - name: 'vm-2_cidata.raw'
+      userdata: |
+          #cloud-config
+          hostname: vm-2
+
+- name: Create config drives for many virtual machines from a common template
+  jm1.libvirt.volume_cloudinit:
+    pool: 'default'
+    template: true
+    max_workers: 8
+    volumes:
+    - name: 'vm-1_cidata.raw'
+      metadata: 'instance-id: vm-1'
+      userdata: |
+          #cloud-config
+          hostname: vm-1
+    - name: 'vm-2_cidata.raw'
+      metadata: 'instance-id: vm-2'
+      userdata: |
+          #cloud-config
+          hostname: vm-2
 '''
 
 RETURN = r'''
+volumes:
+    description:
+      - "Results for each item of I(volumes), with the same keys as returned for a single config drive."
+      - "Items which failed have keys I(failed) and I(msg) instead. Other items are processed anyway and the
+         module fails after all items have been processed."
+    returned: always if I(volumes) is set
+    type: list
+    elements: dict
 '''
 
 # NOTE: Synchronize imports with DOCUMENTATION string above and chapter Requirements in roles/server/README.md
+from ansible_collections.jm1.libvirt.plugins.module_utils import configdrive as configdrive_utils
 from ansible_collections.jm1.libvirt.plugins.module_utils import libvirt as libvirt_utils
 from ansible.module_utils._text import to_native
 from ansible.module_utils.basic import AnsibleModule, missing_required_lib
 import ansible.module_utils.six as six
+import io
 import os
 import traceback
 
@@ -126,9 +212,8 @@ def cloud_localds(volume_format,
                   ci_networkconfig_path,
                   configdrive_path,
                   module):
-    # TODO: Reimplement cloud-localds in Python and drop dependency on cloud-localds,
-    #       because it is not available on Red Hat Enterprise Linux 8 / 9 and CentOS 8 / 9.
-    #       Ref.: https://salsa.debian.org/cloud-team/cloud-utils/-/blob/master/bin/cloud-localds
+    # Only used for formats other than raw, raw images are built with configdrive_utils.make_configdrive()
+    # Ref.: https://salsa.debian.org/cloud-team/cloud-utils/-/blob/master/bin/cloud-localds
 
     cmd = 'cloud-localds'
     if volume_format:
@@ -149,6 +234,71 @@ def cloud_localds(volume_format,
     module.run_command(cmd, check_rc=True)
 
 
+def template_key(volume_filesystem, files):
+    # Config drives share a template if they have the same filesystem and the same files
+    return volume_filesystem, tuple(name for name, data in files)
+
+
+def make_templates(volumes):
+    # Return config drive templates for raw volumes which have enough space for the files of all volumes
+
+    capacities = {}
+    for volume in volumes:
+        if volume['format'] != 'raw' or not volume['userdata']:
+            continue
+
+        files = configdrive_utils.configdrive_files(volume['metadata'], volume['userdata'], volume['networkconfig'])
+        key = template_key(volume['filesystem'], files)
+        sizes = capacities.setdefault(key, dict((name, 0) for name, data in files))
+        for name, data in files:
+            sizes[name] = max(sizes[name], len(data))
+
+    return dict(
+        (key, configdrive_utils.ConfigDriveTemplate(key[0], [(name, sizes[name]) for name in key[1]]))
+        for key, sizes in capacities.items())
+
+
+def lookup_marker(conn, volume):
+    # Return marker with digest of files in config drive volume or None if volume has not been created by this module,
+    # reading only the markers instead of the whole image. Markers of all filesystems are looked up because the
+    # filesystem of a config drive might have been changed since it has been created.
+
+    volume_type, volume_capacity, volume_allocation = conn.inventory.info(volume)
+    for filesystem, offset in sorted(configdrive_utils.MARKER_OFFSETS.items()):
+        if volume_capacity < offset + configdrive_utils.MARKER_SIZE:
+            continue
+
+        marker = libvirt_utils.download_range(conn, volume, offset, configdrive_utils.MARKER_SIZE)
+        if marker.startswith(configdrive_utils.MARKER_PREFIX):
+            return marker
+
+    return None
+
+
+def create_volume_and_upload(conn, pool, volume_name, volume_format, configdrive, configdrive_size):
+    # Create libvirt storage volume and upload config drive image from file-like object configdrive to it
+
+    volume_xml = libvirt_utils.make_volume_xml(volume_name, configdrive_size, volume_format)
+    volume = pool.createXML(volume_xml, 0)
+
+    try:
+        libvirt_utils.upload_file(conn, volume, configdrive, configdrive_size)
+
+    # bare 'except' is no issue because we reraise the exception unconditionally below
+    except:  # noqa: E722
+
+        try:
+            # Remove volume if upload failed
+            volume.delete()
+
+        # bare 'except' is no issue because we reraise the outer exception unconditionally below
+        except:  # noqa: E722
+            pass
+
+        # Reraise exception from upload
+        raise
+
+
 def create(uri,
            pool_name,
            volume_name,
@@ -157,15 +307,52 @@ def create(uri,
            ci_metadata,
            ci_userdata,
            ci_networkconfig,
+           templates,
+           force,
            module):
 
     with libvirt_utils.Connection(uri, module) as conn:
-        pool = conn.storagePoolLookupByName(pool_name)
-
-        if volume_name in pool.listVolumes():
-            # volume exists already
-            return False
-
+        pool = conn.inventory.pool(pool_name)
+        if not pool:
+            raise ValueError('storage pool %s does not exist' % pool_name)
+
+        files = configdrive_utils.configdrive_files(ci_metadata, ci_userdata, ci_networkconfig)
+
+        volume = conn.inventory.volume(pool, volume_name)
+        if volume:
+            if volume_format != 'raw':
+                # images in other formats cannot be inspected without converting them, hence they are kept
+                return False
+
+            marker = lookup_marker(conn, volume)
+            if marker == configdrive_utils.configdrive_marker(volume_filesystem, files):
+                # volume exists already and has the desired content and filesystem
+                return False
+
+            if not force and not marker:
+                # volume has not been created by this module, e.g. it has been created by cloud-localds or it is an
+                # unrelated volume with the same name, hence it is kept
+                return False
+
+        if volume_format == 'raw':
+            # Build config drive image in memory, without spawning any processes
+            template = templates.get(template_key(volume_filesystem, files))
+            if template:
+                configdrive = template.render(files)
+            else:
+                configdrive = configdrive_utils.make_configdrive(volume_filesystem, ci_metadata, ci_userdata,
+                                                                 ci_networkconfig)
+
+            if volume:
+                # existing volume has other content, it is replaced after the new image has been built
+                volume.delete()
+                conn.inventory.invalidate(volume)
+
+            create_volume_and_upload(conn, pool, volume_name, volume_format, io.BytesIO(configdrive),
+                                     len(configdrive))
+            return True
+
+        # Images in formats other than raw are converted by cloud-localds with qemu-img
         with tempfile.TemporaryDirectory() as dir:
             ci_metadata_path = os.path.join(dir, 'meta-data')
             ci_userdata_path = os.path.join(dir, 'user-data')
@@ -193,40 +380,9 @@ def create(uri,
                 configdrive_path,
                 module)
 
-            configdrive_size = os.path.getsize(configdrive_path)
-
-            # Create cloud-init config volume
-
-            cmd = """
-                virsh
-                    --connect '{uri}'
-                    vol-create-as
-                    '{pool_name}'
-                    '{volume_name}'
-                    '{configdrive_size}'
-                    --format '{volume_format}'
-                """.replace('\n', ' ').format(uri=uri,
-                                              pool_name=pool_name,
-                                              volume_name=volume_name,
-                                              configdrive_size=configdrive_size,
-                                              volume_format=volume_format)
-
-            module.run_command(cmd, check_rc=True)
-
-            # Upload cloud-init config drive to libvirt storage volume
-            cmd = """
-                virsh
-                    --connect '{uri}'
-                    vol-upload
-                    --pool '{pool_name}'
-                    '{volume_name}'
-                    '{configdrive_path}'
-                """.replace('\n', ' ').format(uri=uri,
-                                              pool_name=pool_name,
-                                              volume_name=volume_name,
-                                              configdrive_path=configdrive_path)
-
-            module.run_command(cmd, check_rc=True)
+            with open(configdrive_path, 'rb') as f:
+                create_volume_and_upload(conn, pool, volume_name, volume_format, f,
+                                         os.path.getsize(configdrive_path))
 
         return True
 
@@ -242,31 +398,36 @@ def delete(uri,
            module):
 
     with libvirt_utils.Connection(uri, module) as conn:
-        pools = conn.listAllStoragePools()
-        pool = next((pool for pool in pools if pool.name() == pool_name), None)
+        pool = conn.inventory.pool(pool_name)
         if not pool:
             # pool absent already and hence volume as well
             return False
 
-        if volume_name not in pool.listVolumes():
+        volume = conn.inventory.volume(pool, volume_name)
+        if not volume:
             # volume absent already
             return False
 
-        volume = pool.storageVolLookupByName(volume_name)
         volume.delete()
+        conn.inventory.invalidate(volume)
         return True
 
 
-def core(module):
-    state = module.params['state']
-    uri = module.params['uri']
-    pool_name = module.params['pool']
-    volume_name = module.params['name']
-    volume_format = module.params['format']
-    volume_filesystem = module.params['filesystem']
-    ci_metadata = module.params['metadata']
-    ci_userdata = module.params['userdata']
-    ci_networkconfig = module.params['networkconfig']
+def reconcile(module,
+              state,
+              uri,
+              pool_name,
+              volume_name,
+              volume_format,
+              volume_filesystem,
+              ci_metadata,
+              ci_userdata,
+              ci_networkconfig,
+              templates,
+              force):
+
+    if state == 'present' and not ci_userdata:
+        raise ValueError('userdata is required for creating config drive %s' % volume_name)
 
     if module.check_mode:
         return dict(
@@ -287,6 +448,8 @@ def core(module):
             pool_name,
             volume_name, volume_format, volume_filesystem,
             ci_metadata, ci_userdata, ci_networkconfig,
+            templates,
+            force,
             module)
     elif state == 'absent':
         changed = delete(
@@ -309,22 +472,82 @@ def core(module):
         networkconfig=ci_networkconfig)
 
 
+def core(module):
+    state = module.params['state']
+    uri = module.params['uri']
+    pool_name = module.params['pool']
+
+    volumes = libvirt_utils.list_params(
+        module,
+        'volumes',
+        ['name', 'format', 'filesystem', 'metadata', 'userdata', 'networkconfig'])
+
+    if state == 'present' and module.params['template'] and not module.check_mode:
+        templates = make_templates(volumes)
+    else:
+        templates = {}
+
+    def reconcile_volume(volume):
+        return reconcile(module,
+                         state,
+                         uri,
+                         pool_name,
+                         volume['name'],
+                         volume['format'],
+                         volume['filesystem'],
+                         volume['metadata'],
+                         volume['userdata'],
+                         volume['networkconfig'],
+                         templates,
+                         module.params['force'])
+
+    if module.params['volumes'] is None:
+        return reconcile_volume(volumes[0])
+
+    results = libvirt_utils.map_items(reconcile_volume, volumes, module.params['max_workers'])
+
+    return libvirt_utils.fail_items(dict(
+        changed=any(result.get('changed', False) for result in results),
+        state=state,
+        uri=uri,
+        pool=pool_name,
+        volumes=results), 'volumes')
+
+
 def main():
     module = AnsibleModule(
         argument_spec=dict(
             state=dict(type='str', choices=['present', 'absent'], default='present'),
             uri=dict(default='qemu:///system'),
+            broker_dir=dict(type='path'),
             pool=dict(required=True, type='str'),
-            name=dict(required=True, type='str'),
+            name=dict(type='str'),
             format=dict(type='str', default='raw'),
             filesystem=dict(type='str', choices=['vfat', 'iso'], default='iso'),
             metadata=dict(type='str'),
             userdata=dict(type='str'),
-            networkconfig=dict(type='str')
+            networkconfig=dict(type='str'),
+            template=dict(type='bool', default=False),
+            force=dict(type='bool', default=False),
+            max_workers=dict(type='int', default=1),
+            volumes=dict(
+                type='list',
+                elements='dict',
+                options=dict(
+                    name=dict(required=True, type='str'),
+                    format=dict(type='str'),
+                    filesystem=dict(type='str', choices=['vfat', 'iso']),
+                    metadata=dict(type='str'),
+                    userdata=dict(type='str'),
+                    networkconfig=dict(type='str')
+                ))
         ),
         supports_check_mode=True,
-        required_if=[
-            ['state', 'present', ['userdata']]
+        mutually_exclusive=[
+            ['name', 'volumes']
+        ],
+        required_one_of=[
+            ['name', 'volumes']
         ]
     )
 
@@ -338,6 +561,8 @@ def main():
     except Exception as e:
         module.fail_json(msg=to_native(e), exception=traceback.format_exc())
     else:
+        if result.get('failed'):
+            module.fail_json(**result)
         module.exit_json(**result)
 
 
@@ -27,7 +27,6 @@ description:
 
 requirements:
    - backports.tempfile (python 2 only)
-   - virsh (e.g. in debian package libvirt-clients)
 
 options:
     pool:
@@ -44,15 +43,49 @@ options:
         description:
             - "Image file path (relative or absolute) or URL. Required if C(state) is C(present)."
         type: str
+    cache_dir:
+        description:
+            - "Directory where images downloaded from URLs are cached, shared by all runs of this module on the host.
+               Cached images are identified by URL, I(checksum) and the ETag and Last-Modified headers sent by the
+               server. Images without any of those are never cached. Caching is disabled if not set."
+            - "Images which have been cached with a I(checksum) are used without contacting the server again. For other
+               cached images, a conditional request with the ETag and Last-Modified headers is sent to the server and
+               the cached image is used if the server reports that the image has not been modified, without opening
+               a download."
+        required: false
+        type: path
+    cache_size:
+        description:
+            - "Maximum disk usage of all images in I(cache_dir), as a scaled integer (see NOTES in `man virsh`).
+               Least recently used images are removed from the cache when it grows larger. Unlimited if not set."
+        required: false
+        type: str
     checksum:
         description:
             - "Optional image checksum."
         required: false
         type: str
+    detach:
+        default: false
+        description:
+            - "Import the image in a detached worker process and return immediately with a job id, instead of waiting
+               for the upload to finish. The job can be polled with module M(ansible.builtin.async_status) which
+               reports the number of bytes uploaded so far and the throughput, until it returns the result of the
+               module run."
+        required: false
+        type: bool
     format:
         description:
             - "Image file format, e.g. raw or qcow2, defaulting to image extension."
         type: str
+    sparse:
+        default: false
+        description:
+            - "Upload image with libvirt's sparse streams, i.e. holes in the image file are not transferred and not
+               allocated in the volume. Requires libvirt 3.4.0 or later and a storage pool which supports sparse
+               volumes, e.g. a dir pool. Applies to local image files and images from I(cache_dir) only."
+        required: false
+        type: bool
     state:
         choices: [present, absent]
         default: present
@@ -62,6 +95,8 @@ options:
 
 notes:
   - "No modifications are applied to existing volumes; module is skipped if volume exists already."
+  - "Images given as URL are streamed to the volume directly if the server reports their size. Else they are
+     downloaded to a temporary directory first."
 
 extends_documentation_fragment:
   - jm1.libvirt.libvirt
@@ -76,9 +111,46 @@ EXAMPLES = r'''
     image: 'https://cdimage.debian.org/cdimage/openstack/current/debian-10.3.1-20200328-openstack-amd64.qcow2'
     checksum: sha256:c97f8680284734535bdf988b8574e494eeda82fd6ab0720cd02aa5ee0b681263
     format: 'qcow2'
+
+- name: Download image once per host and reuse it for further imports
+  jm1.libvirt.volume_import:
+    pool: 'default'
+    name: 'debian-12-genericcloud-amd64.qcow2'
+    image: 'https://cdimage.debian.org/images/cloud/bookworm/latest/debian-12-genericcloud-amd64.qcow2'
+    format: 'qcow2'
+    cache_dir: '/var/cache/jm1.libvirt/images'
+    cache_size: 20G
+    sparse: true
+
+- name: Start upload of a large image without waiting for it
+  jm1.libvirt.volume_import:
+    pool: 'default'
+    image: '/var/lib/images/windows-server-2022.qcow2'
+    detach: true
+  register: import_job
+
+- name: Wait for upload to finish
+  ansible.builtin.async_status:
+    jid: "{{ import_job.ansible_job_id }}"
+  register: import_result
+  until: import_result.finished
+  retries: 360
+  delay: 10
 '''
 
 RETURN = r'''
+ansible_job_id:
+    description: Id of the job which imports the image, to be polled with M(ansible.builtin.async_status)
+    returned: if I(detach) is true
+    type: str
+    sample: 488359678239.2844
+
+results_file:
+    description: Path to the status file of the job
+    returned: if I(detach) is true
+    type: str
+    sample: /root/.ansible_async/488359678239.2844
+
 name:
     description: Name of the volume
     returned: changed or success
@@ -100,12 +172,17 @@ format:
 
 # NOTE: Synchronize imports with DOCUMENTATION string above and chapter Requirements in roles/server/README.md
 from ansible_collections.jm1.libvirt.plugins.module_utils import libvirt as libvirt_utils
-from ansible.module_utils._text import to_native
-from ansible.module_utils.basic import AnsibleModule, missing_required_lib
+from ansible.module_utils._text import to_bytes, to_native
+from ansible.module_utils.basic import AnsibleModule, AVAILABLE_HASH_ALGORITHMS, human_to_bytes, missing_required_lib
+from ansible.module_utils.six.moves.urllib.error import HTTPError
 from ansible.module_utils.six.moves.urllib.parse import urlsplit
 from ansible.module_utils.urls import open_url
 import ansible.module_utils.six as six
 import contextlib
+import errno
+import fcntl
+import hashlib
+import json
 import os
 import re
 import shutil
@@ -124,6 +201,232 @@ elif six.PY3:
     import tempfile
 
 
+def new_digest(algorithm):
+    try:
+        return AVAILABLE_HASH_ALGORITHMS[algorithm]()
+    except KeyError:
+        raise ValueError("Checksum algorithm '%s' is not supported. Available algorithms: %s" %
+                         (algorithm, ', '.join(AVAILABLE_HASH_ALGORITHMS)))
+
+
+def verify_checksum(image_checksum, digest):
+    if image_checksum != digest.hexdigest():
+        raise Exception('Checksum mismatch %s != %s' % (image_checksum, digest.hexdigest()))
+
+
+class HashingReader(object):
+    """ File-like object which counts all data read from file-like object `fileobj` and passes it to
+        `digest.update()` if `digest` is given
+    """
+
+    def __init__(self, fileobj, digest=None):
+        self.fileobj = fileobj
+        self.digest = digest
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.size += len(data)
+        if self.digest:
+            self.digest.update(data)
+        return data
+
+
+class ImageCache(object):
+    """ Directory of downloaded images which is shared by all module runs on a host
+
+        Each image is stored in a file named after its key. A lock file next to it ensures that concurrent runs
+        download an image only once and that images are not evicted while being read. Validators and file name of
+        the last image downloaded from each URL are stored in a metadata file, named after a digest of the URL with
+        suffix '.url', so that later runs can send conditional requests.
+    """
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+
+        try:
+            os.makedirs(path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    @staticmethod
+    def key(url, checksum, etag, last_modified):
+        """ Return key of image at `url` or None if image content cannot be identified and hence not be cached """
+        if not checksum and not etag and not last_modified:
+            return None
+
+        digest = hashlib.sha256()
+        for value in [url, checksum, etag, last_modified]:
+            digest.update(to_bytes(value or ''))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def metadata_path(self, url):
+        return os.path.join(self.path, hashlib.sha256(to_bytes(url)).hexdigest() + '.url')
+
+    def lookup(self, url, checksum):
+        """ Return metadata dict with keys 'key', 'etag', 'last_modified' and 'filename' of the image which has been
+            downloaded from `url` before and is still cached or None if there is no such image
+        """
+        try:
+            with open(self.metadata_path(url), 'r') as f:
+                metadata = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+        key = self.key(url, checksum, metadata.get('etag'), metadata.get('last_modified'))
+        if not key or not os.path.exists(os.path.join(self.path, key)):
+            return None
+        return dict(metadata, key=key)
+
+    def remember(self, url, etag, last_modified, filename):
+        """ Store metadata of the image downloaded from `url`, see lookup() """
+        metadata_path = self.metadata_path(url)
+        with open(metadata_path + '.part', 'w') as f:
+            json.dump(dict(etag=etag, last_modified=last_modified, filename=filename), f)
+        os.rename(metadata_path + '.part', metadata_path)
+
+    @staticmethod
+    def conditional_headers(metadata):
+        """ Return headers of a http request which is answered with status 304 if cached image is not modified """
+        headers = {}
+        if metadata.get('etag'):
+            headers['If-None-Match'] = metadata['etag']
+        if metadata.get('last_modified'):
+            headers['If-Modified-Since'] = metadata['last_modified']
+        return headers
+
+    @contextlib.contextmanager
+    def open(self, key, response, image_checksum, image_checksum_algorithm):
+        """ Yield path to cached image with `key`, downloading it from http `response` if it is not cached yet
+
+            `response` may be None if the image is known to be cached, e.g. after a conditional request.
+        """
+        image_path = os.path.join(self.path, key)
+
+        with open(image_path + '.lock', 'a') as lock:
+            # wait for concurrent downloads of this image to finish
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            if os.path.exists(image_path):
+                # mark image as recently used
+                os.utime(image_path, None)
+            elif response is None:
+                raise Exception('cached image %s has been evicted from cache concurrently, retry' % key)
+            else:
+                self.download(image_path, response, image_checksum, image_checksum_algorithm)
+
+            # allow concurrent reads but prevent eviction while image is used
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            yield image_path
+
+        self.evict()
+
+    def download(self, image_path, response, image_checksum, image_checksum_algorithm):
+        partial_image_path = image_path + '.part'
+        digest = new_digest(image_checksum_algorithm) if image_checksum else None
+        reader = HashingReader(response, digest)
+
+        try:
+            with open(partial_image_path, 'wb') as f:
+                while True:
+                    data = reader.read(libvirt_utils.STREAM_CHUNK_SIZE)
+                    if not data:
+                        break
+
+                    if data.count(b'\0') == len(data):
+                        # keep zeroed regions as holes in cached image, to be skipped by sparse uploads
+                        f.seek(len(data), os.SEEK_CUR)
+                    else:
+                        f.write(data)
+                f.truncate()
+
+            if digest:
+                verify_checksum(image_checksum, digest)
+
+            os.rename(partial_image_path, image_path)
+
+        # bare 'except' is no issue because we reraise the exception unconditionally below
+        except:  # noqa: E722
+            try:
+                os.remove(partial_image_path)
+            # bare 'except' is no issue because we reraise the outer exception unconditionally below
+            except:  # noqa: E722
+                pass
+            raise
+
+    def evict(self):
+        """ Remove least recently used images until cache does not exceed its maximum size """
+        if self.max_size is None:
+            return
+
+        images = []
+        for filename in os.listdir(self.path):
+            if filename.endswith('.lock') or filename.endswith('.part') or filename.endswith('.url'):
+                continue
+            stat = os.stat(os.path.join(self.path, filename))
+            # disk usage of sparse images is smaller than their apparent size
+            images.append((stat.st_mtime, stat.st_blocks * 512, filename))
+
+        cache_size = sum(size for mtime, size, filename in images)
+        for mtime, size, filename in sorted(images):
+            if cache_size <= self.max_size:
+                break
+
+            image_path = os.path.join(self.path, filename)
+            with open(image_path + '.lock', 'a') as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except (IOError, OSError) as e:
+                    if e.errno not in [errno.EACCES, errno.EAGAIN]:
+                        raise
+                    # image is being used
+                    continue
+
+                os.remove(image_path)
+                cache_size -= size
+
+
+def get_header(response, name):
+    if six.PY2:
+        return response.info().getheader(name)
+    elif six.PY3:
+        return response.getheader(name)
+
+
+def create_volume_and_upload(pool, volume_name, image_size, image_format, allocation, upload):
+    # Create libvirt storage volume and upload image to volume with function upload
+
+    if libvirt_utils.lookup_volume_by_name(pool, volume_name):
+        # Fail if volume exists already
+        raise Exception('volume %s exists already in pool %s' % (volume_name, pool.name()))
+
+    volume_xml = libvirt_utils.make_volume_xml(volume_name, image_size, image_format, allocation)
+    volume = pool.createXML(volume_xml, 0)
+
+    try:
+        upload(volume)
+
+    # bare 'except' is no issue because we reraise the exception unconditionally below
+    except:  # noqa: E722
+
+        try:
+            # Remove volume if upload failed
+            volume.delete()
+
+        # bare 'except' is no issue because we reraise the outer exception unconditionally below
+        except:  # noqa: E722
+            pass
+
+        # Reraise exception from upload
+        raise
+
+    volume_type, volume_capacity, volume_allocation = volume.info()
+    return volume_capacity
+
+
 def import_from_disk(uri,
                      pool_name,
                      volume_name,
@@ -131,86 +434,71 @@ def import_from_disk(uri,
                      image_format,
                      image_checksum,
                      image_checksum_algorithm,
+                     sparse,
+                     job,
                      module):
-    # Create libvirt storage volume and upload image to volume
+    # Create libvirt storage volume and upload image to volume, computing the image checksum on the way
 
     if not os.path.exists(image_path):
         raise Exception('Image path %s does not exist' % image_path)
 
-    if image_checksum:
-        # Verify image checksum
-        checksum_on_disk = module.digest_from_file(image_path, image_checksum_algorithm)
-        if image_checksum != checksum_on_disk:
-            raise Exception('Checksum mismatch %s != %s' % (image_checksum, checksum_on_disk))
+    image_size = os.path.getsize(image_path)
+
+    def upload(volume):
+        digest = new_digest(image_checksum_algorithm) if image_checksum else None
+
+        def verify():
+            # Abort upload before it is finished if checksum does not match
+            if digest:
+                verify_checksum(image_checksum, digest)
+
+        progress = (lambda uploaded: job.progress(volume_name, uploaded, image_size)) if job else None
+
+        if sparse:
+            libvirt_utils.upload_sparse_file(conn, volume, image_path, digest=digest, verify=verify, progress=progress)
+        else:
+            with open(image_path, 'rb') as f:
+                libvirt_utils.upload_file(conn, volume, f, image_size, digest=digest, verify=verify,
+                                          progress=progress)
 
     with libvirt_utils.Connection(uri, module) as conn:
-        pool = conn.storagePoolLookupByName(pool_name)
-        if volume_name in pool.listVolumes():
-            # Fail if volume exists already
-            raise Exception('volume %s exists already in pool %s' % (volume_name, pool_name))
+        pool = conn.inventory.pool(pool_name)
+        if not pool:
+            raise ValueError('storage pool %s does not exist' % pool_name)
 
-    image_size = os.path.getsize(image_path)
+        # Allocate no space upfront for sparse uploads, else holes would be filled in the volume
+        return create_volume_and_upload(pool, volume_name, image_size, image_format,
+                                        0 if sparse else None,
+                                        upload)
 
-    cmd = """
-        virsh
-            --connect '{uri}'
-            vol-create-as
-            '{pool_name}'
-            '{volume_name}'
-            '{image_size}'
-            --format '{image_format}'
-        """.replace('\n', ' ').format(uri=uri,
-                                      pool_name=pool_name,
-                                      volume_name=volume_name,
-                                      image_size=image_size,
-                                      image_format=image_format)
-
-    module.run_command(cmd, check_rc=True)
 
-    try:
-        cmd = """
-            virsh
-                --connect '{uri}'
-                vol-upload
-                --pool '{pool_name}'
-                '{volume_name}'
-                '{image_path}'
-            """.replace('\n', ' ').format(uri=uri,
-                                          pool_name=pool_name,
-                                          volume_name=volume_name,
-                                          image_path=image_path)
-
-        module.run_command(cmd, check_rc=True)
+def import_from_stream(conn,
+                       pool,
+                       volume_name,
+                       image_stream,
+                       image_size,
+                       image_format,
+                       image_checksum,
+                       image_checksum_algorithm,
+                       job):
+    # Create libvirt storage volume and pass image from file-like object image_stream through to volume,
+    # computing the image checksum on the way
 
-    # bare 'except' is no issue because we reraise the exception unconditionally below
-    except:  # noqa: E722
+    def upload(volume):
+        reader = HashingReader(image_stream, new_digest(image_checksum_algorithm) if image_checksum else None)
 
-        try:
-            # Remove volume if upload failed
-            cmd = """
-                virsh
-                    --connect '{uri}'
-                    vol-delete
-                    '{volume_name}'
-                    --pool '{pool_name}'
-                """.replace('\n', ' ').format(uri=uri,
-                                              pool_name=pool_name,
-                                              volume_name=volume_name)
-
-            module.run_command(cmd, check_rc=True)
+        def verify():
+            # Abort upload before it is finished if image is incomplete or checksum does not match
+            if reader.size != image_size:
+                raise Exception('Image size mismatch %s != %s' % (image_size, reader.size))
 
-        # bare 'except' is no issue because we reraise the outer exception unconditionally below
-        except:  # noqa: E722
-            pass
+            if image_checksum:
+                verify_checksum(image_checksum, reader.digest)
 
-        # Reraise exception from virsh vol-upload command
-        raise
+        progress = (lambda uploaded: job.progress(volume_name, uploaded, image_size)) if job else None
+        libvirt_utils.upload_file(conn, volume, reader, image_size, verify=verify, progress=progress)
 
-    with libvirt_utils.Connection(uri, module) as conn:
-        pool = conn.storagePoolLookupByName(pool_name)
-        volume = pool.storageVolLookupByName(volume_name)
-        volume_type, volume_capacity, volume_allocation = volume.info()
-        return volume_capacity
+    return create_volume_and_upload(pool, volume_name, image_size, image_format, None, upload)
 
 
 def import_(uri,
@@ -220,68 +508,130 @@ def import_(uri,
             image_format,
             image_checksum,
             image_checksum_algorithm,
+            sparse,
+            cache,
+            job,
             module):
 
     with libvirt_utils.Connection(uri, module) as conn:
-        pool = conn.storagePoolLookupByName(pool_name)
+        pool = conn.inventory.pool(pool_name)
+        if not pool:
+            raise ValueError('storage pool %s does not exist' % pool_name)
+
         image_path_scheme = urlsplit(image_path).scheme
         image_path_is_uri = image_path_scheme != 'file' and len(image_path_scheme) > 0
 
         if image_path_is_uri:
-            # Download image, create libvirt storage volume and upload image to volume
-            with tempfile.TemporaryDirectory() as dir:
-                with contextlib.closing(open_url(image_path)) as r:
-                    filename = None
-
-                    if six.PY2:
-                        cd = r.info().getheader('Content-Disposition')
-                    elif six.PY3:
-                        cd = r.getheader('Content-Disposition')
-
-                    if cd:
-                        try:
-                            filename = re.findall("filename=(.+)", cd)[0]
-                        except IndexError:
-                            filename = None
-
-                    if not filename:
-                        filename = os.path.basename(urlsplit(image_path).path)
-
-                    if not filename:
-                        filename = volume_name
-
-                    if not volume_name:
-                        volume_name = filename
-
-                    if not filename:  # or not volume_name
-                        raise ValueError('no volume name given and volume name could not be derived from image')
+            volume = conn.inventory.volume(pool, volume_name) if volume_name else None
+            if volume:
+                # volume exists already, hence the image is not requested from its server
+                volume_type, volume_capacity, volume_allocation = conn.inventory.info(volume)
+                volume_format = libvirt_utils.lookup_attribute(volume, '/volume/target/format', 'type', conn.inventory)
+                return False, volume_name, volume_capacity, volume_format
 
-                    if not image_format:
-                        image_format = os.path.splitext(volume_name)[1]
+            cached = cache.lookup(image_path, image_checksum) if cache else None
 
-                    if not image_format:
-                        raise ValueError('no image format given and format could not be derived from image')
+            if cached and image_checksum:
+                # content of cached image is identified by its checksum, hence the server is not contacted again
+                return import_cached(conn, pool, volume_name, image_format, image_checksum, image_checksum_algorithm,
+                                     sparse, cache, cached, job, module)
 
-                    if volume_name in pool.listVolumes():
-                        # volume exists already
-                        volume = pool.storageVolLookupByName(volume_name)
-                        volume_type, volume_capacity, volume_allocation = volume.info()
-                        volume_format = libvirt_utils.lookup_attribute(volume, '/volume/target/format', 'type')
-                        return False, volume_name, volume_capacity, volume_format
+            try:
+                response = open_url(image_path, headers=cache.conditional_headers(cached) if cached else None)
+            except HTTPError as e:
+                if e.code != 304 or not cached:
+                    raise
+                # image has not been modified since it has been cached, no download has been opened
+                return import_cached(conn, pool, volume_name, image_format, image_checksum, image_checksum_algorithm,
+                                     sparse, cache, cached, job, module)
 
-                    # Download image
+            # Download image, create libvirt storage volume and upload image to volume
+            with contextlib.closing(response) as r:
+                filename = None
+
+                cd = get_header(r, 'Content-Disposition')
+                if cd:
+                    try:
+                        filename = re.findall("filename=(.+)", cd)[0]
+                    except IndexError:
+                        filename = None
+
+                if not filename:
+                    filename = os.path.basename(urlsplit(image_path).path)
+
+                if not filename:
+                    filename = volume_name
+
+                if not volume_name:
+                    volume_name = filename
+
+                if not filename:  # or not volume_name
+                    raise ValueError('no volume name given and volume name could not be derived from image')
+
+                if not image_format:
+                    image_format = os.path.splitext(volume_name)[1]
+
+                if not image_format:
+                    raise ValueError('no image format given and format could not be derived from image')
+
+                volume = conn.inventory.volume(pool, volume_name)
+                if volume:
+                    # volume exists already
+                    volume_type, volume_capacity, volume_allocation = conn.inventory.info(volume)
+                    volume_format = libvirt_utils.lookup_attribute(volume, '/volume/target/format', 'type',
+                                                                   conn.inventory)
+                    return False, volume_name, volume_capacity, volume_format
+
+                cache_key = cache.key(image_path,
+                                      image_checksum,
+                                      get_header(r, 'ETag'),
+                                      get_header(r, 'Last-Modified')) if cache else None
+
+                if cache_key:
+                    # Download image to cache unless cached already, then upload cached image to volume
+                    with cache.open(cache_key, r, image_checksum, image_checksum_algorithm) as cached_image_path:
+                        cache.remember(image_path, get_header(r, 'ETag'), get_header(r, 'Last-Modified'), filename)
+                        volume_capacity = import_from_disk(
+                            uri,
+                            pool_name,
+                            volume_name,
+                            cached_image_path, image_format, image_checksum, image_checksum_algorithm,
+                            sparse,
+                            job,
+                            module)
+
+                    return True, volume_name, volume_capacity, image_format
+
+                content_length = get_header(r, 'Content-Length')
+                content_encoding = get_header(r, 'Content-Encoding')
+
+                if content_length and content_encoding in [None, 'identity']:
+                    # Stream image from http response to volume, without storing it on disk first
+                    volume_capacity = import_from_stream(
+                        conn,
+                        pool,
+                        volume_name,
+                        r, int(content_length), image_format, image_checksum, image_checksum_algorithm,
+                        job)
+
+                    return True, volume_name, volume_capacity, image_format
+
+                # Image size is not known in advance but required to create the volume, hence download image first
+                with tempfile.TemporaryDirectory() as dir:
                     local_image_path = os.path.join(dir, filename)
                     with open(local_image_path, 'wb') as f:
                         shutil.copyfileobj(r, f)
 
-                image_size = import_from_disk(
-                    uri,
-                    pool_name,
-                    volume_name,
-                    local_image_path, image_format, image_checksum, image_checksum_algorithm,
-                    module)
+                    volume_capacity = import_from_disk(
+                        uri,
+                        pool_name,
+                        volume_name,
+                        local_image_path, image_format, image_checksum, image_checksum_algorithm,
+                        sparse,
+                        job,
+                        module)
 
-                return True, volume_name, image_size, image_format
+                    return True, volume_name, volume_capacity, image_format
 
         else:  # not image_path_is_uri
             if not volume_name:
@@ -296,11 +646,11 @@ def import_(uri,
             if not image_format:
                 raise ValueError('no image format given and format could not be derived from image')
 
-            if volume_name in pool.listVolumes():
+            volume = conn.inventory.volume(pool, volume_name)
+            if volume:
                 # volume exists already
-                volume = pool.storageVolLookupByName(volume_name)
-                volume_type, volume_capacity, volume_allocation = volume.info()
-                volume_format = libvirt_utils.lookup_attribute(volume, '/volume/target/format', 'type')
+                volume_type, volume_capacity, volume_allocation = conn.inventory.info(volume)
+                volume_format = libvirt_utils.lookup_attribute(volume, '/volume/target/format', 'type', conn.inventory)
                 return False, volume_name, volume_capacity, volume_format
 
             volume_capacity = import_from_disk(
@@ -308,11 +658,55 @@ def import_(uri,
                 pool_name,
                 volume_name,
                 image_path, image_format, image_checksum, image_checksum_algorithm,
+                sparse,
+                job,
                 module)
 
             return True, volume_name, volume_capacity, image_format
 
 
+def import_cached(conn,
+                  pool,
+                  volume_name,
+                  image_format,
+                  image_checksum,
+                  image_checksum_algorithm,
+                  sparse,
+                  cache,
+                  cached,
+                  job,
+                  module):
+    # Create libvirt storage volume and upload image from cache to it, without requesting the image from its server
+
+    if not volume_name:
+        volume_name = cached['filename']
+
+    if not image_format:
+        image_format = os.path.splitext(volume_name)[1]
+
+    if not image_format:
+        raise ValueError('no image format given and format could not be derived from image')
+
+    volume = conn.inventory.volume(pool, volume_name)
+    if volume:
+        # volume exists already
+        volume_type, volume_capacity, volume_allocation = conn.inventory.info(volume)
+        volume_format = libvirt_utils.lookup_attribute(volume, '/volume/target/format', 'type', conn.inventory)
+        return False, volume_name, volume_capacity, volume_format
+
+    with cache.open(cached['key'], None, image_checksum, image_checksum_algorithm) as cached_image_path:
+        volume_capacity = import_from_disk(
+            conn.uri,
+            pool.name(),
+            volume_name,
+            cached_image_path, image_format, image_checksum, image_checksum_algorithm,
+            sparse,
+            job,
+            module)
+
+    return True, volume_name, volume_capacity, image_format
+
+
 def delete(uri,
            pool_name,
            volume_name,
@@ -323,8 +717,7 @@ def delete(uri,
            module):
 
     with libvirt_utils.Connection(uri, module) as conn:
-        pools = conn.listAllStoragePools()
-        pool = next((pool for pool in pools if pool.name() == pool_name), None)
+        pool = conn.inventory.pool(pool_name)
         if not pool:
             # pool absent already and hence volume as well
             return False, volume_name, None, None
@@ -341,11 +734,11 @@ def delete(uri,
         if not volume_name:
             raise ValueError('name is required for deleting volumes')
 
-        if volume_name not in pool.listVolumes():
+        volume = conn.inventory.volume(pool, volume_name)
+        if not volume:
             # volume absent already
             return False, volume_name, None, None
 
-        volume = pool.storageVolLookupByName(volume_name)
         # volume_type is of type virStorageVolType:
         #
         # enum virStorageVolType {
@@ -359,13 +752,14 @@ def delete(uri,
         # }
         #
         # Ref.: https://libvirt.org/html/libvirt-libvirt-storage.html#virStorageVolType
-        volume_type, volume_capacity, volume_allocation = volume.info()
-        volume_format = libvirt_utils.lookup_attribute(volume, '/volume/target/format', 'type')
+        volume_type, volume_capacity, volume_allocation = conn.inventory.info(volume)
+        volume_format = libvirt_utils.lookup_attribute(volume, '/volume/target/format', 'type', conn.inventory)
         volume.delete()
+        conn.inventory.invalidate(volume)
         return True, volume_name, volume_capacity, volume_format
 
 
-def core(module):
+def core(module, job=None):
     state = module.params['state']
     uri = module.params['uri']
     pool_name = module.params['pool']
@@ -373,12 +767,15 @@ def core(module):
     image_path = module.params['image']
     image_format = module.params['format']
     image_checksum = module.params['checksum']
+    sparse = module.params['sparse']
+    cache_dir = module.params['cache_dir']
+    cache_size = module.params['cache_size']
 
     if image_checksum:
         try:
             algorithm, checksum = image_checksum.split(':', 1)
         except ValueError:
-            module.fail_json(msg="The checksum parameter has to be in format <algorithm>:<checksum>")
+            raise ValueError("The checksum parameter has to be in format <algorithm>:<checksum>")
     else:
         algorithm = None
         checksum = None
@@ -392,14 +789,22 @@ def core(module):
             name=volume_name,
             image=image_path,
             format=image_format,
-            checksum=image_checksum)
+            checksum=image_checksum,
+            sparse=sparse,
+            cache_dir=cache_dir,
+            cache_size=cache_size)
 
     if state == 'present':
+        cache = ImageCache(cache_dir, human_to_bytes(cache_size) if cache_size else None) if cache_dir else None
+
         changed, volume_name, volume_capacity, volume_format = import_(
             uri,
             pool_name,
             volume_name,
             image_path, image_format, checksum, algorithm,
+            sparse,
+            cache,
+            job,
             module)
     elif state == 'absent':
         changed, volume_name, volume_capacity, volume_format = delete(
@@ -418,6 +823,9 @@ def core(module):
         image=image_path,
         format=volume_format,
         checksum=image_checksum,
+        sparse=sparse,
+        cache_dir=cache_dir,
+        cache_size=cache_size,
         capacity=(int(volume_capacity) if volume_capacity is not None else None)
     )
 
@@ -427,11 +835,16 @@ def main():
         argument_spec=dict(
             state=dict(type='str', choices=['present', 'absent'], default='present'),
             uri=dict(default='qemu:///system'),
+            broker_dir=dict(type='path'),
             pool=dict(required=True, type='str'),
             name=dict(type='str'),
             image=dict(type='str'),
             format=dict(type='str'),
             checksum=dict(type='str'),
+            sparse=dict(type='bool', default=False),
+            cache_dir=dict(type='path'),
+            cache_size=dict(type='str'),
+            detach=dict(type='bool', default=False),
         ),
         supports_check_mode=True,
         required_if=[
@@ -445,7 +858,10 @@ def main():
         module.fail_json(msg=missing_required_lib("backports.tempfile"), exception=BACKPORTS_TEMPFILE_IMPORT_ERROR)
 
     try:
-        result = core(module)
+        if module.params['detach'] and not module.check_mode:
+            result = libvirt_utils.run_detached(module, core)
+        else:
+            result = core(module)
     except Exception as e:
         module.fail_json(msg=to_native(e), exception=traceback.format_exc())
     else:
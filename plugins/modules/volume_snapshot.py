@@ -42,7 +42,8 @@ options:
             - "Name of the new volume. For a disk pool, this must match the partition name as determined from the pool's
                source device path and the next available partition. For example, a source device path of /dev/sdb and
                there are no partitions on the disk, then the name must be sdb1 with the next name being sdb2 and so on."
-        required: true
+            - "Either I(name) or I(volumes) is required."
+        required: false
         type: str
     capacity:
         description:
@@ -84,12 +85,49 @@ options:
                only slightly higher initial disk space usage."
         required: false
         type: bool
+    reflink:
+        choices: [always, auto, never]
+        default: auto
+        description:
+            - "Create clones, i.e. volumes which are not I(linked), as lightweight copies which share their data with
+               I(backing_vol) until either is modified, like C(cp --reflink). Copies take milliseconds instead of
+               minutes then but require a filesystem with reflink support such as btrfs or XFS."
+            - "libvirt supports reflinks only for raw volumes in filesystem based storage pools and without
+               I(prealloc_metadata). With C(auto), reflinks are used if these conditions are met and if probing the
+               directory of the storage pool succeeds, which requires libvirt to run on the same host as this module.
+               With C(always), creating the clone fails if reflinks cannot be used."
+        required: false
+        type: str
     state:
         choices: [present, absent]
         default: present
         description:
             - "Should the volume be present or absent."
         type: str
+    detach:
+        default: false
+        description:
+            - "Create or delete volumes in a detached worker process and return immediately with a job id, instead of
+               waiting for e.g. full clones to finish. The job can be polled with module M(ansible.builtin.async_status)
+               which reports the number of bytes copied so far for each volume and the overall throughput, until it
+               returns the result of the module run."
+        required: false
+        type: bool
+    max_workers:
+        default: 1
+        description:
+            - "Maximum number of volumes from I(volumes) which are created or deleted in parallel."
+        required: false
+        type: int
+    volumes:
+        description:
+            - "List of volumes to create or delete in a single module run, instead of a single volume I(name).
+               Each item accepts the options I(name), I(capacity), I(format), I(backing_vol), I(backing_vol_format),
+               I(linked), I(prealloc_metadata) and I(reflink). Options which are not set for an item default to the module
+               options with the same name."
+        elements: dict
+        required: false
+        type: list
 
 notes:
   - "No modifications are applied to existing volumes; module is skipped if volume exists already."
@@ -113,17 +151,114 @@ EXAMPLES = r'''
     name: "clone.qcow2"
     backing_vol: "base_volume.qcow2"
     linked: false
+
+- name: Create snapshots for several virtual machines at once
+  jm1.libvirt.volume_snapshot:
+    pool: "default"
+    backing_vol: "base_volume.qcow2"
+    capacity: 20GB
+    volumes:
+    - name: "vm-1.qcow2"
+    - name: "vm-2.qcow2"
+    - name: "vm-3.qcow2"
+
+- name: Start full clones for several virtual machines without waiting for them
+  jm1.libvirt.volume_snapshot:
+    pool: "default"
+    backing_vol: "base_volume.qcow2"
+    linked: false
+    detach: true
+    max_workers: 20
+    volumes:
+    - name: "vm-1.qcow2"
+    - name: "vm-2.qcow2"
+    - name: "vm-3.qcow2"
+  register: clone_job
+
+- name: Wait for clones to finish
+  ansible.builtin.async_status:
+    jid: "{{ clone_job.ansible_job_id }}"
+  register: clone_result
+  until: clone_result.finished
+  retries: 360
+  delay: 10
 '''
 
 RETURN = r'''
+ansible_job_id:
+    description: Id of the job which creates or deletes the volumes, to be polled with M(ansible.builtin.async_status)
+    returned: if I(detach) is true
+    type: str
+    sample: 488359678239.2844
+
+results_file:
+    description: Path to the status file of the job
+    returned: if I(detach) is true
+    type: str
+    sample: /root/.ansible_async/488359678239.2844
+
+volumes:
+    description:
+      - "Results for each item of I(volumes), with the same keys as returned for a single volume."
+      - "Items which failed have keys I(failed) and I(msg) instead. Other items are processed anyway and the
+         module fails after all items have been processed."
+    returned: always if I(volumes) is set
+    type: list
+    elements: dict
 '''
 
 # NOTE: Synchronize imports with DOCUMENTATION string above and chapter Requirements in roles/server/README.md
 from ansible_collections.jm1.libvirt.plugins.module_utils import libvirt as libvirt_utils
 from ansible.module_utils._text import to_native
 from ansible.module_utils.basic import AnsibleModule, human_to_bytes
+from ansible.module_utils.six.moves.urllib.parse import urlsplit
+import fcntl
+import os
+import tempfile
 import traceback
 
+try:
+    from lxml import etree
+except ImportError:
+    # error handled in libvirt_utils.try_import() below
+    pass
+
+# ioctl request FICLONE from linux/fs.h which shares the data of a file with another file on e.g. btrfs and XFS
+FICLONE = 0x40049409
+
+
+def supports_reflink(path):
+    """ Return whether files in directory `path` can be cloned with reflinks """
+    try:
+        with tempfile.TemporaryFile(dir=path) as src, tempfile.TemporaryFile(dir=path) as dst:
+            src.write(b'\0' * 4096)
+            src.flush()
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return True
+    except (IOError, OSError):
+        return False
+
+
+def can_reflink(uri, conn, pool, volume_format, backing_volume_format, prealloc_metadata):
+    """ Return whether a clone of a volume in `pool` can be created with reflinks
+
+        libvirt supports reflinks for raw volumes in filesystem based pools only. The filesystem of the pool is probed
+        if libvirt runs on the same host as this module.
+    """
+    if volume_format != 'raw' or backing_volume_format != 'raw' or prealloc_metadata:
+        return False
+
+    if urlsplit(uri).hostname:
+        # pool directory is not accessible from this host
+        return False
+
+    pool_xml = etree.fromstring(conn.inventory.xml_desc(pool))
+    if pool_xml.get('type') not in ['dir', 'fs', 'netfs']:
+        return False
+
+    pool_path = pool_xml.findtext('target/path')
+    return bool(pool_path) and os.path.isdir(pool_path) and supports_reflink(pool_path)
+
 
 def snapshot(uri,
              pool_name,
@@ -134,13 +269,21 @@ def snapshot(uri,
              backing_volume_format,
              linked,
              prealloc_metadata,
+             reflink,
+             job,
              module):
     with libvirt_utils.Connection(uri, module) as conn:
-        pool = conn.storagePoolLookupByName(pool_name)
-        backing_volume = pool.storageVolLookupByName(backing_volume_name)
+        pool = conn.inventory.pool(pool_name)
+        if not pool:
+            raise ValueError('storage pool %s does not exist' % pool_name)
+
+        backing_volume = conn.inventory.volume(pool, backing_volume_name)
+        if not backing_volume:
+            raise ValueError('backing volume %s does not exist' % backing_volume_name)
 
         if not backing_volume_format:
-            backing_volume_format = libvirt_utils.lookup_attribute(backing_volume, '/volume/target/format', 'type')
+            backing_volume_format = libvirt_utils.lookup_attribute(backing_volume, '/volume/target/format', 'type',
+                                                                   conn.inventory)
 
             if not backing_volume_format:
                 raise ValueError('backing volume format not specified')
@@ -149,7 +292,7 @@ def snapshot(uri,
             volume_format = backing_volume_format
 
         # Get size of backing volume
-        backing_volume_type, backing_volume_capacity, backing_volume_allocation = backing_volume.info()
+        backing_volume_type, backing_volume_capacity, backing_volume_allocation = conn.inventory.info(backing_volume)
 
         if not volume_capacity:
             volume_capacity = backing_volume_capacity
@@ -158,10 +301,10 @@ def snapshot(uri,
         if volume_capacity < backing_volume_capacity:
             raise ValueError('volume size is smaller than backing volume size')
 
-        if volume_name in pool.listVolumes():
+        volume = conn.inventory.volume(pool, volume_name)
+        if volume:
             # volume exists already
-            volume = pool.storageVolLookupByName(volume_name)
-            volume_type, volume_capacity, volume_allocation = volume.info()
+            volume_type, volume_capacity, volume_allocation = conn.inventory.info(volume)
             return False, volume_capacity, volume_format
 
         if linked:
@@ -191,7 +334,7 @@ def snapshot(uri,
                 backing_volume_name=backing_volume_name,
                 backing_volume_format=backing_volume_format)
 
-            rc, stdout, stderr = module.run_command(cmd, check_rc=True)
+            stdout, stderr = libvirt_utils.run_command(module, cmd)
             return True, volume_capacity, volume_format
         else:  # not linked
             cmd = """
@@ -216,7 +359,7 @@ def snapshot(uri,
                 backing_volume_name=backing_volume_name,
                 backing_volume_format=backing_volume_format)
 
-            rc, stdout, stderr = module.run_command(cmd, check_rc=True)
+            stdout, stderr = libvirt_utils.run_command(module, cmd)
 
             # enum virStorageVolCreateFlags {
             #     VIR_STORAGE_VOL_CREATE_PREALLOC_METADATA = 1 (0x1; 1 << 0)
@@ -227,10 +370,26 @@ def snapshot(uri,
             flags = 0
             if prealloc_metadata:
                 flags |= 1
+            if reflink == 'auto':
+                use_reflink = can_reflink(uri, conn, pool, volume_format, backing_volume_format, prealloc_metadata)
+            else:
+                use_reflink = reflink == 'always'
+            if use_reflink:
+                flags |= 2
 
             volume_xml = stdout
 
-            volume = pool.createXMLFrom(volume_xml, backing_volume, flags)
+            if job:
+                # createXMLFrom blocks until the clone is complete, hence report its allocation while it is growing
+                watcher = libvirt_utils.watch_volume_allocation(
+                    pool, volume_name,
+                    lambda allocation: job.progress(volume_name, allocation, backing_volume_allocation))
+
+            try:
+                volume = pool.createXMLFrom(volume_xml, backing_volume, flags)
+            finally:
+                if job:
+                    watcher.set()
 
             # Cloning with createXMLFrom does not preserve the requested
             # capacity, hence we might have to growth the storage volume
@@ -240,6 +399,8 @@ def snapshot(uri,
                 volume.resize(volume_capacity)
 
             volume_type, volume_capacity, volume_allocation = volume.info()
+            if job:
+                job.progress(volume_name, volume_allocation, volume_allocation)
             return True, volume_capacity, volume_format
 
 
@@ -252,10 +413,10 @@ def delete(uri,
            backing_volume_format,
            linked,
            prealloc_metadata,
+           reflink,
            module):
     with libvirt_utils.Connection(uri, module) as conn:
-        pools = conn.listAllStoragePools()
-        pool = next((pool for pool in pools if pool.name() == pool_name), None)
+        pool = conn.inventory.pool(pool_name)
         if not pool:
             # pool absent already and hence volume as well
             return False, None, None
@@ -263,27 +424,33 @@ def delete(uri,
         if not volume_name:
             raise ValueError('name is required for deleting volumes')
 
-        if volume_name not in pool.listVolumes():
+        volume = conn.inventory.volume(pool, volume_name)
+        if not volume:
             # volume absent already
             return False, None, None
 
-        volume = pool.storageVolLookupByName(volume_name)
-        volume_type, volume_capacity, volume_allocation = volume.info()
+        volume_type, volume_capacity, volume_allocation = conn.inventory.info(volume)
         volume.delete()
+        conn.inventory.invalidate(volume)
         return True, volume_capacity, volume_format
 
 
-def core(module):
-    state = module.params['state']
-    uri = module.params['uri']
-    pool_name = module.params['pool']
-    volume_name = module.params['name']
-    volume_capacity = module.params['capacity']
-    volume_format = module.params['format']
-    backing_volume_name = module.params['backing_vol']
-    backing_volume_format = module.params['backing_vol_format']
-    linked = module.params['linked']
-    prealloc_metadata = module.params['prealloc_metadata']
+def reconcile(module,
+              state,
+              uri,
+              pool_name,
+              volume_name,
+              volume_capacity,
+              volume_format,
+              backing_volume_name,
+              backing_volume_format,
+              linked,
+              prealloc_metadata,
+              reflink,
+              job):
+
+    if state == 'present' and not backing_volume_name:
+        raise ValueError('backing_vol is required for creating volume %s' % volume_name)
 
     if not volume_format:
         volume_format = backing_volume_format
@@ -300,7 +467,8 @@ def core(module):
             backing_vol=backing_volume_name,
             backing_vol_format=backing_volume_format,
             linked=linked,
-            prealloc_metadata=prealloc_metadata)
+            prealloc_metadata=prealloc_metadata,
+            reflink=reflink)
 
     if state == 'present':
         changed, volume_capacity, volume_format = snapshot(
@@ -310,6 +478,8 @@ def core(module):
             backing_volume_name, backing_volume_format,
             linked,
             prealloc_metadata,
+            reflink,
+            job,
             module)
     elif state == 'absent':
         changed, volume_capacity, volume_format = delete(
@@ -319,6 +489,7 @@ def core(module):
             backing_volume_name, backing_volume_format,
             linked,
             prealloc_metadata,
+            reflink,
             module)
 
     return dict(
@@ -332,7 +503,47 @@ def core(module):
         backing_vol=backing_volume_name,
         backing_vol_format=backing_volume_format,
         linked=linked,
-        prealloc_metadata=prealloc_metadata)
+        prealloc_metadata=prealloc_metadata,
+        reflink=reflink)
+
+
+def core(module, job=None):
+    state = module.params['state']
+    uri = module.params['uri']
+    pool_name = module.params['pool']
+
+    volumes = libvirt_utils.list_params(
+        module,
+        'volumes',
+        ['name', 'capacity', 'format', 'backing_vol', 'backing_vol_format', 'linked', 'prealloc_metadata',
+         'reflink'])
+
+    def reconcile_volume(volume):
+        return reconcile(module,
+                         state,
+                         uri,
+                         pool_name,
+                         volume['name'],
+                         volume['capacity'],
+                         volume['format'],
+                         volume['backing_vol'],
+                         volume['backing_vol_format'],
+                         volume['linked'],
+                         volume['prealloc_metadata'],
+                         volume['reflink'],
+                         job)
+
+    if module.params['volumes'] is None:
+        return reconcile_volume(volumes[0])
+
+    results = libvirt_utils.map_items(reconcile_volume, volumes, module.params['max_workers'])
+
+    return libvirt_utils.fail_items(dict(
+        changed=any(result.get('changed', False) for result in results),
+        state=state,
+        uri=uri,
+        pool=pool_name,
+        volumes=results), 'volumes')
 
 
 def main():
@@ -340,28 +551,53 @@ def main():
         argument_spec=dict(
             state=dict(type='str', choices=['present', 'absent'], default='present'),
             uri=dict(default='qemu:///system'),
+            broker_dir=dict(type='path'),
             pool=dict(required=True, type='str'),
-            name=dict(required=True, type='str'),
+            name=dict(type='str'),
             capacity=dict(type='str'),
             format=dict(type='str'),
             backing_vol=dict(type='str'),
             backing_vol_format=dict(type='str'),
             linked=dict(type='bool', default=True),
-            prealloc_metadata=dict(type='bool', default=False)
+            prealloc_metadata=dict(type='bool', default=False),
+            reflink=dict(type='str', choices=['always', 'auto', 'never'], default='auto'),
+            max_workers=dict(type='int', default=1),
+            detach=dict(type='bool', default=False),
+            volumes=dict(
+                type='list',
+                elements='dict',
+                options=dict(
+                    name=dict(required=True, type='str'),
+                    capacity=dict(type='str'),
+                    format=dict(type='str'),
+                    backing_vol=dict(type='str'),
+                    backing_vol_format=dict(type='str'),
+                    linked=dict(type='bool'),
+                    prealloc_metadata=dict(type='bool'),
+                    reflink=dict(type='str', choices=['always', 'auto', 'never'])
+                ))
         ),
         supports_check_mode=True,
-        required_if=[
-            ['state', 'present', ['backing_vol']]
+        mutually_exclusive=[
+            ['name', 'volumes']
+        ],
+        required_one_of=[
+            ['name', 'volumes']
         ]
     )
 
     libvirt_utils.try_import(module)
 
     try:
-        result = core(module)
+        if module.params['detach'] and not module.check_mode:
+            result = libvirt_utils.run_detached(module, core)
+        else:
+            result = core(module)
     except Exception as e:
         module.fail_json(msg=to_native(e), exception=traceback.format_exc())
     else:
+        if result.get('failed'):
+            module.fail_json(**result)
         module.exit_json(**result)
 
 
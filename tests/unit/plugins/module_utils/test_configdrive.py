@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+# vim:set fileformat=unix shiftwidth=4 softtabstop=4 expandtab:
+# kate: end-of-line unix; space-indent on; indent-width 4; remove-trailing-spaces modified;
+
+# Copyright: (c) 2020, Jakob Meng <jakobmeng@web.de>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import io
+import struct
+
+import pytest
+
+from ansible_collections.jm1.libvirt.plugins.module_utils import configdrive as configdrive_utils
+
+USERDATA = '#cloud-config\nhostname: vm-1\n' + 'x' * 5000 + '\n'
+NETWORKCONFIG = 'version: 2\n'
+
+# files with names which do not fit into 8.3 names and with sizes which span several sectors and clusters
+FILES = [
+    ('meta-data', b'instance-id: vm-1\n'),
+    ('user-data', b'#cloud-config\n' + b'y' * 70000),
+    ('network-config', b''),
+    ('vendor-data.yaml.bak', b'#cloud-config\n'),
+]
+
+
+def read_iso(image):
+    """ Return dict of Joliet paths to file contents and the volume identifier of ISO 9660 image `image` """
+    pycdlib = pytest.importorskip('pycdlib')
+
+    iso = pycdlib.PyCdlib()
+    iso.open_fp(io.BytesIO(image))
+    try:
+        files = {}
+        for record in iso.list_children(joliet_path='/'):
+            if record.is_dot() or record.is_dotdot():
+                continue
+            name = record.file_identifier().decode('utf-16-be')
+            data = io.BytesIO()
+            iso.get_file_from_iso_fp(data, joliet_path='/' + name)
+            files[name] = data.getvalue()
+        return files, iso.pvd.volume_identifier.decode('ascii').rstrip()
+    finally:
+        iso.close()
+
+
+def read_vfat(image, tmp_path):
+    """ Return dict of long file names to file contents and the volume label of FAT image `image` """
+    PyFatFS = pytest.importorskip('pyfatfs.PyFatFS')
+
+    path = tmp_path / 'vfat.img'
+    path.write_bytes(bytes(image))
+    fs = PyFatFS.PyFatFS(str(path), read_only=True)
+    try:
+        return dict((name, fs.readbytes('/' + name)) for name in fs.listdir('/')), image[43:54].decode('ascii').rstrip()
+    finally:
+        fs.close()
+
+
+def marker_of(image, filesystem):
+    offset = configdrive_utils.MARKER_OFFSETS[filesystem]
+    return bytes(image[offset:offset + configdrive_utils.MARKER_SIZE])
+
+
+def test_iso_configdrive():
+    image = configdrive_utils.make_configdrive('iso', None, USERDATA, NETWORKCONFIG)
+    files, volume_id = read_iso(image)
+
+    assert volume_id == 'cidata'
+    assert files == {
+        'meta-data': configdrive_utils.DEFAULT_METADATA.encode(),
+        'user-data': USERDATA.encode(),
+        'network-config': NETWORKCONFIG.encode(),
+    }
+
+
+def test_vfat_configdrive(tmp_path):
+    image = configdrive_utils.make_configdrive('vfat', 'instance-id: vm-1\n', USERDATA, None)
+    files, volume_label = read_vfat(image, tmp_path)
+
+    assert volume_label == 'CIDATA'
+    assert files == {
+        'meta-data': b'instance-id: vm-1\n',
+        'user-data': USERDATA.encode(),
+    }
+
+
+def test_long_file_names(tmp_path):
+    assert read_iso(configdrive_utils.make_iso(FILES))[0] == dict(FILES)
+    assert read_vfat(configdrive_utils.make_vfat(FILES), tmp_path)[0] == dict(FILES)
+
+
+@pytest.mark.parametrize('filesystem', ['iso', 'vfat'])
+def test_marker(filesystem):
+    image = configdrive_utils.make_configdrive(filesystem, None, USERDATA, NETWORKCONFIG)
+    files = configdrive_utils.configdrive_files(None, USERDATA, NETWORKCONFIG)
+    marker = configdrive_utils.configdrive_marker(filesystem, files)
+
+    assert len(marker) == configdrive_utils.MARKER_SIZE
+    assert marker.startswith(configdrive_utils.MARKER_PREFIX)
+    assert marker_of(image, filesystem) == marker
+
+    other_files = configdrive_utils.configdrive_files(None, USERDATA + 'a: 1\n', NETWORKCONFIG)
+    assert configdrive_utils.configdrive_marker(filesystem, other_files) != marker
+
+
+def test_marker_locations():
+    # application identifier of the primary volume descriptor
+    image = configdrive_utils.make_iso(FILES)
+    assert image[16 * 2048:16 * 2048 + 6] == b'\x01CD001'
+    assert configdrive_utils.MARKER_OFFSETS['iso'] == 16 * 2048 + 574
+
+    # boot code area of the boot sector, behind the extended BIOS parameter block and before the boot signature
+    image = configdrive_utils.make_vfat(FILES)
+    assert image[510:512] == b'\x55\xaa'
+    assert 62 <= configdrive_utils.MARKER_OFFSETS['vfat']
+    assert configdrive_utils.MARKER_OFFSETS['vfat'] + configdrive_utils.MARKER_SIZE <= 510
+
+
+@pytest.mark.parametrize('filesystem', ['iso', 'vfat'])
+def test_template_render(filesystem, tmp_path):
+    capacities = [(name, len(data) + 3000) for name, data in FILES]
+    template = configdrive_utils.ConfigDriveTemplate(filesystem, capacities)
+
+    for files in [FILES, [(name, data[:len(data) // 3]) for name, data in FILES]]:
+        image = template.render(files)
+        if filesystem == 'iso':
+            assert read_iso(image)[0] == dict(files)
+        else:
+            assert read_vfat(image, tmp_path)[0] == dict(files)
+        assert marker_of(image, filesystem) == configdrive_utils.configdrive_marker(filesystem, files)
+
+
+def test_template_render_rejects_large_files():
+    template = configdrive_utils.ConfigDriveTemplate('vfat', [(name, len(data)) for name, data in FILES])
+    with pytest.raises(ValueError):
+        template.render([(name, data + b'z') for name, data in FILES])
+
+
+def test_fat12_cluster_count():
+    # FAT12 requires less than 4085 clusters
+    image = configdrive_utils.make_vfat(FILES)
+    bios_parameter_block = struct.unpack('<HBHBHH', image[11:21])
+    bytes_per_sector, sectors_per_cluster, reserved_sectors, fats, root_entries, total_sectors = bios_parameter_block
+    sectors_per_fat = struct.unpack('<H', image[22:24])[0]
+    data_sectors = total_sectors - reserved_sectors - fats * sectors_per_fat - root_entries * 32 // bytes_per_sector
+    assert data_sectors // sectors_per_cluster < 4085
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# vim:set fileformat=unix shiftwidth=4 softtabstop=4 expandtab:
+# kate: end-of-line unix; space-indent on; indent-width 4; remove-trailing-spaces modified;
+
+# Copyright: (c) 2020, Jakob Meng <jakobmeng@web.de>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+import socket
+import stat
+
+import pytest
+
+from ansible_collections.jm1.libvirt.plugins.module_utils import libvirt as libvirt_utils
+
+
+def mode_of(path):
+    return stat.S_IMODE(os.lstat(path).st_mode)
+
+
+def test_broker_dir_is_private(tmp_path):
+    path = str(tmp_path / 'broker')
+    libvirt_utils._make_private_dir(path)
+    assert mode_of(path) == 0o700
+
+    os.chmod(path, 0o777)
+    libvirt_utils._make_private_dir(path)
+    assert mode_of(path) == 0o700
+
+
+def test_broker_dir_must_be_directory(tmp_path):
+    (tmp_path / 'target').mkdir()
+    os.symlink(str(tmp_path / 'target'), str(tmp_path / 'link'))
+    with pytest.raises(Exception, match='not a directory owned by the current user'):
+        libvirt_utils._make_private_dir(str(tmp_path / 'link'))
+
+
+def test_owned_unix_socket(tmp_path):
+    path = str(tmp_path / 'tunnel.sock')
+    assert not libvirt_utils._owned_unix_socket(path)
+
+    with open(path, 'w'):
+        pass
+    assert not libvirt_utils._owned_unix_socket(path)
+    os.unlink(path)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.bind(path)
+        assert libvirt_utils._owned_unix_socket(path)
+    finally:
+        sock.close()
+
+
+@pytest.mark.parametrize('uri', ['qemu:///system', 'qemu+tcp://host/system', 'qemu+ssh://host/session'])
+def test_broker_uri_without_tunnel(tmp_path, uri):
+    assert libvirt_utils.broker_uri(uri, str(tmp_path / 'broker')) == uri
+    assert not os.path.exists(str(tmp_path / 'broker'))
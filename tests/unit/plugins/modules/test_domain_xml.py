@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+# vim:set fileformat=unix shiftwidth=4 softtabstop=4 expandtab:
+# kate: end-of-line unix; space-indent on; indent-width 4; remove-trailing-spaces modified;
+
+# Copyright: (c) 2020, Jakob Meng <jakobmeng@web.de>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import uuid
+
+import pytest
+
+libvirt = pytest.importorskip('libvirt')
+etree = pytest.importorskip('lxml.etree')
+
+from ansible_collections.jm1.libvirt.plugins.module_utils import libvirt as libvirt_utils  # noqa: E402
+from ansible_collections.jm1.libvirt.plugins.modules import domain_xml  # noqa: E402
+
+
+DOMAIN_XML = '''
+<domain type='kvm'>
+  <name>vm1</name>
+  <memory>1048576</memory>
+  <vcpu>2</vcpu>
+  <os>
+    <type arch='x86_64'>hvm</type>
+  </os>
+  <devices>
+    <disk type='file' device='disk'>
+      <source file='/var/lib/libvirt/images/vm1.qcow2'/>
+      <target dev='vda' bus='virtio'/>
+    </disk>
+    <disk type='file' device='cdrom'>
+      <source file='/var/lib/libvirt/images/vm1.iso'/>
+      <target dev='sda' bus='sata'/>
+    </disk>
+    <interface type='network'>
+      <source network='default'/>
+      <model type='virtio'/>
+    </interface>
+    <video>
+      <model type='virtio'/>
+    </video>
+    <video>
+      <model type='vga'/>
+    </video>
+  </devices>
+</domain>
+'''
+
+
+def complete(xml):
+    """ Add defaults to domain xml like libvirt does when a domain is defined """
+    root = etree.fromstring(xml, etree.XMLParser(remove_blank_text=True))
+    if root.find('uuid') is None:
+        etree.SubElement(root, 'uuid').text = str(uuid.uuid5(uuid.NAMESPACE_DNS, root.findtext('name')))
+    root.find('memory').set('unit', 'KiB')
+    if root.find('currentMemory') is None:
+        etree.SubElement(root, 'currentMemory', unit='KiB').text = root.find('memory').text
+    root.find('vcpu').set('placement', 'static')
+    root.find('os/type').set('machine', 'pc-q35-8.2')
+    if root.find('os/boot') is None:
+        etree.SubElement(root.find('os'), 'boot', dev='hd')
+    if root.find('resource') is None:
+        resource = etree.SubElement(root, 'resource')
+        etree.SubElement(resource, 'partition').text = '/machine'
+    if root.find('seclabel') is None:
+        etree.SubElement(root, 'seclabel', type='dynamic', model='selinux', relabel='yes')
+
+    devices = root.find('devices')
+    if devices.find('emulator') is None:
+        devices.insert(0, etree.Element('emulator'))
+        devices[0].text = '/usr/bin/qemu-system-x86_64'
+    slots = [int(address.get('slot'), 16) for address in devices.findall('*/address')]
+    for device in devices.findall('disk') + devices.findall('interface') + devices.findall('video'):
+        if device.find('address') is None:
+            slots.append(max(slots + [0]) + 1)
+            etree.SubElement(device, 'address', type='pci', domain='0x0000', bus='0x00', slot='0x%02x' % slots[-1],
+                             function='0x0')
+    for disk in devices.findall('disk'):
+        if disk.find('driver') is None:
+            disk.insert(0, etree.Element('driver', name='qemu', type='raw'))
+    for interface in devices.findall('interface'):
+        if interface.find('mac') is None:
+            interface.insert(0, etree.Element('mac', address='52:54:00:12:34:56'))
+    if not devices.findall('controller'):
+        devices.append(etree.Element('controller', type='usb', index='0', model='qemu-xhci'))
+        devices.append(etree.Element('controller', type='pci', index='0', model='pcie-root'))
+    if devices.find('input') is None:
+        devices.append(etree.Element('input', type='mouse', bus='ps2'))
+    if devices.find('memballoon') is None:
+        devices.append(etree.Element('memballoon', model='virtio'))
+    return etree.tostring(root).decode()
+
+
+class NoDomainError(libvirt.libvirtError):
+
+    def __init__(self, name):
+        Exception.__init__(self, "Domain not found: no domain with matching name '%s'" % name)
+
+    def get_error_code(self):
+        return libvirt.VIR_ERR_NO_DOMAIN
+
+
+class Domain(libvirt.virDomain):
+
+    def __init__(self, conn, xml):
+        self.conn = conn
+        self.xml = xml
+
+    def name(self):
+        return etree.fromstring(self.xml).findtext('name')
+
+    def UUIDString(self):
+        return etree.fromstring(self.xml).findtext('uuid')
+
+    def XMLDesc(self, flags=0):
+        return self.xml
+
+    def undefine(self):
+        del self.conn.domains[self.name()]
+
+
+class Connection(object):
+
+    def __init__(self):
+        self.domains = {}
+        self.defined = 0
+        self.calls = []
+
+    def isAlive(self):
+        return 1
+
+    def close(self):
+        pass
+
+    def defineXML(self, xml):
+        self.defined += 1
+        self.defined_xml = xml
+        domain = Domain(self, complete(xml))
+        self.domains[domain.name()] = domain
+        return domain
+
+    def listAllDomains(self, flags=0):
+        self.calls.append('listAllDomains')
+        return list(self.domains.values())
+
+    def lookupByName(self, name):
+        self.calls.append('lookupByName')
+        if name not in self.domains:
+            raise NoDomainError(name)
+        return self.domains[name]
+
+
+class Module(object):
+    check_mode = False
+    _diff = False
+
+    def __init__(self, **params):
+        self.params = dict(compare='subset', ignore=['/domain/uuid'], state='present', uri='test:///fake',
+                           broker_dir=None, xml=None, xmls=None)
+        self.params.update(params)
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    conn = Connection()
+    monkeypatch.setattr(libvirt, 'open', lambda uri: conn, raising=False)
+    libvirt_utils.connection_pool.close()
+    yield conn
+    libvirt_utils.connection_pool.close()
+
+
+def test_second_run_is_unchanged(conn):
+    assert domain_xml.core(Module(xml=DOMAIN_XML))['changed'] is True
+    result = domain_xml.core(Module(xml=DOMAIN_XML))
+    assert result['changed'] is False
+    assert conn.defined == 1
+
+
+def test_full_compare_reports_defaults(conn):
+    domain_xml.core(Module(xml=DOMAIN_XML))
+    assert domain_xml.core(Module(xml=DOMAIN_XML, compare='full'))['changed'] is True
+
+
+@pytest.mark.parametrize('old, new, path', [
+    ("<model type='vga'/>", "<model type='qxl'/>", '/domain/devices/video[2]/model'),
+    ("<vcpu>2</vcpu>", "<vcpu>4</vcpu>", '/domain/vcpu'),
+])
+def test_changes_are_applied(conn, old, new, path):
+    domain_xml.core(Module(xml=DOMAIN_XML))
+    result = domain_xml.core(Module(xml=DOMAIN_XML.replace(old, new)))
+    assert result['changed'] is True
+    assert path in result['changes']['changed']
+    assert conn.defined == 2
+
+
+def test_reordered_video_devices_are_applied(conn):
+    domain_xml.core(Module(xml=DOMAIN_XML))
+    xml = DOMAIN_XML.replace("<model type='virtio'/>\n    </video>", "<model type='tmp'/>\n    </video>")
+    xml = xml.replace("<model type='vga'/>", "<model type='virtio'/>")
+    xml = xml.replace("<model type='tmp'/>", "<model type='vga'/>")
+    assert domain_xml.core(Module(xml=xml))['changed'] is True
+
+
+def test_removed_disk_is_applied(conn):
+    domain_xml.core(Module(xml=DOMAIN_XML))
+    root = etree.fromstring(DOMAIN_XML)
+    devices = root.find('devices')
+    devices.remove(devices.findall('disk')[1])
+    result = domain_xml.core(Module(xml=etree.tostring(root).decode()))
+    assert result['changed'] is True
+    assert result['changes']['removed'] == ['/domain/devices/disk[2]']
+
+
+def test_xmls_are_listed_once(conn):
+    xmls = [DOMAIN_XML.replace('<name>vm1</name>', '<name>vm%d</name>' % i) for i in range(1, 4)]
+    domain_xml.core(Module(xmls=xmls[:2]))
+
+    # each module run starts with an empty inventory
+    libvirt_utils.connection_pool.close()
+    conn.calls = []
+    result = domain_xml.core(Module(xmls=xmls))
+    assert [item['changed'] for item in result['xmls']] == [False, False, True]
+    assert conn.calls == ['listAllDomains']
+
+    libvirt_utils.connection_pool.close()
+    conn.calls = []
+    result = domain_xml.core(Module(xmls=xmls, state='absent'))
+    assert [item['changed'] for item in result['xmls']] == [True, True, True]
+    assert conn.calls == ['listAllDomains']
+    assert conn.domains == {}
+
+
+def test_changes_are_merged_into_existing_config(conn):
+    domain_xml.core(Module(xml=DOMAIN_XML))
+    old_root = etree.fromstring(conn.domains['vm1'].xml)
+
+    result = domain_xml.core(Module(xml=DOMAIN_XML.replace("<model type='vga'/>", "<model type='qxl'/>")))
+    assert result['changes']['changed'] == ['/domain/devices/video[2]/model']
+
+    # defaults which libvirt added to the existing domain are passed to libvirt again
+    defined_root = etree.fromstring(conn.defined_xml)
+    for xpath in ['uuid', 'currentMemory', 'resource', 'seclabel', 'devices/emulator', 'devices/disk/driver',
+                  'devices/interface/mac', 'devices/controller', 'devices/input', 'devices/memballoon']:
+        assert len(defined_root.findall(xpath)) == len(old_root.findall(xpath)) > 0, xpath
+    assert [etree.tostring(address) for address in defined_root.iterfind('devices/*/address')] == \
+        [etree.tostring(address) for address in old_root.iterfind('devices/*/address')]
+    assert defined_root.find('os/type').get('machine') == 'pc-q35-8.2'
+    assert [model.get('type') for model in defined_root.iterfind('devices/video/model')] == ['virtio', 'qxl']
+
+    assert domain_xml.core(Module(xml=DOMAIN_XML.replace("<model type='vga'/>", "<model type='qxl'/>")))['changed'] \
+        is False
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+# vim:set fileformat=unix shiftwidth=4 softtabstop=4 expandtab:
+# kate: end-of-line unix; space-indent on; indent-width 4; remove-trailing-spaces modified;
+
+# Copyright: (c) 2020, Jakob Meng <jakobmeng@web.de>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import re
+
+import pytest
+
+libvirt = pytest.importorskip('libvirt')
+
+from ansible_collections.jm1.libvirt.plugins.module_utils import configdrive as configdrive_utils  # noqa: E402
+from ansible_collections.jm1.libvirt.plugins.module_utils import libvirt as libvirt_utils  # noqa: E402
+from ansible_collections.jm1.libvirt.plugins.modules import volume_cloudinit  # noqa: E402
+
+
+USERDATA = '#cloud-config\nhostname: vm-1\n'
+
+
+class NoVolumeError(libvirt.libvirtError):
+
+    def __init__(self, name):
+        Exception.__init__(self, "Storage volume not found: no storage vol with matching name '%s'" % name)
+
+    def get_error_code(self):
+        return libvirt.VIR_ERR_NO_STORAGE_VOL
+
+
+class Stream(object):
+
+    def __init__(self):
+        self.volume = None
+        self.data = b''
+
+    def send(self, data):
+        self.data += bytes(data)
+        return len(data)
+
+    def recv(self, length):
+        data, self.data = self.data[:length], self.data[length:]
+        return data
+
+    def finish(self):
+        if self.volume is not None:
+            self.volume.data = self.data
+
+    def abort(self):
+        pass
+
+
+class Volume(libvirt.virStorageVol):
+
+    def __init__(self, pool, name, data=b''):
+        self.pool = pool
+        self._name = name
+        self.data = data
+
+    def name(self):
+        return self._name
+
+    def key(self):
+        return '/var/lib/libvirt/images/' + self._name
+
+    def info(self):
+        return (0, len(self.data), len(self.data))
+
+    def upload(self, stream, offset, length, flags=0):
+        stream.volume = self
+
+    def download(self, stream, offset, length, flags=0):
+        stream.data = self.data[offset:offset + length]
+
+    def delete(self, flags=0):
+        del self.pool.volumes[self._name]
+
+
+class Pool(libvirt.virStoragePool):
+
+    def __init__(self):
+        self.volumes = {}
+
+    def name(self):
+        return 'default'
+
+    def storageVolLookupByName(self, name):
+        if name not in self.volumes:
+            raise NoVolumeError(name)
+        return self.volumes[name]
+
+    def createXML(self, xml, flags=0):
+        volume = Volume(self, re.search('<name>(.*)</name>', xml).group(1))
+        self.volumes[volume.name()] = volume
+        return volume
+
+
+class Connection(object):
+
+    def __init__(self):
+        self.storage_pool = Pool()
+
+    def isAlive(self):
+        return 1
+
+    def close(self):
+        pass
+
+    def newStream(self, flags=0):
+        return Stream()
+
+    def storagePoolLookupByName(self, name):
+        return self.storage_pool
+
+
+class Module(object):
+    check_mode = False
+    _diff = False
+
+    def __init__(self, **params):
+        self.params = dict(state='present', uri='test:///fake', broker_dir=None, pool='default', name='vm-1_cidata',
+                           format='raw', filesystem='iso', metadata=None, userdata=USERDATA, networkconfig=None,
+                           template=False, force=False, max_workers=1, volumes=None)
+        self.params.update(params)
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    conn = Connection()
+    monkeypatch.setattr(libvirt, 'open', lambda uri: conn, raising=False)
+    libvirt_utils.connection_pool.close()
+    yield conn
+    libvirt_utils.connection_pool.close()
+
+
+def filesystem_of(data):
+    # ISO 9660 images have a primary volume descriptor at sector 16, FAT images have a boot sector signature instead
+    return 'iso' if data[16 * 2048 + 1:16 * 2048 + 6] == b'CD001' else 'vfat'
+
+
+def test_second_run_is_unchanged(conn):
+    assert volume_cloudinit.core(Module())['changed'] is True
+    assert volume_cloudinit.core(Module())['changed'] is False
+
+
+@pytest.mark.parametrize('old, new', [('iso', 'vfat'), ('vfat', 'iso')])
+def test_changed_filesystem_is_applied(conn, old, new):
+    volume_cloudinit.core(Module(filesystem=old))
+    assert filesystem_of(conn.storage_pool.volumes['vm-1_cidata'].data) == old
+
+    assert volume_cloudinit.core(Module(filesystem=new))['changed'] is True
+    assert filesystem_of(conn.storage_pool.volumes['vm-1_cidata'].data) == new
+    assert volume_cloudinit.core(Module(filesystem=new))['changed'] is False
+
+
+def test_foreign_volume_is_kept(conn):
+    # config drive without marker like images created by cloud-localds
+    data = bytearray(configdrive_utils.make_configdrive('iso', None, USERDATA, None))
+    offset = configdrive_utils.MARKER_OFFSETS['iso']
+    data[offset:offset + configdrive_utils.MARKER_SIZE] = b' ' * configdrive_utils.MARKER_SIZE
+    conn.storage_pool.volumes['vm-1_cidata'] = Volume(conn.storage_pool, 'vm-1_cidata', bytes(data))
+
+    assert volume_cloudinit.core(Module())['changed'] is False
+    assert conn.storage_pool.volumes['vm-1_cidata'].data == bytes(data)
+
+    assert volume_cloudinit.core(Module(force=True))['changed'] is True
+    assert conn.storage_pool.volumes['vm-1_cidata'].data != bytes(data)